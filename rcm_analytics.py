@@ -0,0 +1,300 @@
+"""Portfolio analytics over the assets of one or more projects
+
+Analytics are kept as mergeable partial results: the counts, sums, histograms and top-k lists of
+one partition of assets can be merged with those of any other partition. Large portfolios are
+split into partitions that are analysed in a process pool. Each worker receives a compact payload
+with only the fields the analytics read (no effects text, functions or components) and returns
+its partial result, so little data crosses process boundaries in either direction.
+
+The risk heat map keeps the consequence and likelihood ratings of every failure mode, before and
+after its task, in NumPy arrays, so that the 5x5 counts, the before/after migration between risk
+levels and the failure modes in a cell are vectorised operations.
+"""
+import heapq
+import os
+from collections import Counter
+
+import numpy as np
+
+RISK_LEVELS = ('High', 'Moderate', 'Low')
+MAX_RISK_SCORE = 10
+DEFAULT_TOP_K = 10
+
+# Portfolios with fewer failure modes are analysed in this process; below this the time spent
+# sending payloads to the workers is larger than the time saved
+PARALLEL_MIN_FAILURE_MODES = 20000
+
+# Compact Payload Functions
+def compact_asset(asset):
+    """The fields of an asset that the analytics read, as plain tuples
+
+    Returns (asset name, asset class, modes) with one tuple per failure mode: (id, component,
+    description, consequence category, risk score, risk level, post-task risk score, post-task
+    risk level, task type, task cost, failure cost). Task fields are None without a task.
+    """
+    modes = []
+    for mode in asset.get('failure_modes', []):
+        risk = mode.get('risk_assessment') or {}
+        task = mode.get('management_task') or {}
+        post_risk = task.get('post_risk_assessment') or {}
+        modes.append((mode.get('id', ''), mode.get('component', ''), mode.get('description', ''),
+                      mode.get('consequence_category', ''), risk.get('risk_score'), risk.get('risk_level', ''),
+                      post_risk.get('risk_score'), post_risk.get('risk_level'),
+                      task.get('task_type') if task else None, task.get('cost', 0) or 0 if task else None,
+                      task.get('failure_cost', 0) or 0 if task else None))
+    return (asset.get('asset_name', ''), asset.get('asset_class', ''), tuple(modes))
+
+def partition(items, count):
+    """Split a list into count contiguous parts of nearly equal size"""
+    size, extra = divmod(len(items), count)
+    parts = []
+    start = 0
+    for position in range(count):
+        end = start + size + (1 if position < extra else 0)
+        if end > start:
+            parts.append(items[start:end])
+        start = end
+    return parts
+
+# Partial Result Functions
+def empty_analytics():
+    """Partial result of no assets"""
+    return {
+        'assets': 0,
+        'failure_modes': 0,
+        'tasks': 0,
+        'task_cost': 0,
+        'failure_cost': 0,
+        'risk_levels': Counter(),
+        'residual_risk_levels': Counter(),
+        'risk_score_histogram': [0] * (MAX_RISK_SCORE + 1),
+        'residual_risk_score_histogram': [0] * (MAX_RISK_SCORE + 1),
+        'consequence_categories': Counter(),
+        'task_type_counts': Counter(),
+        'task_type_costs': Counter(),
+        'asset_class_counts': Counter(),
+        'asset_class_costs': Counter(),
+        'top_risks': []
+    }
+
+def _histogram_bin(score):
+    """Histogram position of a risk score, or None if it is not a score"""
+    if isinstance(score, (int, float)) and not isinstance(score, bool):
+        return min(max(int(score), 0), MAX_RISK_SCORE)
+    return None
+
+def analyse_partition(compact_assets, top_k=DEFAULT_TOP_K):
+    """Partial result of a list of compact assets (see compact_asset)
+
+    Residual risk is the post-task risk of a failure mode where its task has one, and its
+    current risk otherwise. Top risks are (score, asset name, failure mode id, component,
+    description, risk level), highest score first.
+    """
+    result = empty_analytics()
+    histogram = result['risk_score_histogram']
+    residual_histogram = result['residual_risk_score_histogram']
+    top_risks = []
+    for asset_name, asset_class, modes in compact_assets:
+        result['assets'] += 1
+        result['asset_class_counts'][asset_class] += 1
+        result['failure_modes'] += len(modes)
+        for (mode_id, component, description, consequence, score, level, post_score, post_level,
+             task_type, cost, failure_cost) in modes:
+            result['consequence_categories'][consequence] += 1
+            if level:
+                result['risk_levels'][level] += 1
+                result['residual_risk_levels'][post_level or level] += 1
+            position = _histogram_bin(score)
+            if position is not None:
+                histogram[position] += 1
+                residual_position = _histogram_bin(post_score)
+                residual_histogram[position if residual_position is None else residual_position] += 1
+                top_risks.append((score, asset_name, mode_id, component, description, level))
+            if task_type is not None:
+                result['tasks'] += 1
+                result['task_cost'] += cost
+                result['failure_cost'] += failure_cost
+                result['task_type_counts'][task_type] += 1
+                result['task_type_costs'][task_type] += cost
+                result['asset_class_costs'][asset_class] += cost
+    result['top_risks'] = heapq.nlargest(top_k, top_risks, key=lambda risk: risk[0])
+    return result
+
+def merge_analytics(partials, top_k=DEFAULT_TOP_K):
+    """Merge partial results in order; the result is the same as analysing all their assets at once"""
+    merged = empty_analytics()
+    top_risks = []
+    for partial in partials:
+        for key, value in partial.items():
+            if key == 'top_risks':
+                top_risks.extend(value)
+            elif isinstance(value, Counter):
+                merged[key].update(value)
+            elif isinstance(value, list):
+                merged[key] = [total + count for total, count in zip(merged[key], value)]
+            else:
+                merged[key] += value
+    merged['top_risks'] = heapq.nlargest(top_k, top_risks, key=lambda risk: risk[0])
+    return merged
+
+def compute_portfolio_analytics(compact_assets, executor=None, workers=None, top_k=DEFAULT_TOP_K):
+    """Analytics of a list of compact assets, partitioned across an executor's workers for large portfolios
+
+    executor is a concurrent.futures executor (normally a ProcessPoolExecutor) with workers
+    workers (default: one per CPU); without one, or for fewer than PARALLEL_MIN_FAILURE_MODES
+    failure modes, the assets are analysed here. Callers that analyse the same assets repeatedly
+    should keep the compact assets, so that only changed assets are compacted again.
+    """
+    failure_mode_count = sum(len(modes) for _, _, modes in compact_assets)
+    workers = (workers or os.cpu_count() or 1) if executor is not None else 1
+    if workers <= 1 or failure_mode_count < PARALLEL_MIN_FAILURE_MODES:
+        return analyse_partition(compact_assets, top_k)
+    # A few partitions per worker keep the workers busy when asset sizes differ
+    parts = partition(compact_assets, min(len(compact_assets), workers * 4))
+    return merge_analytics(executor.map(analyse_partition, parts, [top_k] * len(parts)), top_k)
+
+# Report Row Functions
+def task_type_rows(analytics):
+    """One row per task type: number of tasks and annual cost, most frequent first"""
+    return [{'Task Type': task_type, 'Tasks': count, 'Annual Cost ($)': analytics['task_type_costs'][task_type]}
+            for task_type, count in analytics['task_type_counts'].most_common()]
+
+def top_risk_rows(analytics):
+    """One row per top risk, highest score first"""
+    return [{'Asset Name': asset_name, 'Failure Mode ID': mode_id, 'Component': component,
+             'Failure Mode': description, 'Risk Score': score, 'Risk Level': level}
+            for score, asset_name, mode_id, component, description, level in analytics['top_risks']]
+
+def risk_score_rows(analytics):
+    """One row per risk score: failure modes at that score now and after their tasks"""
+    return [{'Risk Score': score, 'Current': count, 'After Tasks': residual}
+            for score, (count, residual) in enumerate(zip(analytics['risk_score_histogram'],
+                                                          analytics['residual_risk_score_histogram']))
+            if count or residual]
+
+# Risk Heat Map Functions
+RATING_COUNT = 5
+
+def _rating_number(value):
+    """The number of a rating such as '3-Occasional', or 0 if it is not rated"""
+    text = str(value or '')
+    return int(text[0]) if text[:1] in ('1', '2', '3', '4', '5') else 0
+
+def risk_rating_array(asset):
+    """Ratings of an asset's failure modes as an int8 array with one row per failure mode
+
+    The columns are consequence, likelihood, post-task consequence and post-task likelihood;
+    0 means not rated.
+    """
+    rows = []
+    for mode in asset.get('failure_modes', []):
+        risk = mode.get('risk_assessment') or {}
+        post_risk = (mode.get('management_task') or {}).get('post_risk_assessment') or {}
+        rows.append((_rating_number(risk.get('consequence')), _rating_number(risk.get('likelihood')),
+                     _rating_number(post_risk.get('consequence')), _rating_number(post_risk.get('likelihood'))))
+    return np.array(rows, dtype=np.int8).reshape(-1, 4)
+
+def combine_rating_arrays(rating_arrays):
+    """Stack the rating arrays of a list of assets
+
+    Returns (ratings, asset index, mode position): row i of ratings is failure mode
+    mode_position[i] of asset asset_index[i].
+    """
+    lengths = np.array([len(ratings) for ratings in rating_arrays], dtype=np.int64)
+    ratings = np.concatenate(rating_arrays) if rating_arrays else np.zeros((0, 4), dtype=np.int8)
+    asset_index = np.repeat(np.arange(len(rating_arrays)), lengths)
+    mode_position = np.arange(len(ratings)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return ratings, asset_index, mode_position
+
+def residual_ratings(ratings):
+    """(consequence, likelihood) columns after tasks: the post-task ratings where a task has them"""
+    has_post_risk = (ratings[:, 2] > 0) & (ratings[:, 3] > 0)
+    return np.where(has_post_risk[:, None], ratings[:, 2:4], ratings[:, 0:2])
+
+def risk_heat_map(consequence_likelihood):
+    """5x5 counts of failure modes; row = likelihood - 1, column = consequence - 1. Unrated modes are skipped"""
+    consequence = consequence_likelihood[:, 0].astype(np.int64)
+    likelihood = consequence_likelihood[:, 1].astype(np.int64)
+    rated = (consequence > 0) & (likelihood > 0)
+    cells = (likelihood[rated] - 1) * RATING_COUNT + consequence[rated] - 1
+    return np.bincount(cells, minlength=RATING_COUNT * RATING_COUNT).reshape(RATING_COUNT, RATING_COUNT)
+
+def risk_level_grid(moderate_threshold, high_threshold):
+    """5x5 risk level of each heat map cell: 0 = Low, 1 = Moderate, 2 = High"""
+    scores = np.add.outer(np.arange(1, RATING_COUNT + 1), np.arange(1, RATING_COUNT + 1))
+    return (scores >= moderate_threshold).astype(np.int64) + (scores >= high_threshold)
+
+def risk_migration(ratings, moderate_threshold, high_threshold):
+    """3x3 counts of rated failure modes by risk level before (rows) and after tasks (columns), Low first"""
+    residual = residual_ratings(ratings).astype(np.int64)
+    rated = (ratings[:, 0] > 0) & (ratings[:, 1] > 0)
+    levels = risk_level_grid(moderate_threshold, high_threshold)
+    before = levels[ratings[rated, 1].astype(np.int64) - 1, ratings[rated, 0].astype(np.int64) - 1]
+    after = levels[residual[rated, 1] - 1, residual[rated, 0] - 1]
+    migration = np.zeros((3, 3), dtype=np.int64)
+    np.add.at(migration, (before, after), 1)
+    return migration
+
+def risk_cell_rows(ratings, consequence, likelihood, after_tasks=False):
+    """Row positions of the failure modes in one heat map cell"""
+    cell = residual_ratings(ratings) if after_tasks else ratings[:, 0:2]
+    return np.flatnonzero((cell[:, 0] == consequence) & (cell[:, 1] == likelihood))
+
+# Risk Reduction Functions
+def task_cost_array(asset):
+    """Annual task cost of each of an asset's failure modes as a float array; NaN without a task"""
+    costs = [(mode['management_task'].get('cost', 0) or 0) if mode.get('management_task') else np.nan
+             for mode in asset.get('failure_modes', [])]
+    return np.array(costs, dtype=np.float64)
+
+def compute_risk_reduction(ratings, task_costs, asset_index, asset_count, moderate_threshold, high_threshold):
+    """Risk reduction of every failure mode's task, summed per asset and for the project
+
+    The reduction of a failure mode is its risk score minus its score after its task (see
+    residual_ratings); unrated failure modes have no reduction. Levels are 0 = Low, 1 = Moderate,
+    2 = High and -1 for unrated modes. Per-asset arrays are indexed by asset position; 'task_cost'
+    is the cost of the tasks that reduce risk.
+    """
+    rated = (ratings[:, 0] > 0) & (ratings[:, 1] > 0)
+    residual = residual_ratings(ratings).astype(np.int64)
+    score_before = np.where(rated, ratings[:, 0].astype(np.int64) + ratings[:, 1], 0)
+    score_after = np.where(rated, residual[:, 0] + residual[:, 1], 0)
+    reduction = score_before - score_after
+
+    levels = risk_level_grid(moderate_threshold, high_threshold)
+    level_before = np.full(len(ratings), -1, dtype=np.int64)
+    level_after = np.full(len(ratings), -1, dtype=np.int64)
+    level_before[rated] = levels[ratings[rated, 1].astype(np.int64) - 1, ratings[rated, 0].astype(np.int64) - 1]
+    level_after[rated] = levels[residual[rated, 1] - 1, residual[rated, 0] - 1]
+
+    reducing = reduction > 0
+    reducing_cost = np.where(reducing, np.nan_to_num(task_costs), 0.0)
+    by_asset = {
+        'modes_reduced': np.bincount(asset_index[reducing], minlength=asset_count),
+        'levels_reduced': np.bincount(asset_index[level_after < level_before], minlength=asset_count),
+        'score_before': np.bincount(asset_index, weights=score_before, minlength=asset_count),
+        'reduction': np.bincount(asset_index, weights=reduction, minlength=asset_count),
+        'task_cost': np.bincount(asset_index, weights=reducing_cost, minlength=asset_count)
+    }
+    return {
+        'score_before': score_before,
+        'score_after': score_after,
+        'reduction': reduction,
+        'level_before': level_before,
+        'level_after': level_after,
+        'by_asset': by_asset,
+        'totals': {key: values.sum() for key, values in by_asset.items()}
+    }
+
+def reduction_per_cost(reduction, cost):
+    """Risk score reduction per dollar; tasks without cost that reduce risk are infinitely cost-effective"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(cost > 0, reduction / np.where(cost > 0, cost, 1), np.where(reduction > 0, np.inf, 0.0))
+
+def rank_cost_effective_tasks(risk_reduction, task_costs, top_n=20):
+    """Row positions of the tasks that reduce risk, most reduction per dollar first (ties: larger reduction first)"""
+    reduction = risk_reduction['reduction']
+    candidates = np.flatnonzero((reduction > 0) & ~np.isnan(task_costs))
+    efficiency = reduction_per_cost(reduction[candidates], task_costs[candidates])
+    order = np.lexsort((-reduction[candidates], -efficiency))
+    return candidates[order[:top_n]]
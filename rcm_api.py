@@ -0,0 +1,309 @@
+"""Read-only REST/JSON API over the project workspace
+
+Serves the projects saved to the workspace (see "Projects" in the app sidebar) so that other
+systems, e.g. a CMMS, can pull assets, failure modes and approved maintenance tasks:
+
+    GET /projects                              ?q=
+    GET /projects/<key>
+    GET /projects/<key>/assets                 ?q= &asset_class= &site_location=
+    GET /projects/<key>/failure-modes          ?asset= &component= &consequence= &q=
+    GET /projects/<key>/tasks                  ?asset= &task_type= &q=
+
+List endpoints take ?page= and ?page_size= (default 50, at most 500). Responses carry an ETag
+derived from the workspace files they are read from, so a polling client that sends If-None-Match
+gets 304 Not Modified without the project being read; bodies are gzip-compressed when accepted.
+
+    python rcm_api.py [--host 127.0.0.1] [--port 8502] [--workspace workspace]
+
+Settings come from the [API] and [Workspace] sections of config.ini. If [API] api_token is set,
+requests must send "Authorization: Bearer <token>".
+"""
+import argparse
+import configparser
+import gzip
+import hashlib
+import hmac
+import json
+import math
+import os
+import sys
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from urllib.parse import urlsplit, parse_qs
+
+from rcm_data import parse_project_data, flatten_failure_mode
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+GZIP_MIN_BYTES = 1024
+PROJECT_CACHE_ENTRIES = 8
+
+def load_api_config():
+    """Read the API and workspace settings from config.ini"""
+    config = configparser.ConfigParser()
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    config.read(os.path.join(base_dir, 'config.ini'))
+    workspace_path = config.get('Workspace', 'workspace_path', fallback='workspace')
+    if not os.path.isabs(workspace_path):
+        workspace_path = os.path.join(base_dir, workspace_path)
+    return {
+        'WORKSPACE_PATH': workspace_path,
+        'HOST': config.get('API', 'host', fallback='127.0.0.1'),
+        'PORT': config.getint('API', 'port', fallback=8502),
+        'API_TOKEN': config.get('API', 'api_token', fallback='')
+    }
+
+# Project Store Functions
+class ProjectStore:
+    """Reads workspace projects, keeping the most recently used ones parsed in memory
+
+    A project is re-read only when its file's size or modification time changes.
+    """
+
+    def __init__(self, workspace_path, max_entries=PROJECT_CACHE_ENTRIES):
+        self.workspace_path = workspace_path
+        self.max_entries = max_entries
+        self._projects = OrderedDict()
+        self._lock = Lock()
+
+    def file_signature(self, file_name):
+        """(size, modification time) of a workspace file, or None if it does not exist"""
+        try:
+            stat = os.stat(os.path.join(self.workspace_path, file_name))
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def load_catalogue(self):
+        """The workspace catalogue: {project key: header}"""
+        try:
+            with open(os.path.join(self.workspace_path, 'catalogue.json'), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def load_project(self, file_name):
+        """Parsed project {project_data, assets} of a workspace file, or None if it does not exist"""
+        signature = self.file_signature(file_name)
+        if signature is None:
+            return None
+        with self._lock:
+            cached = self._projects.get(file_name)
+            if cached is not None and cached[0] == signature:
+                self._projects.move_to_end(file_name)
+                return cached[1]
+        with open(os.path.join(self.workspace_path, file_name), 'r') as f:
+            project = parse_project_data(json.load(f))
+        with self._lock:
+            self._projects[file_name] = (signature, project)
+            self._projects.move_to_end(file_name)
+            while len(self._projects) > self.max_entries:
+                self._projects.popitem(last=False)
+        return project
+
+# Response Building Functions
+class ApiError(Exception):
+    """An error returned to the client as {"error": message} with an HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def paginate(items, query):
+    """One page of a list: {items, page, page_size, total, pages}"""
+    try:
+        page_size = min(max(int(query.get('page_size', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        page = max(int(query.get('page', 1)), 1)
+    except ValueError:
+        raise ApiError(400, "page and page_size must be integers")
+    start = (page - 1) * page_size
+    return {
+        'items': items[start:start + page_size],
+        'page': page,
+        'page_size': page_size,
+        'total': len(items),
+        'pages': max(math.ceil(len(items) / page_size), 1)
+    }
+
+def matches_text(query, *values):
+    """Case-insensitive substring match of ?q= against any of the values (always true without q)"""
+    search_text = query.get('q', '').strip().lower()
+    return not search_text or any(search_text in str(value).lower() for value in values)
+
+def summarize_asset(position, asset):
+    """Asset header with record counts, without the analysis itself"""
+    return {
+        'asset': position + 1,
+        'asset_name': asset.get('asset_name', ''),
+        'asset_class': asset.get('asset_class', ''),
+        'asset_type': asset.get('asset_type', ''),
+        'site_location': asset.get('site_location', ''),
+        'components': len(asset.get('components', [])),
+        'functions': len(asset.get('functions', [])),
+        'functional_failures': len(asset.get('functional_failures', [])),
+        'failure_modes': len(asset.get('failure_modes', [])),
+        'tasks': len(asset.get('analysis_results', []))
+    }
+
+def select_assets(project, query):
+    """(position, asset) pairs of a project, limited to ?asset= (1-based position or exact name) if given"""
+    assets = list(enumerate(project.get('assets', [])))
+    selected = query.get('asset')
+    if not selected:
+        return assets
+    if selected.isdigit():
+        return [(position, asset) for position, asset in assets if position + 1 == int(selected)]
+    return [(position, asset) for position, asset in assets if asset.get('asset_name') == selected]
+
+# Request Handler
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    """Routes GET requests to the project store; set store and api_token on a subclass"""
+    store = None
+    api_token = ''
+    server_version = 'RCMApi/1.0'
+
+    def do_GET(self):
+        try:
+            if self.api_token:
+                expected = f"Bearer {self.api_token}".encode('utf-8')
+                if not hmac.compare_digest(self.headers.get('Authorization', '').encode('utf-8'), expected):
+                    raise ApiError(401, "Missing or invalid API token")
+            url = urlsplit(self.path)
+            parts = [part for part in url.path.split('/') if part]
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+            # The ETag only depends on the request and the files it reads, so unchanged data is
+            # answered with 304 before any project is parsed or serialized
+            etag = self.compute_etag(parts, url.query)
+            if etag and etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_json(200, self.route(parts, query), etag)
+        except ApiError as e:
+            self.send_json(e.status, {'error': e.message})
+        except Exception as e:
+            print(f"API error: {str(e)}")
+            self.send_json(500, {'error': "Internal server error"})
+
+    def compute_etag(self, parts, query_string):
+        """Weak ETag of the workspace files behind a request, or None if they do not exist"""
+        signatures = [self.store.file_signature('catalogue.json')]
+        if len(parts) >= 2 and parts[0] == 'projects':
+            entry = self.store.load_catalogue().get(parts[1])
+            if entry is not None:
+                signatures.append(self.store.file_signature(entry['file_name']))
+        if any(signature is None for signature in signatures):
+            return None
+        digest = hashlib.sha1(repr((parts, query_string, signatures)).encode()).hexdigest()
+        return f'W/"{digest}"'
+
+    def route(self, parts, query):
+        """Build the response body of a GET request"""
+        if not parts or parts[0] != 'projects':
+            raise ApiError(404, "Not found")
+        catalogue = self.store.load_catalogue()
+        if len(parts) == 1:
+            projects = [dict(entry, key=key) for key, entry in sorted(catalogue.items())
+                        if matches_text(query, entry.get('project_no', ''), entry.get('project_description', ''))]
+            return paginate(projects, query)
+
+        entry = catalogue.get(parts[1])
+        project = self.store.load_project(entry['file_name']) if entry else None
+        if project is None:
+            raise ApiError(404, f"Project {parts[1]} not found")
+        if len(parts) == 2:
+            return {
+                'key': parts[1],
+                'project_information': project.get('project_data', {}),
+                'assets': [summarize_asset(position, asset) for position, asset in enumerate(project.get('assets', []))]
+            }
+        if len(parts) != 3:
+            raise ApiError(404, "Not found")
+
+        if parts[2] == 'assets':
+            assets = [summarize_asset(position, asset) for position, asset in enumerate(project.get('assets', []))
+                      if (not query.get('asset_class') or asset.get('asset_class') == query['asset_class'])
+                      and (not query.get('site_location') or asset.get('site_location') == query['site_location'])
+                      and matches_text(query, asset.get('asset_name', ''), asset.get('asset_type', ''))]
+            return paginate(assets, query)
+
+        if parts[2] == 'failure-modes':
+            failure_modes = []
+            for position, asset in select_assets(project, query):
+                for mode in asset.get('failure_modes', []):
+                    if query.get('component') and mode.get('component') != query['component']:
+                        continue
+                    if query.get('consequence') and query['consequence'] not in mode.get('consequence_category', ''):
+                        continue
+                    if not matches_text(query, mode.get('id', ''), mode.get('description', ''), mode.get('component', '')):
+                        continue
+                    failure_modes.append(dict(flatten_failure_mode(mode, asset), **{'Asset No.': position + 1}))
+            return paginate(failure_modes, query)
+
+        if parts[2] == 'tasks':
+            tasks = []
+            for position, asset in select_assets(project, query):
+                modes = {mode.get('id'): mode for mode in asset.get('failure_modes', [])}
+                for result in asset.get('analysis_results', []):
+                    if query.get('task_type') and query['task_type'] not in result.get('task_type', ''):
+                        continue
+                    if not matches_text(query, result.get('failure_mode', ''), result.get('task_description', ''),
+                                        result.get('component', '')):
+                        continue
+                    task = modes.get(result.get('failure_mode_id'), {}).get('management_task', {})
+                    tasks.append(dict(result, asset=position + 1, asset_name=asset.get('asset_name', ''),
+                                      failure_cost=task.get('failure_cost', 0),
+                                      justification=task.get('justification', '')))
+            return paginate(tasks, query)
+
+        raise ApiError(404, "Not found")
+
+    def send_json(self, status, body, etag=None):
+        """Send a JSON body, gzip-compressed if the client accepts it and it is large enough"""
+        payload = json.dumps(body).encode('utf-8')
+        gzipped = len(payload) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            payload = gzip.compress(payload, compresslevel=5)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Vary', 'Accept-Encoding')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(payload)
+
+def create_server(host, port, workspace_path, api_token=''):
+    """Create (but do not start) the API server for a workspace directory"""
+    handler = type('ConfiguredApiRequestHandler', (ApiRequestHandler,),
+                   {'store': ProjectStore(workspace_path), 'api_token': api_token})
+    return ThreadingHTTPServer((host, port), handler)
+
+def main(argv=None):
+    """Serve the workspace projects until interrupted"""
+    api_config = load_api_config()
+    parser = argparse.ArgumentParser(description="Read-only REST/JSON API over the RCM project workspace")
+    parser.add_argument('--host', default=api_config['HOST'], help=f"Interface to listen on (default: {api_config['HOST']})")
+    parser.add_argument('--port', type=int, default=api_config['PORT'], help=f"Port (default: {api_config['PORT']})")
+    parser.add_argument('--workspace', default=api_config['WORKSPACE_PATH'], help="Workspace directory")
+    args = parser.parse_args(argv)
+
+    server = create_server(args.host, args.port, args.workspace, api_config['API_TOKEN'])
+    print(f"Serving {args.workspace} on http://{args.host}:{args.port}/projects")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Batch processing of FMECA & RCM project files without the web interface
+
+Every project JSON file in a directory is validated (referential integrity), has its risk levels
+recalculated against the given thresholds and is written out as an Excel workbook; a consolidated
+workbook covers all projects, with portfolio analytics (task types and top risks) merged from the
+per-project results of the workers. With --pdf a PDF report of each project is written as well. Files
+are processed in parallel in a process pool.
+
+    python rcm_cli.py projects/ -o reports/
+    python rcm_cli.py projects/ -o reports/ --repair --write-json --pdf --moderate-threshold 5 --high-threshold 8
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from rcm_data import (DEFAULT_RISK_MODERATE_THRESHOLD, DEFAULT_RISK_HIGH_THRESHOLD, parse_project_data,
+                      recalculate_risk_levels, flatten_assets, build_excel_workbook, build_fmeca_workbook)
+from rcm_analytics import compact_asset, analyse_partition, merge_analytics, task_type_rows, top_risk_rows
+from rcm_integrity import check_project_integrity, repair_project
+from rcm_pdf import write_pdf_report
+
+def process_project_file(project_path, output_dir, options):
+    """Validate, recalculate and export one project file; returns a summary dict for the report"""
+    summary = {'file': os.path.basename(project_path), 'project_no': '', 'assets': 0, 'failure_modes': 0,
+               'issues': [], 'risk_changes': 0, 'workbook': None, 'report': None, 'rows': [], 'analytics': None,
+               'error': None}
+    try:
+        with open(project_path, 'r') as f:
+            project_file = json.load(f)
+
+        summary['issues'] = [f"{label}: {issue['message']}"
+                             for label, issues in check_project_integrity(project_file) for issue in issues]
+        if options['repair'] and summary['issues']:
+            project_file = repair_project(project_file)
+
+        project = parse_project_data(project_file)
+        if not project.get('assets'):
+            raise ValueError("no assets or legacy asset data found in the file")
+        project_data = project.get('project_data', {})
+        project_no = project_data.get('project_no') or os.path.splitext(summary['file'])[0]
+        assets, summary['risk_changes'] = recalculate_risk_levels(project.get('assets', []), options['moderate_threshold'],
+                                                                  options['high_threshold'])
+        summary['project_no'] = project_no
+        summary['assets'] = len(assets)
+
+        rows = flatten_assets(assets)
+        summary['failure_modes'] = len(rows)
+        summary['rows'] = [{'Project No.': project_no, **row} for row in rows]
+        # Partial analytics of this project; the main process merges them across projects
+        summary['analytics'] = analyse_partition(
+            [(f"{project_no}: {asset_name}", asset_class, modes)
+             for asset_name, asset_class, modes in (compact_asset(asset) for asset in assets)])
+        base_name = os.path.splitext(summary['file'])[0]
+        if rows:
+            summary['workbook'] = os.path.join(output_dir, f"{base_name}.xlsx")
+            with open(summary['workbook'], 'wb') as f:
+                f.write(build_fmeca_workbook(assets, project_data))
+
+        if options['pdf'] and assets:
+            # Projects are already spread over the pool, so each report is laid out in this worker
+            summary['report'] = os.path.join(output_dir, f"{base_name}.pdf")
+            with open(summary['report'], 'wb') as f:
+                write_pdf_report(f, assets, project_data, options['moderate_threshold'], options['high_threshold'],
+                                 workers=1)
+
+        if options['write_json']:
+            # Written in the multi-asset format only, so a legacy file's analysis is not kept twice
+            output_file = {'project_information': project_data, 'assets': assets,
+                           'export_date': datetime.now().isoformat()}
+            if 'application_info' in project_file:
+                output_file = {'application_info': project_file['application_info'], **output_file}
+            with open(os.path.join(output_dir, f"{base_name}.json"), 'w') as f:
+                json.dump(output_file, f, indent=2)
+    except Exception as e:
+        summary['error'] = str(e)
+    return summary
+
+def main(argv=None):
+    """Process a directory of project files and write per-project and consolidated workbooks"""
+    parser = argparse.ArgumentParser(description="Validate, recalculate and export a directory of RCM project files")
+    parser.add_argument('project_dir', help="Directory of exported project JSON files")
+    parser.add_argument('-o', '--output', default='reports', help="Output directory (default: reports)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument('--repair', action='store_true', help="Remove orphaned, stale and duplicate records")
+    parser.add_argument('--write-json', action='store_true', help="Also write the recalculated project files")
+    parser.add_argument('--pdf', action='store_true', help="Also write a PDF report of each project")
+    parser.add_argument('--moderate-threshold', type=int, default=DEFAULT_RISK_MODERATE_THRESHOLD,
+                        help=f"Lowest risk score rated Moderate (default: {DEFAULT_RISK_MODERATE_THRESHOLD})")
+    parser.add_argument('--high-threshold', type=int, default=DEFAULT_RISK_HIGH_THRESHOLD,
+                        help=f"Lowest risk score rated High (default: {DEFAULT_RISK_HIGH_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    if args.moderate_threshold >= args.high_threshold:
+        parser.error("--moderate-threshold must be lower than --high-threshold")
+    project_paths = sorted(os.path.join(args.project_dir, name) for name in os.listdir(args.project_dir)
+                           if name.endswith('.json'))
+    if not project_paths:
+        print(f"No project files found in {args.project_dir}")
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    options = {'repair': args.repair, 'write_json': args.write_json, 'pdf': args.pdf,
+               'moderate_threshold': args.moderate_threshold, 'high_threshold': args.high_threshold}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        summaries = list(executor.map(process_project_file, project_paths,
+                                      [args.output] * len(project_paths), [options] * len(project_paths)))
+
+    consolidated_rows = []
+    overview = []
+    for summary in summaries:
+        if summary['error']:
+            print(f"{summary['file']}: ERROR {summary['error']}")
+            continue
+        status = f"{len(summary['issues'])} issue(s)" + (" repaired" if args.repair and summary['issues'] else "")
+        print(f"{summary['file']}: {summary['project_no']} - {summary['assets']} asset(s), "
+              f"{summary['failure_modes']} failure mode(s), {summary['risk_changes']} risk level(s) recalculated, {status}")
+        for issue in summary['issues']:
+            print(f"  - {issue}")
+        consolidated_rows.extend(summary['rows'])
+        overview.append({
+            'Project No.': summary['project_no'],
+            'File': summary['file'],
+            'Assets': summary['assets'],
+            'Failure Modes': summary['failure_modes'],
+            'Integrity Issues': len(summary['issues']),
+            'Risk Levels Recalculated': summary['risk_changes']
+        })
+
+    if overview:
+        analytics = merge_analytics(summary['analytics'] for summary in summaries if not summary['error'])
+        consolidated_path = os.path.join(args.output, f"rcm_consolidated_{datetime.now().strftime('%Y%m%d')}.xlsx")
+        with open(consolidated_path, 'wb') as f:
+            f.write(build_excel_workbook([('Projects', overview), ('Complete FMECA Analysis', consolidated_rows),
+                                          ('Task Types', task_type_rows(analytics)),
+                                          ('Top Risks', top_risk_rows(analytics))]))
+        print(f"Consolidated workbook written to {consolidated_path}")
+
+    failed = any(summary['error'] for summary in summaries)
+    unrepaired = not args.repair and any(summary['issues'] for summary in summaries)
+    return 1 if failed or unrepaired else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,429 @@
+"""Data layer for FMECA & RCM project files
+
+Project data handling that does not depend on Streamlit: building and reading project files,
+risk classification, flattening failure modes into report rows and writing Excel workbooks.
+It is used by the Streamlit app and by the batch command line tool (rcm_cli.py).
+"""
+import io
+from datetime import datetime
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import CellIsRule
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from rcm_integrity import derive_analysis_results
+
+DEFAULT_RISK_MODERATE_THRESHOLD = 6
+DEFAULT_RISK_HIGH_THRESHOLD = 8
+
+# Project file keys and the session state keys they are loaded into
+PROJECT_FILE_KEYS = {
+    'project_information': 'project_data',
+    'assets': 'assets',
+    # Legacy single-asset format
+    'asset_information': 'asset_data',
+    'operating_context': 'operating_context',
+    'components': 'components',
+    'functions': 'functions',
+    'functional_failures': 'functional_failures',
+    'failure_modes': 'failure_modes',
+    'analysis_results': 'analysis_results'
+}
+
+# Consequence and likelihood ratings of a risk assessment; a risk score is the sum of their numbers
+CONSEQUENCE_RATINGS = ["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"]
+LIKELIHOOD_RATINGS = ["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"]
+
+# Risk Classification Functions
+def classify_risk(risk_score, moderate_threshold=DEFAULT_RISK_MODERATE_THRESHOLD,
+                  high_threshold=DEFAULT_RISK_HIGH_THRESHOLD):
+    """Get the risk level and its display colour for a risk score"""
+    if risk_score >= high_threshold:
+        return "High", "red"
+    elif risk_score >= moderate_threshold:
+        return "Moderate", "orange"
+    else:
+        return "Low", "green"
+
+def calculate_risk_score(consequence, likelihood):
+    """Risk score of a consequence and likelihood rating, e.g. '3-Moderate' and '2-Unlikely' score 5"""
+    return int(str(consequence)[0]) + int(str(likelihood)[0])
+
+def recalculate_risk_assessment(assessment, moderate_threshold=DEFAULT_RISK_MODERATE_THRESHOLD,
+                                high_threshold=DEFAULT_RISK_HIGH_THRESHOLD):
+    """Recalculate the score and level of a risk assessment; returns the same dict if nothing changed"""
+    try:
+        risk_score = calculate_risk_score(assessment.get('consequence'), assessment.get('likelihood'))
+    except (TypeError, ValueError, IndexError):
+        risk_score = assessment.get('risk_score')
+    if not isinstance(risk_score, (int, float)):
+        return assessment
+    risk_level, _ = classify_risk(risk_score, moderate_threshold, high_threshold)
+    if assessment.get('risk_score') == risk_score and assessment.get('risk_level') == risk_level:
+        return assessment
+    return dict(assessment, risk_score=risk_score, risk_level=risk_level)
+
+def recalculate_risk_levels(assets, moderate_threshold=DEFAULT_RISK_MODERATE_THRESHOLD,
+                            high_threshold=DEFAULT_RISK_HIGH_THRESHOLD):
+    """Recalculate every risk and post-task risk assessment of a project's assets
+
+    The input is not modified: only the assets and failure modes whose assessments changed are
+    copied. Returns (assets, number of assessments changed).
+    """
+    changed = 0
+    new_assets = []
+    for asset in assets:
+        new_modes = []
+        for mode in asset.get('failure_modes', []):
+            new_mode = mode
+            if 'risk_assessment' in mode:
+                assessment = recalculate_risk_assessment(mode['risk_assessment'], moderate_threshold, high_threshold)
+                if assessment is not mode['risk_assessment']:
+                    new_mode = dict(new_mode, risk_assessment=assessment)
+                    changed += 1
+            task = mode.get('management_task')
+            if task and 'post_risk_assessment' in task:
+                assessment = recalculate_risk_assessment(task['post_risk_assessment'], moderate_threshold, high_threshold)
+                if assessment is not task['post_risk_assessment']:
+                    new_mode = dict(new_mode, management_task=dict(task, post_risk_assessment=assessment))
+                    changed += 1
+            new_modes.append(new_mode)
+        if any(new is not old for new, old in zip(new_modes, asset.get('failure_modes', []))):
+            asset = dict(asset, failure_modes=new_modes)
+        new_assets.append(asset)
+    return new_assets, changed
+
+# Project File Functions
+def build_export_data(session, application_info):
+    """Build a project file from session-like data (a mapping with the PROJECT_FILE_KEYS values)
+
+    Returns None when there is neither a project number nor a legacy asset name.
+    """
+    project_data = session.get('project_data', {})
+    asset_data = session.get('asset_data', {})
+    if not project_data.get('project_no') and not asset_data.get('asset_name'):
+        return None
+
+    export_data = {"application_info": application_info}
+    for file_key, session_key in PROJECT_FILE_KEYS.items():
+        export_data[file_key] = session.get(session_key, {} if file_key in ('asset_information', 'operating_context') else [])
+    export_data["export_date"] = datetime.now().isoformat()
+    return export_data
+
+def derive_assets_analysis_results(assets):
+    """Rebuild every asset's analysis_results from its failure modes; stored result rows are not trusted"""
+    return [dict(asset, analysis_results=derive_analysis_results(asset.get('failure_modes', []))) for asset in assets]
+
+def legacy_asset(import_data):
+    """The asset of a legacy single-asset file (top-level asset information and analysis), or None"""
+    if not any(import_data.get(key) for key in ('asset_information', 'functions', 'failure_modes')):
+        return None
+    asset = dict(import_data.get('asset_information') or {})
+    asset['operating_context'] = import_data.get('operating_context') or {}
+    for key in ('components', 'functions', 'functional_failures', 'failure_modes'):
+        asset[key] = import_data.get(key) or []
+    return asset
+
+def parse_project_data(import_data):
+    """Read a project file into {session key: value} for the keys present in the file
+
+    Analysis results are derived from the failure modes rather than read from the file. A legacy
+    single-asset file without an assets list gets a one-asset assets list.
+    """
+    project = {}
+    for file_key, session_key in PROJECT_FILE_KEYS.items():
+        if file_key in import_data:
+            project[session_key] = import_data[file_key]
+    if 'assets' not in project:
+        asset = legacy_asset(import_data)
+        if asset is not None:
+            project['assets'] = [asset]
+    if 'assets' in project:
+        project['assets'] = derive_assets_analysis_results(project['assets'])
+    if 'analysis_results' in project or 'failure_modes' in project:
+        project['analysis_results'] = derive_analysis_results(project.get('failure_modes', []))
+    return project
+
+# Report Row Functions
+def flatten_failure_mode(mode, asset=None):
+    """Flatten a failure mode with its effects, consequence, risk and task into one report row
+
+    The asset's name, class, type and location are included as the first columns if asset is given.
+    """
+    row = {}
+    if asset is not None:
+        row['Asset Name'] = asset.get('asset_name', '')
+        row['Asset Class'] = asset.get('asset_class', '')
+        row['Asset Type'] = asset.get('asset_type', '')
+        row['Site Location'] = asset.get('site_location', '')
+    row['Failure Mode ID'] = mode.get('id', '')
+    row['Functional Failure ID'] = mode.get('functional_failure_id', '')
+    row['Component'] = mode.get('component', '')
+    row['Failure Mode'] = mode.get('description', '')
+    row['Failure Mode Category'] = mode.get('category', '')
+
+    # Add effects data
+    if 'effects' in mode:
+        effects = mode['effects']
+        row['Evidence of Failure'] = effects.get('evidence', '')
+        row['Safety/Environmental Impact'] = effects.get('safety_impact', '')
+        row['Operational Impact'] = effects.get('operational_impact', '')
+        row['Physical Damage'] = effects.get('physical_damage', '')
+        row['Repair Action'] = effects.get('repair_action', '')
+        row['Repair Time (hrs)'] = effects.get('repair_time', 0)
+        row['Downtime (hrs)'] = effects.get('downtime', 0)
+
+    # Add consequence data
+    row['Consequence Category'] = mode.get('consequence_category', 'Not categorized')
+
+    # Add risk assessment data
+    if 'risk_assessment' in mode:
+        risk = mode['risk_assessment']
+        row['Risk Consequence'] = risk.get('consequence', '')
+        row['Risk Likelihood'] = risk.get('likelihood', '')
+        row['Risk Score'] = risk.get('risk_score', '')
+        row['Risk Level'] = risk.get('risk_level', '')
+
+    # Add management task data
+    if 'management_task' in mode:
+        task = mode['management_task']
+        row['Task Type'] = task.get('task_type', '')
+        row['Task Description'] = task.get('description', '')
+        row['Technically Feasible'] = task.get('technically_feasible', '')
+        row['Worth Doing'] = task.get('worth_doing', '')
+        row['Justification'] = task.get('justification', '')
+        row['Task Cost ($)'] = task.get('cost', 0)
+        row['Failure Cost ($)'] = task.get('failure_cost', 0)
+
+        # Add post-implementation risk assessment if exists
+        if 'post_risk_assessment' in task:
+            post_risk = task['post_risk_assessment']
+            row['Post-Task Risk Consequence'] = post_risk.get('consequence', '')
+            row['Post-Task Risk Likelihood'] = post_risk.get('likelihood', '')
+            row['Post-Task Risk Score'] = post_risk.get('risk_score', '')
+            row['Post-Task Risk Level'] = post_risk.get('risk_level', '')
+    return row
+
+def flatten_assets(assets, project_no=None):
+    """Report rows for every failure mode of every asset, with a leading 'Project No.' column if given"""
+    rows = []
+    for asset in assets:
+        for mode in asset.get('failure_modes', []):
+            row = flatten_failure_mode(mode, asset)
+            if project_no is not None:
+                row = {'Project No.': project_no, **row}
+            rows.append(row)
+    return rows
+
+# Excel Functions
+def build_excel_workbook(sheets):
+    """Write (sheet name, rows or DataFrame) pairs to an Excel workbook and return its bytes"""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, data in sheets:
+            df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+            # Excel sheet names are limited to 31 characters and may not contain []:*?/\
+            safe_name = ''.join('_' if c in '[]:*?/\\' else c for c in str(sheet_name))[:31] or 'Sheet'
+            df.to_excel(writer, sheet_name=safe_name, index=False)
+    return output.getvalue()
+
+# Formatted FMECA Workbook Functions
+# Risk level fills, matching the colours used for risk levels in the app
+RISK_LEVEL_FILLS = {'High': 'FF0000', 'Moderate': 'FFA500', 'Low': '008000'}
+
+def _get_workbook_styles():
+    """Named styles shared by every sheet; cells refer to them by name instead of carrying their own"""
+    thin = Side(style='thin', color='BFBFBF')
+    header = NamedStyle(name='fmeca_header')
+    header.font = Font(bold=True, color='FFFFFF')
+    header.fill = PatternFill('solid', start_color='1F4E78')
+    header.alignment = Alignment(vertical='center', wrap_text=True)
+    header.border = Border(bottom=thin)
+    currency = NamedStyle(name='fmeca_currency', number_format='"$"#,##0.00')
+    hours = NamedStyle(name='fmeca_hours', number_format='#,##0.0')
+    return [header, currency, hours]
+
+def _risk_level(assessment):
+    """Risk level of an optional risk assessment dict"""
+    return (assessment or {}).get('risk_level', '')
+
+def _risk_score(assessment):
+    """Risk score of an optional risk assessment dict"""
+    return (assessment or {}).get('risk_score', '')
+
+def _fmeca_sheets(assets, project_data):
+    """(sheet name, [(header, width, style)], row iterator) for each sheet of the FMECA workbook
+
+    Rows are generated lazily so that the write-only workbook never holds a whole sheet in memory.
+    """
+    def modes():
+        for asset in assets:
+            for mode in asset.get('failure_modes', []):
+                yield asset.get('asset_name', ''), mode
+
+    def functions():
+        for asset in assets:
+            for function in asset.get('functions', []):
+                yield (asset.get('asset_name', ''), function.get('id', ''), function.get('type', ''),
+                       function.get('verb', ''), function.get('object', ''), function.get('performance_standard', ''),
+                       function.get('full_statement', ''))
+
+    def functional_failures():
+        for asset in assets:
+            for failure in asset.get('functional_failures', []):
+                yield (asset.get('asset_name', ''), failure.get('id', ''), failure.get('function_id', ''),
+                       failure.get('function_statement', ''), failure.get('description', ''), failure.get('category', ''))
+
+    def failure_modes():
+        for asset_name, mode in modes():
+            yield (asset_name, mode.get('id', ''), mode.get('functional_failure_id', ''), mode.get('component', ''),
+                   mode.get('description', ''), mode.get('category', ''), mode.get('consequence_category', ''),
+                   _risk_score(mode.get('risk_assessment')), _risk_level(mode.get('risk_assessment')))
+
+    def effects():
+        for asset_name, mode in modes():
+            effect = mode.get('effects')
+            if effect:
+                yield (asset_name, mode.get('id', ''), mode.get('component', ''), mode.get('description', ''),
+                       effect.get('evidence', ''), effect.get('safety_impact', ''), effect.get('operational_impact', ''),
+                       effect.get('physical_damage', ''), effect.get('repair_action', ''),
+                       effect.get('repair_time', 0), effect.get('downtime', 0))
+
+    def consequences():
+        for asset_name, mode in modes():
+            if 'consequence_category' in mode:
+                risk = mode.get('risk_assessment') or {}
+                yield (asset_name, mode.get('id', ''), mode.get('description', ''), mode['consequence_category'],
+                       risk.get('consequence', ''), risk.get('likelihood', ''), risk.get('risk_score', ''),
+                       risk.get('risk_level', ''))
+
+    def tasks():
+        for asset_name, mode in modes():
+            task = mode.get('management_task')
+            if task:
+                yield (asset_name, mode.get('id', ''), mode.get('component', ''), mode.get('description', ''),
+                       task.get('task_type', ''), task.get('description', ''), task.get('technically_feasible', ''),
+                       task.get('worth_doing', ''), task.get('justification', ''), task.get('cost', 0),
+                       task.get('failure_cost', 0), _risk_level(task.get('post_risk_assessment')))
+
+    def risk_register():
+        # Highest risk first; the sort holds one tuple per assessed failure mode
+        assessed = [(asset_name, mode) for asset_name, mode in modes() if mode.get('risk_assessment')]
+        assessed.sort(key=lambda item: -(item[1]['risk_assessment'].get('risk_score') or 0))
+        for asset_name, mode in assessed:
+            risk = mode['risk_assessment']
+            task = mode.get('management_task') or {}
+            yield (asset_name, mode.get('id', ''), mode.get('component', ''), mode.get('description', ''),
+                   mode.get('consequence_category', ''), risk.get('consequence', ''), risk.get('likelihood', ''),
+                   risk.get('risk_score', ''), risk.get('risk_level', ''), task.get('task_type', ''),
+                   _risk_score(task.get('post_risk_assessment')), _risk_level(task.get('post_risk_assessment')))
+
+    def summary():
+        for asset in assets:
+            failure_modes_list = asset.get('failure_modes', [])
+            risk_levels = [_risk_level(mode.get('risk_assessment')) for mode in failure_modes_list]
+            managed = [mode['management_task'] for mode in failure_modes_list if mode.get('management_task')]
+            yield (project_data.get('project_no', ''), asset.get('asset_name', ''), asset.get('asset_class', ''),
+                   asset.get('asset_type', ''), asset.get('site_location', ''), len(asset.get('components', [])),
+                   len(asset.get('functions', [])), len(asset.get('functional_failures', [])), len(failure_modes_list),
+                   len(managed), risk_levels.count('High'), risk_levels.count('Moderate'), risk_levels.count('Low'),
+                   sum(task.get('cost', 0) or 0 for task in managed), sum(task.get('failure_cost', 0) or 0 for task in managed))
+
+    asset_column = ('Asset Name', 24, None)
+    mode_column = ('Failure Mode ID', 16, None)
+    return [
+        ('Functions', [asset_column, ('Function ID', 12, None), ('Type', 18, None), ('Verb', 36, None),
+                       ('Object', 24, None), ('Performance Standard', 24, None), ('Function Statement', 60, None)],
+         functions()),
+        ('Functional Failures', [asset_column, ('Functional Failure ID', 16, None), ('Function ID', 12, None),
+                                 ('Function Statement', 50, None), ('Functional Failure', 40, None),
+                                 ('Category', 24, None)],
+         functional_failures()),
+        ('Failure Modes', [asset_column, mode_column, ('Functional Failure ID', 16, None), ('Component', 20, None),
+                           ('Failure Mode', 40, None), ('Failure Mode Category', 28, None),
+                           ('Consequence Category', 30, None), ('Risk Score', 10, None), ('Risk Level', 12, None)],
+         failure_modes()),
+        ('Effects', [asset_column, mode_column, ('Component', 20, None), ('Failure Mode', 40, None),
+                     ('Evidence of Failure', 30, None), ('Safety/Environmental Impact', 30, None),
+                     ('Operational Impact', 30, None), ('Physical Damage', 24, None), ('Repair Action', 30, None),
+                     ('Repair Time (hrs)', 14, 'fmeca_hours'), ('Downtime (hrs)', 14, 'fmeca_hours')],
+         effects()),
+        ('Consequences', [asset_column, mode_column, ('Failure Mode', 40, None), ('Consequence Category', 30, None),
+                          ('Risk Consequence', 18, None), ('Risk Likelihood', 18, None), ('Risk Score', 10, None),
+                          ('Risk Level', 12, None)],
+         consequences()),
+        ('Tasks', [asset_column, mode_column, ('Component', 20, None), ('Failure Mode', 40, None),
+                   ('Task Type', 28, None), ('Task Description', 50, None), ('Technically Feasible', 12, None),
+                   ('Worth Doing', 12, None), ('Justification', 40, None), ('Task Cost ($)', 14, 'fmeca_currency'),
+                   ('Failure Cost ($)', 14, 'fmeca_currency'), ('Post-Task Risk Level', 14, None)],
+         tasks()),
+        ('Risk Register', [asset_column, mode_column, ('Component', 20, None), ('Failure Mode', 40, None),
+                           ('Consequence Category', 30, None), ('Risk Consequence', 18, None),
+                           ('Risk Likelihood', 18, None), ('Risk Score', 10, None), ('Risk Level', 12, None),
+                           ('Task Type', 28, None), ('Post-Task Risk Score', 12, None),
+                           ('Post-Task Risk Level', 14, None)],
+         risk_register()),
+        ('Summary', [('Project No.', 16, None), asset_column, ('Asset Class', 18, None), ('Asset Type', 18, None),
+                     ('Site Location', 20, None), ('Components', 12, None), ('Functions', 12, None),
+                     ('Functional Failures', 12, None), ('Failure Modes', 12, None), ('Tasks', 10, None),
+                     ('High Risks', 10, None), ('Moderate Risks', 10, None), ('Low Risks', 10, None),
+                     ('Annual Task Cost ($)', 16, 'fmeca_currency'), ('Failure Cost ($)', 16, 'fmeca_currency')],
+         summary())
+    ]
+
+def build_fmeca_workbook(assets, project_data=None):
+    """Write a formatted FMECA workbook for a list of assets and return its bytes
+
+    One sheet each for functions, functional failures, failure modes, effects, consequences,
+    tasks, a risk register and a summary, with frozen and filterable headers and risk levels
+    coloured by conditional formatting. The workbook is written in openpyxl's write-only mode:
+    rows are streamed to disk as they are generated and cells refer to shared named styles, so
+    memory use does not grow with the number of rows.
+    """
+    workbook = Workbook(write_only=True)
+    for style in _get_workbook_styles():
+        workbook.add_named_style(style)
+    risk_rules = [CellIsRule(operator='equal', formula=[f'"{level}"'], font=Font(color='FFFFFF'),
+                             fill=PatternFill('solid', start_color=color, end_color=color))
+                  for level, color in RISK_LEVEL_FILLS.items()]
+
+    for sheet_name, columns, rows in _fmeca_sheets(assets, project_data or {}):
+        sheet = workbook.create_sheet(sheet_name)
+        # Column widths and frozen panes are written with the sheet header, so they are set first
+        for position, (_, width, _) in enumerate(columns, start=1):
+            sheet.column_dimensions[get_column_letter(position)].width = width
+        sheet.freeze_panes = 'A2'
+
+        header_row = []
+        for header, _, _ in columns:
+            cell = WriteOnlyCell(sheet, value=header)
+            cell.style = 'fmeca_header'
+            header_row.append(cell)
+        sheet.append(header_row)
+
+        styled_columns = [(position, style) for position, (_, _, style) in enumerate(columns) if style]
+        row_count = 0
+        for row in rows:
+            if styled_columns:
+                row = list(row)
+                for position, style in styled_columns:
+                    cell = WriteOnlyCell(sheet, value=row[position])
+                    cell.style = style
+                    row[position] = cell
+            sheet.append(row)
+            row_count += 1
+
+        last_column = get_column_letter(len(columns))
+        sheet.auto_filter.ref = f"A1:{last_column}{row_count + 1}"
+        for position, (header, _, _) in enumerate(columns, start=1):
+            if header.endswith('Risk Level') and row_count:
+                column = get_column_letter(position)
+                for rule in risk_rules:
+                    sheet.conditional_formatting.add(f"{column}2:{column}{row_count + 1}", rule)
+
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
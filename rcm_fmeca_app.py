@@ -6,14 +6,37 @@ Based on Murrumbidgee Irrigation RCM Course Materials
 """
 
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
+import numpy as np
 import json
 from datetime import datetime
-import io
 import configparser
 import os
 import time
 import hashlib
+import hmac
+import secrets
+import base64
+import re
+import math
+import heapq
+import difflib
+import multiprocessing
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from rcm_integrity import (ANALYSIS_KEYS, build_reference_index, collect_cascade, apply_cascade,
+                           derive_analysis_results, check_project_integrity, repair_project)
+from rcm_data import (CONSEQUENCE_RATINGS, LIKELIHOOD_RATINGS, classify_risk, build_export_data,
+                      derive_assets_analysis_results, parse_project_data, flatten_failure_mode, build_fmeca_workbook)
+from rcm_pdf import build_pdf_report
+from rcm_analytics import (compact_asset, compute_portfolio_analytics, task_type_rows, top_risk_rows, risk_score_rows,
+                           risk_rating_array, combine_rating_arrays, residual_ratings, risk_heat_map, risk_migration,
+                           risk_cell_rows, task_cost_array, compute_risk_reduction, reduction_per_cost,
+                           rank_cost_effective_tasks)
+from rcm_optimizer import OBJECTIVES, task_candidates, greedy_selection, knapsack_selection, efficient_frontier
+from rcm_schedule import build_schedule, schedule_summary, calendar_rows
 
 # Cache configuration loading for better performance
 @st.cache_resource
@@ -35,7 +58,22 @@ def load_config():
         'DEPARTMENT': config.get('Organization', 'department', fallback=''),  # Not used - from .registration
         'CONTACT_EMAIL': config.get('Organization', 'contact_email', fallback=''),  # Not used - from .registration
         'SOFTWARE_CONTACT': config.get('Application', 'software_contact_email', fallback='sm@odysseus-imc.com'),
-        'TECHNICAL_CONTACT': config.get('Application', 'technical_contact_email', fallback='adam.hassan@cambia.com.au')
+        'TECHNICAL_CONTACT': config.get('Application', 'technical_contact_email', fallback='adam.hassan@cambia.com.au'),
+        'PASSWORD_HASHER': config.get('Security', 'password_hasher', fallback='pbkdf2_sha256'),
+        'PBKDF2_ITERATIONS': config.getint('Security', 'pbkdf2_iterations', fallback=600000),
+        'SCRYPT_N': config.getint('Security', 'scrypt_n', fallback=16384),
+        'SCRYPT_R': config.getint('Security', 'scrypt_r', fallback=8),
+        'SCRYPT_P': config.getint('Security', 'scrypt_p', fallback=1),
+        'SESSION_TIMEOUT_MINUTES': config.getint('Security', 'session_timeout_minutes', fallback=480),
+        'LIBRARY_PATH': config.get('Library', 'library_path', fallback='project_library'),
+        'LIBRARY_SUGGESTIONS': config.getint('Library', 'suggestions', fallback=5),
+        'UNDO_MEMORY_MB': config.getfloat('History', 'undo_memory_mb', fallback=32),
+        'WORKSPACE_PATH': config.get('Workspace', 'workspace_path', fallback='workspace'),
+        'WORKBOOK_CACHE_MB': config.getfloat('Export', 'workbook_cache_mb', fallback=64),
+        'PDF_WORKERS': config.getint('Export', 'pdf_workers', fallback=0),
+        'ANALYTICS_WORKERS': config.getint('Analytics', 'workers', fallback=0),
+        'SCHEDULE_CREW_HOURS': config.getfloat('Schedule', 'weekly_crew_hours', fallback=80),
+        'SCHEDULE_HORIZON_YEARS': config.getint('Schedule', 'horizon_years', fallback=10)
     }
 
 config_data = load_config()
@@ -203,6 +241,9 @@ def get_custom_css():
 # Apply cached CSS
 st.markdown(get_custom_css(), unsafe_allow_html=True)
 
+# Counters kept per asset and for the whole project by get_project_aggregates()
+AGGREGATE_FIELDS = ['components', 'functions', 'functional_failures', 'failure_modes', 'tasks', 'annual_cost']
+
 # Initialize session state
 def initialize_session_state():
     """Initialize all session state variables"""
@@ -219,6 +260,9 @@ def initialize_session_state():
     if 'user_data' not in st.session_state:
         st.session_state.user_data = None
     
+    if 'session_token' not in st.session_state:
+        st.session_state.session_token = None
+    
     # Project-level data
     if 'project_data' not in st.session_state:
         st.session_state.project_data = {
@@ -277,14 +321,75 @@ def initialize_session_state():
     if 'current_view' not in st.session_state:
         st.session_state.current_view = 'rcm_navigation'
     
+    # Stage 2 table memoisation: per-asset data version and cached DataFrames
+    if 'analysis_data_versions' not in st.session_state:
+        st.session_state.analysis_data_versions = {}
+    
+    if 'analysis_table_cache' not in st.session_state:
+        st.session_state.analysis_table_cache = {}
+    
+    # Inverted index over the failure modes of all assets, refreshed per asset data version
+    if 'search_index' not in st.session_state:
+        st.session_state.search_index = {'docs': {}, 'postings': {}, 'total_length': 0, 'asset_versions': {}}
+    
     # Initialize autosave flag
     if 'last_autosave_hash' not in st.session_state:
         st.session_state.last_autosave_hash = None
     
+    if 'last_autosave_assets' not in st.session_state:
+        st.session_state.last_autosave_assets = None
+    
+    # Undo/redo stacks of structural diffs and the last recorded project state
+    if 'history' not in st.session_state:
+        st.session_state.history = {'undo': [], 'redo': [], 'assets': None, 'project': None}
+    
+    # Projects opened in this session ({project key: project_data, assets, history}) and the
+    # versions last written to the workspace, so switching back is a reference swap
+    if 'workspace' not in st.session_state:
+        st.session_state.workspace = {'open_projects': {}, 'saved': {}}
+    
+    # Per-asset and project-wide counters for the Stage 4 summary (see get_project_aggregates)
+    if 'project_aggregates' not in st.session_state:
+        st.session_state.project_aggregates = {'assets': None, 'asset_ids': Counter(), 'by_asset': {},
+                                               'totals': dict.fromkeys(AGGREGATE_FIELDS, 0), 'summary': None}
+    
+    # Portfolio analytics of the assets list they were computed for, and compact payloads of
+    # asset versions: {id(asset): (asset, payload)} (see get_portfolio_analytics)
+    if 'portfolio_analytics' not in st.session_state:
+        st.session_state.portfolio_analytics = {'assets': None, 'result': None, 'compact': {}}
+    
+    # Consequence/likelihood rating and task cost arrays of the assets list they were built for, and
+    # of asset versions: {id(asset): (asset, ratings, task costs)} (see get_risk_ratings)
+    if 'risk_ratings' not in st.session_state:
+        st.session_state.risk_ratings = {'assets': None, 'by_asset': {}, 'ratings': None, 'task_costs': None,
+                                         'asset_index': None, 'mode_position': None}
+    
+    # Risk reduction of the assets list and thresholds it was computed for (see get_risk_reduction)
+    if 'risk_reduction' not in st.session_state:
+        st.session_state.risk_reduction = {'assets': None, 'thresholds': None, 'result': None}
+    
+    # Task selection of the assets list and parameters it was optimised for (see get_budget_optimization)
+    if 'budget_optimization' not in st.session_state:
+        st.session_state.budget_optimization = {'assets': None, 'candidates': None, 'parameters': None,
+                                                'result': None}
+    
+    # Levelled maintenance calendar of the assets list and parameters it was built for (see get_maintenance_schedule)
+    if 'maintenance_schedule' not in st.session_state:
+        st.session_state.maintenance_schedule = {'assets': None, 'parameters': None, 'result': None}
+    
+    # Content digests of asset versions: {id(asset): (asset, digest)} (see get_asset_digest)
+    if 'asset_digests' not in st.session_state:
+        st.session_state.asset_digests = {}
+    
     # Flag to track if we've attempted autorestore
     if 'autorestore_attempted' not in st.session_state:
         st.session_state.autorestore_attempted = False
     
+    # Asset register: bumped whenever assets are added, changed or deleted in Stage 1,
+    # so the register table starts with a fresh row selection
+    if 'asset_register_version' not in st.session_state:
+        st.session_state.asset_register_version = 0
+    
     # Risk matrix configuration thresholds
     if 'risk_moderate_threshold' not in st.session_state:
         st.session_state.risk_moderate_threshold = 6
@@ -292,17 +397,100 @@ def initialize_session_state():
     if 'risk_high_threshold' not in st.session_state:
         st.session_state.risk_high_threshold = 8
 
+# Stage 2 input widgets whose values survive switching between analysis steps,
+# with the starting value of those that need one
+STAGE_2_WIDGET_DEFAULTS = {
+    'stage2_active_step': None,
+    # Step 2: Functions
+    'function_type_input': None,
+    'function_verb_input': None,
+    'function_object_input': None,
+    'performance_std_input': None,
+    'function_delete_select': None,
+    # Step 3: Functional Failures
+    'ff_function_select': None,
+    'ff_description_input': None,
+    'ff_category_input': None,
+    'ff_selection': None,
+    # Step 4: Failure Modes
+    'fm_failure_select': None,
+    'fm_component_input': None,
+    'fm_description_input': None,
+    'fm_category_input': None,
+    'fm_selection': None,
+    # Step 5: Failure Effects
+    'effect_mode_select': None,
+    'effect_evidence_input': None,
+    'effect_safety_input': None,
+    'effect_operational_input': None,
+    'effect_damage_input': None,
+    'effect_repair_input': None,
+    'effect_repair_time_input': None,
+    'effect_downtime_input': None,
+    'effect_selection': None,
+    # Step 6: Consequences
+    'consequence_mode_select': None,
+    'consequence_evident_input': None,
+    'consequence_hidden_type_input': None,
+    'consequence_evident_type_input': None,
+    'consequence_rating_input': "3-Moderate",
+    'likelihood_rating_input': "3-Occasional",
+    'consequence_selection': None,
+    # Step 7: Task Selection
+    'task_mode_select': None,
+    'task_type_input': None,
+    'cbm_potential_failure_input': None,
+    'cbm_pf_interval_input': None,
+    'cbm_inspection_method_input': None,
+    'cbm_inspection_frequency_input': None,
+    'cbm_inspection_unit_input': None,
+    'ftm_task_action_input': None,
+    'ftm_interval_value_input': None,
+    'ftm_interval_unit_input': None,
+    'ftm_useful_life_input': None,
+    'ftm_mtbf_input': None,
+    'ftm_post_consequence': "3-Moderate",
+    'ftm_post_likelihood': "3-Occasional",
+    'ff_test_method_input': None,
+    'ff_mtbf_protective_input': None,
+    'ff_availability_input': None,
+    'redesign_type_input': None,
+    'redesign_description_input': None,
+    'redesign_post_consequence': "3-Moderate",
+    'redesign_post_likelihood': "3-Occasional",
+    'otf_reason_input': None,
+    'technically_feasible_input': None,
+    'worth_doing_input': None,
+    'justification_input': None,
+    'task_labour': None,
+    'task_parts': None,
+    'task_other': None,
+    'failure_labour': None,
+    'failure_parts': None,
+    'failure_other': None,
+    'task_crew_hours': None,
+    'task_selection': None
+}
+
+def preserve_stage_2_widget_state():
+    """Keep Stage 2 widget values while their step is not rendered
+    
+    Streamlit drops the state of widgets that were not drawn in a run, so without this
+    every input of a step would reset when the user switches to another step and back.
+    """
+    for key, default in STAGE_2_WIDGET_DEFAULTS.items():
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
+        elif default is not None:
+            st.session_state[key] = default
+
 initialize_session_state()
+preserve_stage_2_widget_state()
 
 # Risk Classification Helper Functions
 def get_risk_level(risk_score):
     """Get risk level based on score and current thresholds"""
-    if risk_score >= st.session_state.risk_high_threshold:
-        return "High", "red"
-    elif risk_score >= st.session_state.risk_moderate_threshold:
-        return "Moderate", "orange"
-    else:
-        return "Low", "green"
+    return classify_risk(risk_score, st.session_state.risk_moderate_threshold, st.session_state.risk_high_threshold)
 
 def get_risk_matrix_cell_class(score):
     """Get CSS class for risk matrix cell based on score"""
@@ -322,46 +510,51 @@ def get_risk_matrix_cell_label(score):
     else:
         return "L"
 
-def generate_risk_matrix_html():
-    """Generate dynamic risk matrix HTML based on current thresholds"""
-    moderate_thresh = st.session_state.risk_moderate_threshold
-    high_thresh = st.session_state.risk_high_threshold
-    
-    # Calculate score ranges for legend
-    low_max = moderate_thresh - 1
-    moderate_max = high_thresh - 1
-    
-    matrix_html = f"""
+# Styles of the risk matrix tables (threshold matrix and heat maps)
+RISK_MATRIX_CSS = """
     <style>
-        .risk-matrix {{
+        .risk-matrix {
             width: 100%;
             border-collapse: collapse;
             margin: 20px 0;
             font-size: 14px;
-        }}
-        .risk-matrix th, .risk-matrix td {{
+        }
+        .risk-matrix th, .risk-matrix td {
             border: 1px solid #ddd;
             padding: 12px;
             text-align: center;
             font-weight: bold;
-        }}
-        .risk-matrix th {{
+        }
+        .risk-matrix th {
             background-color: #f0f0f0;
             color: #333;
-        }}
-        .risk-low {{
+        }
+        .risk-low {
             background-color: #90EE90;
             color: #000;
-        }}
-        .risk-medium {{
+        }
+        .risk-medium {
             background-color: #FFA500;
             color: #fff;
-        }}
-        .risk-high {{
+        }
+        .risk-high {
             background-color: #FF6B6B;
             color: #fff;
-        }}
+        }
     </style>
+"""
+
+def generate_risk_matrix_html():
+    """Generate dynamic risk matrix HTML based on current thresholds"""
+    moderate_thresh = st.session_state.risk_moderate_threshold
+    high_thresh = st.session_state.risk_high_threshold
+    
+    # Calculate score ranges for legend
+    low_max = moderate_thresh - 1
+    moderate_max = high_thresh - 1
+    
+    matrix_html = f"""
+    {RISK_MATRIX_CSS}
     <table class="risk-matrix">
         <tr>
             <th>Consequence →<br>Likelihood ↓</th>
@@ -418,72 +611,48 @@ def generate_risk_matrix_html():
     """
     return matrix_html
 
+def generate_risk_heat_map_html(counts):
+    """Generate a risk matrix HTML table with the number of failure modes in each cell
+    
+    counts is a 5x5 array: row = likelihood - 1, column = consequence - 1. Cells are coloured
+    by the current thresholds.
+    """
+    header = ''.join(f"<th>{rating}</th>" for rating in CONSEQUENCE_RATINGS)
+    rows = []
+    for likelihood in range(len(LIKELIHOOD_RATINGS), 0, -1):
+        cells = ''.join(
+            f'<td class="{get_risk_matrix_cell_class(consequence + likelihood)}">{counts[likelihood - 1][consequence - 1]}</td>'
+            for consequence in range(1, len(CONSEQUENCE_RATINGS) + 1))
+        rows.append(f"<tr><th>{LIKELIHOOD_RATINGS[likelihood - 1]}</th>{cells}</tr>")
+    return f"""
+    {RISK_MATRIX_CSS}
+    <table class="risk-matrix">
+        <tr><th>Consequence →<br>Likelihood ↓</th>{header}</tr>
+        {''.join(rows)}
+    </table>
+    """
+
 # Import/Export Helper Functions
 def create_export_data():
     """Create export data structure from session state"""
-    # Check if there's project data or legacy asset data
-    if not st.session_state.project_data.get('project_no') and not st.session_state.asset_data.get('asset_name'):
-        return None
-    
-    export_data = {
-        "application_info": {
-            "name": APP_NAME,
-            "version": APP_VERSION,
-            "authority": AUTHORITY_NAME,
-            "department": DEPARTMENT
-        },
-        "project_information": st.session_state.project_data,
-        "assets": st.session_state.assets,
-        # Legacy support - for backward compatibility
-        "asset_information": st.session_state.asset_data,
-        "operating_context": st.session_state.operating_context,
-        "components": st.session_state.get('components', []),
-        "functions": st.session_state.functions,
-        "functional_failures": st.session_state.functional_failures,
-        "failure_modes": st.session_state.failure_modes,
-        "analysis_results": st.session_state.analysis_results,
-        "export_date": datetime.now().isoformat()
-    }
-    return export_data
+    return build_export_data(st.session_state, {
+        "name": APP_NAME,
+        "version": APP_VERSION,
+        "authority": AUTHORITY_NAME,
+        "department": DEPARTMENT
+    })
 
 def load_import_data(import_data):
     """Load imported data into session state"""
     try:
-        # Load project information (new format)
-        if "project_information" in import_data:
-            st.session_state.project_data = import_data["project_information"]
-        
-        # Load assets (new format)
-        if "assets" in import_data:
-            st.session_state.assets = import_data["assets"]
+        # Project information and assets (new format) and legacy single-asset data;
+        # analysis results are derived from the failure modes
+        for session_key, value in parse_project_data(import_data).items():
+            st.session_state[session_key] = value
         
-        # Load asset information (legacy format)
-        if "asset_information" in import_data:
-            st.session_state.asset_data = import_data["asset_information"]
-        
-        # Load operating context
-        if "operating_context" in import_data:
-            st.session_state.operating_context = import_data["operating_context"]
-        
-        # Load components
-        if "components" in import_data:
-            st.session_state.components = import_data["components"]
-        
-        # Load functions
-        if "functions" in import_data:
-            st.session_state.functions = import_data["functions"]
-        
-        # Load functional failures
-        if "functional_failures" in import_data:
-            st.session_state.functional_failures = import_data["functional_failures"]
-        
-        # Load failure modes
-        if "failure_modes" in import_data:
-            st.session_state.failure_modes = import_data["failure_modes"]
-        
-        # Load analysis results
-        if "analysis_results" in import_data:
-            st.session_state.analysis_results = import_data["analysis_results"]
+        # Imported assets replace everything, so no cached table or register selection is still valid
+        invalidate_analysis_tables()
+        st.session_state.asset_register_version += 1
         
         return True
     except Exception as e:
@@ -504,15 +673,16 @@ def autosave_session_data():
         if not st.session_state.project_data.get('project_no') and not st.session_state.asset_data.get('asset_name'):
             return
         
-        # Create a hash of current data to detect changes
+        # Create a hash of current data to detect changes; the assets list is replaced on every
+        # change (see Asset Tree Functions), so comparing its identity covers all asset edits
         current_data_hash = hash(json.dumps({
             "project": st.session_state.project_data,
-            "assets_count": len(st.session_state.assets),
             "stage": st.session_state.current_stage
         }, sort_keys=True))
         
         # Only save if data has changed
-        if hasattr(st.session_state, 'last_autosave_hash') and st.session_state.last_autosave_hash == current_data_hash:
+        if (st.session_state.get('last_autosave_hash') == current_data_hash
+                and st.session_state.get('last_autosave_assets') is st.session_state.assets):
             return
         
         save_data = {
@@ -539,8 +709,9 @@ def autosave_session_data():
         with open(autosave_path, 'w') as f:
             json.dump(save_data, f, indent=2)
         
-        # Store hash to avoid redundant saves
+        # Store hash and assets version to avoid redundant saves
         st.session_state.last_autosave_hash = current_data_hash
+        st.session_state.last_autosave_assets = st.session_state.assets
         
     except Exception as e:
         # Silently fail - don't interrupt user workflow
@@ -563,36 +734,12 @@ def restore_session_data():
             saved_data = json.load(f)
         
         # Load the saved data
-        if "project_information" in saved_data:
-            st.session_state.project_data = saved_data["project_information"]
-        
-        if "assets" in saved_data:
-            st.session_state.assets = saved_data["assets"]
+        for session_key, value in parse_project_data(saved_data).items():
+            st.session_state[session_key] = value
         
         if "current_asset_index" in saved_data:
             st.session_state.current_asset_index = saved_data["current_asset_index"]
         
-        if "asset_information" in saved_data:
-            st.session_state.asset_data = saved_data["asset_information"]
-        
-        if "operating_context" in saved_data:
-            st.session_state.operating_context = saved_data["operating_context"]
-        
-        if "components" in saved_data:
-            st.session_state.components = saved_data["components"]
-        
-        if "functions" in saved_data:
-            st.session_state.functions = saved_data["functions"]
-        
-        if "functional_failures" in saved_data:
-            st.session_state.functional_failures = saved_data["functional_failures"]
-        
-        if "failure_modes" in saved_data:
-            st.session_state.failure_modes = saved_data["failure_modes"]
-        
-        if "analysis_results" in saved_data:
-            st.session_state.analysis_results = saved_data["analysis_results"]
-        
         if "current_stage" in saved_data:
             st.session_state.current_stage = saved_data["current_stage"]
         
@@ -617,16 +764,1266 @@ def save_asset_analysis_data():
         if 'selected_analysis_asset' in st.session_state and st.session_state.selected_analysis_asset is not None:
             asset_index = st.session_state.selected_analysis_asset
             if 0 <= asset_index < len(st.session_state.assets):
-                st.session_state.assets[asset_index]['components'] = st.session_state.get('components', [])
-                st.session_state.assets[asset_index]['functions'] = st.session_state.get('functions', [])
-                st.session_state.assets[asset_index]['functional_failures'] = st.session_state.get('functional_failures', [])
-                st.session_state.assets[asset_index]['failure_modes'] = st.session_state.get('failure_modes', [])
-                st.session_state.assets[asset_index]['analysis_results'] = st.session_state.get('analysis_results', [])
-                st.session_state.assets[asset_index]['operating_context'] = st.session_state.get('operating_context', {})
-                autosave_session_data()
+                asset = st.session_state.assets[asset_index]
+                changes = {}
+                for key in ['components', 'functions', 'functional_failures', 'failure_modes']:
+                    committed = share_unchanged_records(asset.get(key, []), st.session_state.get(key, []))
+                    if committed is not asset.get(key):
+                        changes[key] = committed
+                # analysis_results is derived from the failure modes' tasks, reusing unchanged rows
+                analysis_results = derive_analysis_results(changes.get('failure_modes', asset.get('failure_modes', [])),
+                                                           asset.get('failure_modes', []), asset.get('analysis_results', []))
+                if analysis_results is not asset.get('analysis_results'):
+                    changes['analysis_results'] = analysis_results
+                st.session_state.analysis_results = list(analysis_results)
+                operating_context = st.session_state.get('operating_context', {})
+                if operating_context != asset.get('operating_context', {}):
+                    changes['operating_context'] = dict(operating_context)
+                if changes:
+                    update_asset(asset_index, **changes)
+                    autosave_session_data()
     except Exception as e:
         print(f"Error saving asset analysis data: {str(e)}")
 
+# Asset Tree Functions
+# The assets list and the asset and record dicts in it are never modified in place. A change
+# builds a new list and a new dict for the changed asset only (path copying), so everything else
+# is shared between versions: an old assets list is a complete snapshot of the project, and
+# "assets is not previous_assets" is enough to detect a change. Stage 2 edits a one-level copy
+# of the selected asset's records and commits it with save_asset_analysis_data().
+def update_asset(asset_index, **fields):
+    """Replace fields of one asset, path-copying the assets list and that asset"""
+    assets = list(st.session_state.assets)
+    assets[asset_index] = dict(assets[asset_index], **fields)
+    st.session_state.assets = assets
+    invalidate_analysis_tables(asset_index)
+    if st.session_state.get('last_loaded_asset') == asset_index:
+        # Stage 2 re-reads the asset on its next full run
+        del st.session_state.last_loaded_asset
+
+def append_asset(asset):
+    """Add an asset at the end of the assets list"""
+    st.session_state.assets = st.session_state.assets + [asset]
+
+def share_unchanged_records(committed, working):
+    """Return working as a list that reuses the committed list or records wherever they are unchanged
+    
+    Changed records are copied, because the working list is edited in place afterwards.
+    """
+    if len(committed) == len(working) and all(old == new for old, new in zip(committed, working)):
+        return committed
+    shared = []
+    for i, record in enumerate(working):
+        if i < len(committed) and committed[i] == record:
+            shared.append(committed[i])
+        else:
+            shared.append(dict(record) if isinstance(record, dict) else record)
+    return shared
+
+# Undo/Redo History Functions
+# Each history entry is a structural diff between two versions of the asset tree. Because the
+# tree is copy-on-write, unchanged assets and records are compared by identity and the diff only
+# holds references to the assets, fields and records that were replaced. The memory a diff keeps
+# alive is estimated from the JSON size of those replaced records.
+HISTORY_MISSING = object()
+
+def _history_value_size(value):
+    """Estimate the memory of a history value from its JSON size"""
+    if value is HISTORY_MISSING:
+        return 0
+    try:
+        return len(json.dumps(value, default=str))
+    except Exception:
+        return 0
+
+def _history_field_size(old_value, new_value):
+    """Estimate the memory of a changed field, counting only records not shared by both sides"""
+    if isinstance(old_value, list) and isinstance(new_value, list):
+        old_ids = {id(record) for record in old_value}
+        new_ids = {id(record) for record in new_value}
+        return (8 * (len(old_value) + len(new_value))
+                + sum(_history_value_size(record) for record in old_value if id(record) not in new_ids)
+                + sum(_history_value_size(record) for record in new_value if id(record) not in old_ids))
+    return _history_value_size(old_value) + _history_value_size(new_value)
+
+def diff_assets(old_assets, new_assets):
+    """Build a structural diff between two versions of the assets list
+    
+    Returns (operations, size). Operations cover both lists in order: ('equal', ...) spans are
+    shared; ('fields', ...) spans hold, per asset, the {key: (old, new)} values that changed;
+    ('segment', ...) spans hold the removed and inserted assets.
+    """
+    matcher = difflib.SequenceMatcher(None, [id(asset) for asset in old_assets],
+                                      [id(asset) for asset in new_assets], autojunk=False)
+    operations = []
+    size = 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            operations.append(('equal', i1, i2, j1, j2))
+        elif tag == 'replace' and i2 - i1 == j2 - j1:
+            changes = []
+            for old_asset, new_asset in zip(old_assets[i1:i2], new_assets[j1:j2]):
+                fields = {}
+                for key in list(old_asset) + [key for key in new_asset if key not in old_asset]:
+                    old_value = old_asset.get(key, HISTORY_MISSING)
+                    new_value = new_asset.get(key, HISTORY_MISSING)
+                    if old_value is not new_value:
+                        fields[key] = (old_value, new_value)
+                        size += _history_field_size(old_value, new_value)
+                changes.append(fields)
+            operations.append(('fields', i1, i2, j1, j2, changes))
+        else:
+            removed = old_assets[i1:i2]
+            inserted = new_assets[j1:j2]
+            size += sum(_history_value_size(asset) for asset in removed + inserted)
+            operations.append(('segment', i1, i2, j1, j2, removed, inserted))
+    return operations, size
+
+def apply_assets_diff(operations, assets, forward):
+    """Rebuild one side of a diff from the other: forward turns old into new, otherwise new into old"""
+    result = []
+    for operation in operations:
+        tag, i1, i2, j1, j2 = operation[:5]
+        start, end = (i1, i2) if forward else (j1, j2)
+        if tag == 'equal':
+            result.extend(assets[start:end])
+        elif tag == 'fields':
+            for asset, fields in zip(assets[start:end], operation[5]):
+                restored = dict(asset)
+                for key, (old_value, new_value) in fields.items():
+                    value = new_value if forward else old_value
+                    if value is HISTORY_MISSING:
+                        restored.pop(key, None)
+                    else:
+                        restored[key] = value
+                result.append(restored)
+        else:
+            result.extend(operation[6] if forward else operation[5])
+    return result
+
+def describe_history_change(operations, project_changed):
+    """Short label of a history entry for the Undo/Redo buttons"""
+    labels = []
+    for operation in operations:
+        tag = operation[0]
+        if tag == 'fields':
+            labels.append(f"edit {operation[2] - operation[1]} asset(s)")
+        elif tag == 'segment':
+            if operation[5]:
+                labels.append(f"remove {len(operation[5])} asset(s)")
+            if operation[6]:
+                labels.append(f"add {len(operation[6])} asset(s)")
+    if project_changed:
+        labels.append("project information")
+    return ", ".join(labels).capitalize() or "Change"
+
+def trim_history():
+    """Evict the oldest history entries until the history fits the configured memory budget"""
+    history = st.session_state.history
+    budget = config_data['UNDO_MEMORY_MB'] * 1024 * 1024
+    total = sum(entry['size'] for entry in history['undo'] + history['redo'])
+    while total > budget and (history['undo'] or history['redo']):
+        # Oldest first: the bottom of the undo stack, then the redo step furthest from the present
+        entry = history['undo'].pop(0) if history['undo'] else history['redo'].pop(0)
+        total -= entry['size']
+
+def record_history():
+    """Push the change made since the last recorded state onto the undo stack"""
+    history = st.session_state.history
+    assets = st.session_state.assets
+    project = st.session_state.project_data
+    if history['assets'] is None:
+        history['assets'] = assets
+        history['project'] = project
+        return
+    if assets is history['assets'] and project is history['project']:
+        return
+    
+    operations, size = diff_assets(history['assets'], assets)
+    project_changed = project is not history['project']
+    if project_changed:
+        size += _history_value_size(history['project']) + _history_value_size(project)
+    history['undo'].append({
+        'label': describe_history_change(operations, project_changed),
+        'operations': operations,
+        'project': (history['project'], project) if project_changed else None,
+        'size': size
+    })
+    history['redo'] = []
+    history['assets'] = assets
+    history['project'] = project
+    trim_history()
+
+def step_history(undo=True):
+    """Undo or redo the most recent history entry"""
+    history = st.session_state.history
+    record_history()
+    source, target = (history['undo'], history['redo']) if undo else (history['redo'], history['undo'])
+    if not source:
+        return False
+    entry = source.pop()
+    st.session_state.assets = apply_assets_diff(entry['operations'], st.session_state.assets, forward=not undo)
+    if entry['project'] is not None:
+        st.session_state.project_data = entry['project'][0] if undo else entry['project'][1]
+    target.append(entry)
+    history['assets'] = st.session_state.assets
+    history['project'] = st.session_state.project_data
+    
+    # Selections and the Stage 2 working copy may point at assets that changed or no longer exist
+    st.session_state.current_asset_index = None
+    st.session_state.editing_component = None
+    if st.session_state.get('selected_analysis_asset', 0) >= len(st.session_state.assets):
+        st.session_state.selected_analysis_asset = 0
+    if 'last_loaded_asset' in st.session_state:
+        del st.session_state.last_loaded_asset
+    st.session_state.asset_register_version += 1
+    invalidate_analysis_tables()
+    autosave_session_data()
+    return True
+
+# Analysis Table Cache Functions
+def get_analysis_data_version(asset_index):
+    """Get the data version of an asset; it changes whenever the asset's analysis is edited"""
+    return st.session_state.analysis_data_versions.get(asset_index, 0)
+
+def invalidate_analysis_tables(asset_index=None):
+    """Bump an asset's data version and drop its cached tables (all assets if asset_index is None)"""
+    versions = st.session_state.analysis_data_versions
+    cache = st.session_state.analysis_table_cache
+    if asset_index is None:
+        # Asset indices may have shifted (delete/import) - start every asset on a new version
+        for idx in set(versions) | {key[0] for key in cache} | set(range(len(st.session_state.assets))):
+            versions[idx] = versions.get(idx, 0) + 1
+        cache.clear()
+    else:
+        versions[asset_index] = versions.get(asset_index, 0) + 1
+        for key in [k for k in cache if k[0] == asset_index]:
+            del cache[key]
+
+def get_cached_analysis_table(table_key, build_table):
+    """Return a Stage 2 table for the selected asset, rebuilding it only after the asset changes
+    
+    table_key identifies the table and any filter it depends on, e.g. ('failure_modes', 'FF-1.1').
+    build_table is called without arguments when there is no cached table for the current version.
+    """
+    asset_index = st.session_state.get('selected_analysis_asset')
+    version = get_analysis_data_version(asset_index)
+    cache_key = (asset_index,) + tuple(table_key)
+    
+    cached = st.session_state.analysis_table_cache.get(cache_key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    
+    table = build_table()
+    st.session_state.analysis_table_cache[cache_key] = (version, table)
+    return table
+
+def build_failure_effects_table(modes_with_effects):
+    """Build the Step 5 failure effects display table"""
+    effects_display = []
+    for m in modes_with_effects:
+        effects_display.append({
+            'Failure Mode ID': m['id'],
+            'Component': m['component'],
+            'Description': m['description'],
+            'Evidence': m['effects'].get('evidence', 'N/A'),
+            'Safety Impact': m['effects'].get('safety_impact', 'N/A'),
+            'Operational Impact': m['effects'].get('operational_impact', 'N/A'),
+            'Physical Damage': m['effects'].get('physical_damage', 'N/A'),
+            'Repair Action': m['effects'].get('repair_action', 'N/A'),
+            'Repair Time (hrs)': m['effects'].get('repair_time', 0),
+            'Downtime (hrs)': m['effects'].get('downtime', 0)
+        })
+    return pd.DataFrame(effects_display)
+
+def build_consequences_table(modes_with_consequences):
+    """Build the Step 6 consequence categories display table"""
+    consequences_display = []
+    for m in modes_with_consequences:
+        consequences_display.append({
+            'Failure Mode ID': m['id'],
+            'Component': m['component'],
+            'Description': m['description'],
+            'Consequence Category': m.get('consequence_category', 'N/A'),
+            'Risk Level': m.get('risk_assessment', {}).get('risk_level', 'N/A') if 'risk_assessment' in m else 'N/A'
+        })
+    return pd.DataFrame(consequences_display)
+
+def build_tasks_table(modes_with_tasks):
+    """Build the Step 7 failure management tasks display table"""
+    tasks_display = []
+    for m in modes_with_tasks:
+        task = m.get('management_task', {})
+        post_risk = task.get('post_risk_assessment', {})
+        
+        task_data = {
+            'Failure Mode ID': m['id'],
+            'Component': m['component'],
+            'Description': m['description'],
+            'Consequence': m.get('consequence_category', 'N/A'),
+            'Task Type': task.get('task_type', 'N/A'),
+            'Task Description': task.get('description', 'N/A'),
+            'Technically Feasible': task.get('technically_feasible', 'N/A'),
+            'Worth Doing': task.get('worth_doing', 'N/A'),
+            'Justification': task.get('justification', 'N/A'),
+            'Task Cost': f"${task.get('cost', 0):,.2f}",
+            'Failure Cost': f"${task.get('failure_cost', 0):,.2f}",
+            'Crew Hours': task.get('crew_hours', 0)
+        }
+        
+        # Add post-risk assessment data if available
+        if post_risk:
+            task_data['Post-Risk Consequence'] = post_risk.get('consequence', 'N/A')
+            task_data['Post-Risk Likelihood'] = post_risk.get('likelihood', 'N/A')
+            task_data['Post-Risk Level'] = post_risk.get('risk_level', 'N/A')
+            task_data['Post-Risk Score'] = post_risk.get('risk_score', 'N/A')
+        else:
+            task_data['Post-Risk Consequence'] = 'N/A'
+            task_data['Post-Risk Likelihood'] = 'N/A'
+            task_data['Post-Risk Level'] = 'N/A'
+            task_data['Post-Risk Score'] = 'N/A'
+        
+        tasks_display.append(task_data)
+    return pd.DataFrame(tasks_display)
+
+# Project Aggregate Functions
+def compute_asset_aggregates(asset):
+    """Count an asset's records and sum its annual task cost"""
+    analysis_results = asset.get('analysis_results', [])
+    return {
+        'components': len(asset.get('components', [])),
+        'functions': len(asset.get('functions', [])),
+        'functional_failures': len(asset.get('functional_failures', [])),
+        'failure_modes': len(asset.get('failure_modes', [])),
+        'tasks': len(analysis_results),
+        'annual_cost': sum(r.get('cost', 0) for r in analysis_results)
+    }
+
+def get_project_aggregates():
+    """Per-asset counters and project totals for the current assets list, maintained incrementally
+    
+    Assets are copy-on-write, so an asset object still in the list is unchanged and keeps its counters.
+    Only assets added, replaced or removed since the last call are counted, and the totals are adjusted
+    by their difference. Returns a dict with 'by_asset' ({id(asset): (asset, counters)}), 'totals' and
+    'summary' (the Assets Overview DataFrame).
+    """
+    aggregates = st.session_state.project_aggregates
+    assets = st.session_state.assets
+    if aggregates['assets'] is assets:
+        return aggregates
+    
+    by_asset = aggregates['by_asset']
+    totals = aggregates['totals']
+    asset_ids = Counter(id(asset) for asset in assets)
+    for asset in assets:
+        if id(asset) not in by_asset:
+            by_asset[id(asset)] = (asset, compute_asset_aggregates(asset))
+    
+    added = asset_ids - aggregates['asset_ids']
+    removed = aggregates['asset_ids'] - asset_ids
+    for asset_id, count in added.items():
+        for field in AGGREGATE_FIELDS:
+            totals[field] += count * by_asset[asset_id][1][field]
+    for asset_id, count in removed.items():
+        for field in AGGREGATE_FIELDS:
+            totals[field] -= count * by_asset[asset_id][1][field]
+        if asset_id not in asset_ids:
+            del by_asset[asset_id]
+    if not assets:
+        # Start from exact zeros rather than the rounding left over from float subtraction
+        totals.update(dict.fromkeys(AGGREGATE_FIELDS, 0))
+    
+    aggregates['asset_ids'] = asset_ids
+    aggregates['assets'] = assets
+    aggregates['summary'] = pd.DataFrame([{
+        'Asset Name': asset['asset_name'],
+        'Class': asset['asset_class'],
+        'Components': by_asset[id(asset)][1]['components'],
+        'Failure Modes': by_asset[id(asset)][1]['failure_modes'],
+        'Tasks': by_asset[id(asset)][1]['tasks'],
+        'Annual Cost ($)': by_asset[id(asset)][1]['annual_cost']
+    } for asset in assets])
+    return aggregates
+
+# Portfolio Analytics Functions
+@st.cache_resource
+def get_analytics_executor():
+    """Process pool for portfolio analytics, shared by all sessions; workers start on first use
+    
+    Workers are spawned rather than forked, since forking the multithreaded Streamlit server can
+    deadlock a worker on a lock held by another thread.
+    """
+    return ProcessPoolExecutor(max_workers=config_data['ANALYTICS_WORKERS'] or None,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+def get_portfolio_analytics():
+    """Risk, cost and task analytics of the current assets, recomputed only when the assets list changes
+    
+    Compact payloads are kept per asset version, so only changed assets are compacted again. Large
+    portfolios are analysed in the shared process pool (see rcm_analytics).
+    """
+    cache = st.session_state.portfolio_analytics
+    assets = st.session_state.assets
+    if cache['assets'] is assets:
+        return cache['result']
+    
+    compact = cache['compact']
+    payloads = []
+    for asset in assets:
+        cached = compact.get(id(asset))
+        if cached is None or cached[0] is not asset:
+            cached = (asset, compact_asset(asset))
+            compact[id(asset)] = cached
+        payloads.append(cached[1])
+    current = {id(asset) for asset in assets}
+    for asset_id in [asset_id for asset_id in compact if asset_id not in current]:
+        del compact[asset_id]
+    
+    cache['result'] = compute_portfolio_analytics(payloads, get_analytics_executor(),
+                                                  config_data['ANALYTICS_WORKERS'] or None)
+    cache['assets'] = assets
+    return cache['result']
+
+def get_risk_ratings():
+    """Rating arrays of every failure mode of the current assets, rebuilt only when the assets list changes
+    
+    Returns a dict with 'ratings' (consequence, likelihood, post-task consequence, post-task
+    likelihood per failure mode), 'task_costs', 'asset_index' and 'mode_position' (see
+    rcm_analytics). Arrays are kept per asset version, so only changed assets are read again.
+    """
+    cache = st.session_state.risk_ratings
+    assets = st.session_state.assets
+    if cache['assets'] is assets:
+        return cache
+    
+    by_asset = cache['by_asset']
+    arrays = []
+    for asset in assets:
+        cached = by_asset.get(id(asset))
+        if cached is None or cached[0] is not asset:
+            cached = (asset, risk_rating_array(asset), task_cost_array(asset))
+            by_asset[id(asset)] = cached
+        arrays.append(cached[1:])
+    current = {id(asset) for asset in assets}
+    for asset_id in [asset_id for asset_id in by_asset if asset_id not in current]:
+        del by_asset[asset_id]
+    
+    cache['ratings'], cache['asset_index'], cache['mode_position'] = combine_rating_arrays(
+        [ratings for ratings, _ in arrays])
+    cache['task_costs'] = np.concatenate([costs for _, costs in arrays]) if arrays else np.zeros(0)
+    cache['assets'] = assets
+    return cache
+
+def get_risk_reduction():
+    """Risk reduction of every task, per asset and for the project (see compute_risk_reduction)
+    
+    Recomputed only when the assets list or the risk thresholds change.
+    """
+    cache = st.session_state.risk_reduction
+    assets = st.session_state.assets
+    thresholds = (st.session_state.risk_moderate_threshold, st.session_state.risk_high_threshold)
+    if cache['assets'] is assets and cache['thresholds'] == thresholds:
+        return cache['result']
+    
+    risk_ratings = get_risk_ratings()
+    cache['result'] = compute_risk_reduction(risk_ratings['ratings'], risk_ratings['task_costs'],
+                                             risk_ratings['asset_index'], len(assets), *thresholds)
+    cache['assets'] = assets
+    cache['thresholds'] = thresholds
+    return cache['result']
+
+def get_task_candidates():
+    """Cost, crew hours and value arrays of every task of the current assets (see task_candidates)"""
+    cache = st.session_state.budget_optimization
+    assets = st.session_state.assets
+    if cache['assets'] is not assets:
+        cache['candidates'] = task_candidates(assets)
+        cache['parameters'] = None
+        cache['assets'] = assets
+    return cache['candidates']
+
+def get_budget_optimization(objective, budget, hours_limit):
+    """Greedy and optimal task selections and the efficient frontier within a budget (see rcm_optimizer)
+    
+    Recomputed only when the assets list or the parameters change.
+    """
+    candidates = get_task_candidates()
+    cache = st.session_state.budget_optimization
+    parameters = (objective, budget, hours_limit)
+    if cache['parameters'] == parameters:
+        return cache['result']
+    
+    values = candidates[objective]
+    cache['result'] = {
+        'greedy': greedy_selection(values, candidates['cost'], candidates['hours'], budget, hours_limit),
+        'optimal': knapsack_selection(values, candidates['cost'], candidates['hours'], budget, hours_limit),
+        'frontier': efficient_frontier(values, candidates['cost'])
+    }
+    cache['parameters'] = parameters
+    return cache['result']
+
+def get_maintenance_schedule(start_date, horizon_years, capacity_by_site, operating_hours_per_week, default_task_hours):
+    """Levelled maintenance calendar of all assets (see rcm_schedule.build_schedule)
+    
+    Rebuilt only when the assets list or the parameters change.
+    """
+    cache = st.session_state.maintenance_schedule
+    assets = st.session_state.assets
+    parameters = (start_date, horizon_years, tuple(sorted(capacity_by_site.items())), operating_hours_per_week,
+                  default_task_hours)
+    if cache['assets'] is assets and cache['parameters'] == parameters:
+        return cache['result']
+    
+    cache['result'] = build_schedule(assets, start_date, horizon_years, capacity_by_site,
+                                     operating_hours_per_week=operating_hours_per_week,
+                                     default_task_hours=default_task_hours)
+    cache['assets'] = assets
+    cache['parameters'] = parameters
+    return cache['result']
+
+# Workbook Cache Functions
+# Generated Excel workbooks and PDF reports are cached by the content digest of the assets they
+# contain, so a rerun or a repeated download of unchanged data is served without building it again.
+# The cache is shared by all sessions (equal content gives equal bytes) and bounded in total size.
+WORKBOOK_FORMAT_VERSION = 2
+
+@st.cache_resource
+def get_workbook_cache():
+    """Process-wide LRU of generated workbooks: cache key -> bytes"""
+    return {'entries': OrderedDict(), 'bytes': 0, 'lock': Lock()}
+
+def get_asset_digest(asset):
+    """SHA-256 digest of an asset's content
+    
+    Assets are copy-on-write, so the digest of an asset object never changes and is computed
+    once per asset version.
+    """
+    digests = st.session_state.asset_digests
+    cached = digests.get(id(asset))
+    if cached is not None and cached[0] is asset:
+        return cached[1]
+    digest = hashlib.sha256(json.dumps(asset, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    digests[id(asset)] = (asset, digest)
+    if len(digests) > 2 * len(st.session_state.assets) + 16:
+        current = {id(a) for a in st.session_state.assets}
+        for asset_id in [asset_id for asset_id in digests if asset_id not in current]:
+            del digests[asset_id]
+    return digest
+
+def has_cached_workbook(cache_key):
+    """Whether the workbook or report of a cache key is cached"""
+    cache = get_workbook_cache()
+    with cache['lock']:
+        return (WORKBOOK_FORMAT_VERSION,) + tuple(cache_key) in cache['entries']
+
+def get_cached_workbook(cache_key, build_workbook):
+    """Return the workbook bytes for a cache key, calling build_workbook() only on a cache miss"""
+    cache = get_workbook_cache()
+    cache_key = (WORKBOOK_FORMAT_VERSION,) + tuple(cache_key)
+    with cache['lock']:
+        workbook = cache['entries'].get(cache_key)
+        if workbook is not None:
+            cache['entries'].move_to_end(cache_key)
+            return workbook
+    
+    workbook = build_workbook()
+    max_bytes = config_data['WORKBOOK_CACHE_MB'] * 1024 * 1024
+    if len(workbook) > max_bytes:
+        return workbook
+    with cache['lock']:
+        if cache_key not in cache['entries']:
+            cache['entries'][cache_key] = workbook
+            cache['bytes'] += len(workbook)
+        while cache['bytes'] > max_bytes:
+            _, evicted = cache['entries'].popitem(last=False)
+            cache['bytes'] -= len(evicted)
+    return workbook
+
+# Referential Integrity Functions
+def get_reference_index():
+    """Reverse indexes (function -> failures -> modes -> results) of the asset open in Stage 2"""
+    return get_cached_analysis_table(('reference_index',), lambda: build_reference_index(
+        st.session_state.functional_failures, st.session_state.failure_modes, st.session_state.analysis_results))
+
+def cascade_delete_analysis(function_ids=(), failure_ids=(), mode_ids=()):
+    """Delete records of the asset open in Stage 2 together with everything that depends on them
+    
+    Returns the cascade: the sets of deleted ids per record type.
+    """
+    cascade = collect_cascade(get_reference_index(), function_ids, failure_ids, mode_ids)
+    remaining = apply_cascade({key: st.session_state[key] for key in ANALYSIS_KEYS}, cascade)
+    for key in ANALYSIS_KEYS:
+        st.session_state[key] = remaining[key]
+    save_asset_analysis_data()
+    return cascade
+
+# Search Index Functions
+SEARCH_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+
+def tokenize_search_text(text):
+    """Split text into lowercase alphanumeric search terms"""
+    return SEARCH_TOKEN_PATTERN.findall(str(text).lower())
+
+def build_search_document(failure_mode):
+    """Collect the searchable text of a failure mode: component, description, category, effects and task"""
+    effects = failure_mode.get('effects', {})
+    task = failure_mode.get('management_task', {})
+    fields = [
+        failure_mode.get('component', ''),
+        failure_mode.get('description', ''),
+        failure_mode.get('category', ''),
+        effects.get('evidence', ''),
+        effects.get('safety_impact', ''),
+        effects.get('operational_impact', ''),
+        effects.get('physical_damage', ''),
+        effects.get('repair_action', ''),
+        failure_mode.get('consequence_category', ''),
+        task.get('task_type', ''),
+        task.get('description', ''),
+        task.get('justification', '')
+    ]
+    return " ".join(str(field) for field in fields if field)
+
+def _remove_search_document(index, doc_id):
+    """Remove a document and its postings from the search index"""
+    doc = index['docs'].pop(doc_id, None)
+    if doc is None:
+        return
+    for term in doc['terms']:
+        postings = index['postings'][term]
+        del postings[doc_id]
+        if not postings:
+            del index['postings'][term]
+    index['total_length'] -= doc['length']
+
+def _add_search_document(index, doc_id, text, failure_mode):
+    """Tokenise a document and add it to the search index postings"""
+    tokens = tokenize_search_text(text)
+    terms = {}
+    for token in tokens:
+        terms[token] = terms.get(token, 0) + 1
+    for term, count in terms.items():
+        index['postings'].setdefault(term, {})[doc_id] = count
+    index['docs'][doc_id] = {
+        'text': text,
+        'terms': list(terms),
+        'length': len(tokens),
+        'component': failure_mode.get('component', ''),
+        'description': failure_mode.get('description', ''),
+        'task': failure_mode.get('management_task', {}).get('description', '')
+    }
+    index['total_length'] += len(tokens)
+
+def refresh_search_index():
+    """Bring the search index up to date with the assets
+    
+    Only assets whose data version changed are re-read, and only their failure modes whose
+    text changed are re-tokenised. Documents are keyed by (asset index, failure mode id).
+    """
+    index = st.session_state.search_index
+    assets = st.session_state.assets
+    
+    stale_assets = [idx for idx in index['asset_versions'] if idx >= len(assets)]
+    for idx in range(len(assets)):
+        if index['asset_versions'].get(idx) != get_analysis_data_version(idx):
+            stale_assets.append(idx)
+    if not stale_assets:
+        return
+    
+    docs_by_asset = {}
+    for doc_id in index['docs']:
+        docs_by_asset.setdefault(doc_id[0], set()).add(doc_id)
+    
+    for idx in stale_assets:
+        old_doc_ids = docs_by_asset.get(idx, set())
+        current_doc_ids = set()
+        if idx < len(assets):
+            for failure_mode in assets[idx].get('failure_modes', []):
+                doc_id = (idx, failure_mode.get('id'))
+                text = build_search_document(failure_mode)
+                current_doc_ids.add(doc_id)
+                existing = index['docs'].get(doc_id)
+                if existing is not None and existing['text'] == text:
+                    continue
+                _remove_search_document(index, doc_id)
+                _add_search_document(index, doc_id, text, failure_mode)
+            index['asset_versions'][idx] = get_analysis_data_version(idx)
+        else:
+            index['asset_versions'].pop(idx, None)
+        
+        for doc_id in old_doc_ids - current_doc_ids:
+            _remove_search_document(index, doc_id)
+
+def search_failure_modes(query, limit=50):
+    """Rank failure modes across all assets against a query with BM25
+    
+    Returns a list of (score, asset index, failure mode id, document) tuples, best match first.
+    """
+    refresh_search_index()
+    index = st.session_state.search_index
+    doc_count = len(index['docs'])
+    query_terms = set(tokenize_search_text(query))
+    if not query_terms or not doc_count:
+        return []
+    
+    average_length = index['total_length'] / doc_count or 1
+    scores = {}
+    for term in query_terms:
+        postings = index['postings'].get(term)
+        if not postings:
+            continue
+        idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+        for doc_id, term_count in postings.items():
+            length_norm = 1 - SEARCH_BM25_B + SEARCH_BM25_B * index['docs'][doc_id]['length'] / average_length
+            scores[doc_id] = scores.get(doc_id, 0) + idf * term_count * (SEARCH_BM25_K1 + 1) / (term_count + SEARCH_BM25_K1 * length_norm)
+    
+    ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+    return [(score, doc_id[0], doc_id[1], index['docs'][doc_id]) for doc_id, score in ranked]
+
+# Failure Mode Library Functions
+FAILURE_MODE_CATEGORIES = ["Select...", "Deterioration (wear, corrosion, fatigue)",
+                           "Lubrication failure", "Dirt/contamination", "Disassembly (loose connections)",
+                           "Human error", "Overloading", "Other"]
+
+def get_library_path():
+    """Get the directory of saved projects the failure mode library is built from"""
+    library_path = config_data['LIBRARY_PATH']
+    if not os.path.isabs(library_path):
+        library_path = os.path.join(os.path.dirname(__file__), library_path)
+    return library_path
+
+def get_library_signature():
+    """Path, size and modification time of every library and workspace project, used as the library cache key"""
+    signature = []
+    for directory in (get_library_path(), get_workspace_path()):
+        if not os.path.isdir(directory):
+            continue
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith('.json') and file_name != 'catalogue.json':
+                file_path = os.path.join(directory, file_name)
+                stat = os.stat(file_path)
+                signature.append((file_path, stat.st_size, stat.st_mtime))
+    return tuple(signature)
+
+def get_project_identity(project_information):
+    """Project number and creation date, which tell apart different projects with the same number"""
+    return (project_information.get('project_no', ''), project_information.get('created_date', ''))
+
+def save_project_to_library():
+    """Save the current project into the library directory; returns the file path or None"""
+    try:
+        export_data = create_export_data()
+        if not export_data:
+            return None
+        library_path = get_library_path()
+        os.makedirs(library_path, exist_ok=True)
+        project_no = st.session_state.project_data.get('project_no') or st.session_state.asset_data.get('asset_name', 'project')
+        identity = get_project_identity(export_data.get('project_information', {}))
+        
+        # Another project with the same file-name-safe key gets a numbered file instead of replacing it
+        base_key = get_project_key(project_no)
+        key = base_key
+        suffix = 2
+        while os.path.exists(os.path.join(library_path, f"{key}.json")):
+            with open(os.path.join(library_path, f"{key}.json"), 'r') as f:
+                if get_project_identity(json.load(f).get('project_information', {})) == identity:
+                    break
+            key = f"{base_key}_{suffix}"
+            suffix += 1
+        file_path = os.path.join(library_path, f"{key}.json")
+        with open(file_path, 'w') as f:
+            json.dump(export_data, f, indent=2)
+        return file_path
+    except Exception as e:
+        print(f"Error saving project to library: {str(e)}")
+        return None
+
+def normalize_component_type(component):
+    """Normalise a component name so 'Pump Bearings' and 'pump  bearings' share a library key"""
+    return " ".join(tokenize_search_text(component))
+
+@st.cache_resource(max_entries=1)
+def load_failure_mode_library(library_signature):
+    """Build the failure mode library from every project in the library and the workspace
+    
+    A project saved both to the library and the workspace (same project number and creation date)
+    is read once, from its newest file. Identical component/description pairs are merged and
+    counted. Each entry's component and
+    description are stored as an L2-normalised TF-IDF vector, kept per term as
+    (entry indices, weights) arrays so a query only touches the columns of its own terms.
+    Cached process-wide; library_signature changes whenever a saved project changes.
+    """
+    entries = []
+    entry_index = {}
+    read_projects = set()
+    for file_path, _, _ in sorted(library_signature, key=lambda item: item[2], reverse=True):
+        try:
+            with open(file_path, 'r') as f:
+                project = json.load(f)
+        except Exception as e:
+            print(f"Error reading library project {file_path}: {str(e)}")
+            continue
+        
+        identity = get_project_identity(project.get('project_information', {}))
+        if identity[0]:
+            if identity in read_projects:
+                continue
+            read_projects.add(identity)
+        project_no = identity[0] or os.path.basename(file_path)[:-5]
+        sources = [(asset.get('asset_name', ''), asset.get('asset_class', ''), asset.get('failure_modes', []))
+                   for asset in project.get('assets', [])]
+        if not sources and project.get('failure_modes'):
+            # Legacy single-asset export
+            sources = [(project.get('asset_information', {}).get('asset_name', ''), '', project['failure_modes'])]
+        
+        for asset_name, asset_class, failure_modes in sources:
+            for failure_mode in failure_modes:
+                description = str(failure_mode.get('description', '')).strip()
+                if not description:
+                    continue
+                component_type = normalize_component_type(failure_mode.get('component', ''))
+                key = (component_type, " ".join(tokenize_search_text(description)))
+                if key in entry_index:
+                    entry = entries[entry_index[key]]
+                    entry['occurrences'] += 1
+                    # Prefer the most complete analysis of a repeated failure mode
+                    if not entry['management_task'] and failure_mode.get('management_task'):
+                        entry['management_task'] = failure_mode['management_task']
+                    if not entry['effects'] and failure_mode.get('effects'):
+                        entry['effects'] = failure_mode['effects']
+                    continue
+                entry_index[key] = len(entries)
+                entries.append({
+                    'component': failure_mode.get('component', ''),
+                    'component_type': component_type,
+                    'description': description,
+                    'category': failure_mode.get('category', ''),
+                    'effects': failure_mode.get('effects', {}),
+                    'consequence_category': failure_mode.get('consequence_category', ''),
+                    'management_task': failure_mode.get('management_task', {}),
+                    'source': f"{project_no} / {asset_name}" if asset_name else project_no,
+                    'asset_class': asset_class,
+                    'occurrences': 1
+                })
+    
+    # TF-IDF over component + description
+    entry_terms = []
+    document_frequency = {}
+    for entry in entries:
+        counts = {}
+        for token in tokenize_search_text(f"{entry['component']} {entry['description']}"):
+            counts[token] = counts.get(token, 0) + 1
+        entry_terms.append(counts)
+        for term in counts:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    
+    entry_count = len(entries)
+    idf = {term: math.log((1 + entry_count) / (1 + df)) + 1 for term, df in document_frequency.items()}
+    columns = {}
+    for entry_idx, counts in enumerate(entry_terms):
+        weights = {term: (1 + math.log(count)) * idf[term] for term, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        for term, weight in weights.items():
+            columns.setdefault(term, ([], []))
+            columns[term][0].append(entry_idx)
+            columns[term][1].append(weight / norm)
+    
+    component_index = {}
+    for entry_idx, entry in enumerate(entries):
+        component_index.setdefault(entry['component_type'], []).append(entry_idx)
+    
+    return {
+        'entries': entries,
+        'idf': idf,
+        'columns': {term: (np.array(rows, dtype=np.int64), np.array(weights, dtype=np.float64))
+                    for term, (rows, weights) in columns.items()},
+        'component_index': {component_type: np.array(rows, dtype=np.int64)
+                            for component_type, rows in component_index.items()}
+    }
+
+def find_similar_failure_modes(component, description='', top_k=None):
+    """Return the library failure modes most similar to a component and (optional) description
+    
+    Entries for the same component type rank first; the rest of the library is only used to fill
+    up to top_k. Returns a list of (cosine similarity, entry) tuples.
+    """
+    if top_k is None:
+        top_k = config_data['LIBRARY_SUGGESTIONS']
+    library = load_failure_mode_library(get_library_signature())
+    entry_count = len(library['entries'])
+    if not entry_count:
+        return []
+    
+    query_counts = {}
+    for token in tokenize_search_text(f"{component} {description}"):
+        if token in library['idf']:
+            query_counts[token] = query_counts.get(token, 0) + 1
+    if not query_counts:
+        return []
+    query_weights = {term: (1 + math.log(count)) * library['idf'][term] for term, count in query_counts.items()}
+    query_norm = math.sqrt(sum(weight * weight for weight in query_weights.values()))
+    
+    scores = np.zeros(entry_count)
+    for term, weight in query_weights.items():
+        rows, weights = library['columns'][term]
+        scores[rows] += weights * (weight / query_norm)
+    
+    same_component = library['component_index'].get(normalize_component_type(component))
+    if same_component is not None:
+        # Lift same-component entries above every other match (cosine similarity is at most 1)
+        ranking = scores.copy()
+        ranking[same_component] += 1.0
+    else:
+        ranking = scores
+    
+    candidates = np.flatnonzero(ranking > 0)
+    if len(candidates) > top_k:
+        candidates = candidates[np.argpartition(-ranking[candidates], top_k - 1)[:top_k]]
+    candidates = candidates[np.argsort(-ranking[candidates], kind='stable')]
+    return [(float(scores[idx]), library['entries'][idx]) for idx in candidates]
+
+def apply_library_failure_mode(entry):
+    """Copy a library failure mode's description and category into the Step 4 inputs"""
+    st.session_state.fm_description_input = entry['description']
+    if entry['category'] in FAILURE_MODE_CATEGORIES:
+        st.session_state.fm_category_input = entry['category']
+
+# Project Workspace Functions
+# The workspace is a directory with one JSON file per project and a catalogue.json holding each
+# project's header (number, description, asset count, last modified). Listing and searching
+# projects only reads the catalogue; a project's assets file is read the first time it is opened
+# in a session, after which switching to it swaps references to the copy-on-write assets list.
+def get_workspace_path():
+    """Get the directory holding the workspace projects and their catalogue"""
+    workspace_path = config_data['WORKSPACE_PATH']
+    if not os.path.isabs(workspace_path):
+        workspace_path = os.path.join(os.path.dirname(__file__), workspace_path)
+    return workspace_path
+
+def get_project_key(project_no):
+    """File-name-safe key of a project number"""
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', project_no or '').strip('._') or 'project'
+
+def get_workspace_key(project_no, catalogue):
+    """Catalogue key of a project number
+    
+    Different project numbers can have the same file-name-safe key ("P/1" and "P 1"), so a key
+    already used by another project number gets a numeric suffix.
+    """
+    base_key = get_project_key(project_no)
+    key = base_key
+    suffix = 2
+    while key in catalogue and catalogue[key].get('project_no') != project_no:
+        key = f"{base_key}_{suffix}"
+        suffix += 1
+    return key
+
+def load_workspace_catalogue():
+    """Load the workspace catalogue: {project key: header}"""
+    try:
+        catalogue_path = os.path.join(get_workspace_path(), 'catalogue.json')
+        if not os.path.exists(catalogue_path):
+            return {}
+        with open(catalogue_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading workspace catalogue: {str(e)}")
+        return {}
+
+def search_workspace_catalogue(catalogue, search_text=''):
+    """Catalogue entries matching a project number or description, ordered by project number"""
+    search_text = search_text.strip().lower()
+    entries = sorted(catalogue.items(), key=lambda item: item[1].get('project_no', '').lower())
+    if not search_text:
+        return entries
+    return [(key, entry) for key, entry in entries
+            if search_text in entry.get('project_no', '').lower()
+            or search_text in entry.get('project_description', '').lower()]
+
+def _write_json_atomic(path, data):
+    """Write JSON to a temporary file and move it into place, so readers never see a partial file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+def save_project_to_workspace():
+    """Write the current project to the workspace and update its catalogue entry; returns the key or None"""
+    try:
+        project_data = st.session_state.project_data
+        assets = st.session_state.assets
+        if not project_data.get('project_no'):
+            return None
+        catalogue = load_workspace_catalogue()
+        key = get_workspace_key(project_data['project_no'], catalogue)
+        workspace = st.session_state.workspace
+        workspace['open_projects'][key] = {'project_data': project_data, 'assets': assets,
+                                           'history': st.session_state.history}
+        saved = workspace['saved'].get(key)
+        if saved is not None and saved[0] is project_data and saved[1] is assets:
+            return key
+        
+        workspace_path = get_workspace_path()
+        os.makedirs(workspace_path, exist_ok=True)
+        _write_json_atomic(os.path.join(workspace_path, f"{key}.json"), {
+            "project_information": project_data,
+            "assets": assets,
+            "export_date": datetime.now().isoformat()
+        })
+        catalogue[key] = {
+            'project_no': project_data['project_no'],
+            'project_description': project_data.get('project_description', ''),
+            'asset_count': len(assets),
+            'last_modified': datetime.now().isoformat(),
+            'file_name': f"{key}.json"
+        }
+        _write_json_atomic(os.path.join(workspace_path, 'catalogue.json'), catalogue)
+        workspace['saved'][key] = (project_data, assets)
+        return key
+    except Exception as e:
+        print(f"Error saving project to workspace: {str(e)}")
+        return None
+
+def switch_workspace_project(project_key=None):
+    """Save the current project to the workspace and open another one (a new, empty project if None)
+    
+    A project already opened in this session is restored from memory, including its undo history;
+    otherwise its file is read from the workspace. Returns True if the project was opened, False if
+    it could not be opened, and None if the current project could not be saved, in which case it
+    stays open and a message says why.
+    """
+    try:
+        save_asset_analysis_data()
+        current_project_no = st.session_state.project_data.get('project_no')
+        if (current_project_no or st.session_state.assets) and save_project_to_workspace() is None:
+            if current_project_no:
+                st.error("❌ The current project could not be saved to the workspace, so it was kept open.")
+            else:
+                st.warning("⚠️ Enter and save a Project No. in Stage 1 first, so the current project can be saved to the workspace.")
+            return None
+        workspace = st.session_state.workspace
+        
+        if project_key is None:
+            project = {'project_data': {'project_no': '', 'project_description': '', 'created_date': '', 'last_modified': ''},
+                       'assets': []}
+        elif project_key in workspace['open_projects']:
+            project = workspace['open_projects'][project_key]
+        else:
+            entry = load_workspace_catalogue().get(project_key)
+            if entry is None:
+                return False
+            with open(os.path.join(get_workspace_path(), entry['file_name']), 'r') as f:
+                project_file = json.load(f)
+            project = {'project_data': project_file.get('project_information', {}),
+                       'assets': derive_assets_analysis_results(project_file.get('assets', []))}
+            workspace['open_projects'][project_key] = project
+            workspace['saved'][project_key] = (project['project_data'], project['assets'])
+        
+        st.session_state.project_data = project['project_data']
+        st.session_state.assets = project['assets']
+        st.session_state.history = project.get('history') or {'undo': [], 'redo': [], 'assets': None, 'project': None}
+        
+        # Selections, the Stage 2 working copy and per-asset caches belong to the previous project
+        st.session_state.current_asset_index = None
+        st.session_state.editing_component = None
+        st.session_state.temp_components = []
+        st.session_state.selected_analysis_asset = 0
+        if 'last_loaded_asset' in st.session_state:
+            del st.session_state.last_loaded_asset
+        st.session_state.asset_register_version += 1
+        invalidate_analysis_tables()
+        autosave_session_data()
+        return True
+    except Exception as e:
+        print(f"Error switching project: {str(e)}")
+        return False
+
+# Asset Register Functions
+ASSET_REGISTER_SORT_FIELDS = {
+    "Register order": None,
+    "Asset Name": 'asset_name',
+    "Asset Class": 'asset_class',
+    "Asset Type": 'asset_type',
+    "Site Location": 'site_location',
+    "Component count": 'components'
+}
+
+ASSET_REGISTER_PAGE_SIZES = [10, 25, 50, 100]
+
+def filter_asset_register(assets, search_text='', sort_by="Register order", descending=False):
+    """Return the indices of the assets matching search_text, in display order
+    
+    The search is a case-insensitive substring match on the asset fields and component names.
+    """
+    terms = search_text.lower().split()
+    matches = []
+    for idx, asset in enumerate(assets):
+        if terms:
+            haystack = " ".join([
+                str(asset.get('asset_name', '')),
+                str(asset.get('asset_class', '')),
+                str(asset.get('asset_type', '')),
+                str(asset.get('site_location', ''))
+            ] + [str(comp) for comp in asset.get('components', [])]).lower()
+            if not all(term in haystack for term in terms):
+                continue
+        matches.append(idx)
+    
+    field = ASSET_REGISTER_SORT_FIELDS.get(sort_by)
+    if field == 'components':
+        matches.sort(key=lambda idx: len(assets[idx].get('components', [])), reverse=descending)
+    elif field:
+        matches.sort(key=lambda idx: str(assets[idx].get(field, '')).lower(), reverse=descending)
+    elif descending:
+        matches.reverse()
+    return matches
+
+def build_asset_register_page(assets, page_indices):
+    """Build the display table for one page of the asset register"""
+    rows = []
+    for idx in page_indices:
+        asset = assets[idx]
+        components = asset.get('components', [])
+        rows.append({
+            '#': idx + 1,
+            'Asset Name': asset.get('asset_name', ''),
+            'Asset Class': asset.get('asset_class', ''),
+            'Asset Type': asset.get('asset_type', ''),
+            'Site Location': asset.get('site_location', ''),
+            'Components': len(components),
+            'Component List': ", ".join(str(comp) for comp in components)
+        })
+    return pd.DataFrame(rows, columns=['#', 'Asset Name', 'Asset Class', 'Asset Type', 'Site Location',
+                                       'Components', 'Component List'])
+
+def delete_assets(asset_indices):
+    """Delete assets by index, keeping the editing and analysis selections pointing at the right asset"""
+    deleted = set(asset_indices)
+    st.session_state.assets = [asset for idx, asset in enumerate(st.session_state.assets) if idx not in deleted]
+    
+    current = st.session_state.current_asset_index
+    if current is not None:
+        if current in deleted:
+            st.session_state.current_asset_index = None
+            st.session_state.temp_components = []
+        else:
+            st.session_state.current_asset_index = current - len([idx for idx in deleted if idx < current])
+    
+    if st.session_state.get('selected_analysis_asset', 0) >= len(st.session_state.assets):
+        st.session_state.selected_analysis_asset = 0
+    if 'last_loaded_asset' in st.session_state:
+        del st.session_state.last_loaded_asset
+    st.session_state.editing_component = None
+    st.session_state.asset_register_version += 1
+    invalidate_analysis_tables()
+
+# Asset Template Functions
+def asset_has_analysis(asset):
+    """Check whether an asset has any Stage 2 analysis data"""
+    return any(asset.get(key) for key in ANALYSIS_KEYS)
+
+def remap_analysis_ids(source, function_id_offset):
+    """Renumber a copy of an asset's analysis so it can be appended after existing functions
+    
+    Function ids are shifted by function_id_offset and functional failure / failure mode ids are
+    rebuilt from them (FF-<function>.<n>, FM-<functional failure>-<n>), with every reference updated.
+    Records referring to a function or functional failure the source does not have are kept as
+    orphans under fresh function ids after the copied ones, so their ids cannot collide with the
+    target's. Only the top-level records are copied; effects, risk assessments and tasks stay shared.
+    """
+    function_ids = {}
+    functions = []
+    for function in source.get('functions', []):
+        function_ids[function['id']] = function['id'] + function_id_offset
+        functions.append(dict(function, id=function_ids[function['id']]))
+    statements = {function['id']: function.get('full_statement', '') for function in functions}
+    next_function_id = max(function_ids.values(), default=function_id_offset) + 1
+    
+    failure_ids = {}
+    functional_failures = []
+    failure_counts = {}
+    for failure in source.get('functional_failures', []):
+        if failure.get('function_id') not in function_ids:
+            function_ids[failure.get('function_id')] = next_function_id
+            next_function_id += 1
+        function_id = function_ids[failure.get('function_id')]
+        failure_counts[function_id] = failure_counts.get(function_id, 0) + 1
+        failure_ids[failure['id']] = f"FF-{function_id}.{failure_counts[function_id]}"
+        functional_failures.append(dict(failure, id=failure_ids[failure['id']], function_id=function_id,
+                                        function_statement=statements.get(function_id, failure.get('function_statement', ''))))
+    
+    mode_ids = {}
+    failure_modes = []
+    mode_counts = {}
+    for mode in source.get('failure_modes', []):
+        if mode.get('functional_failure_id') not in failure_ids:
+            failure_ids[mode.get('functional_failure_id')] = f"FF-{next_function_id}.1"
+            next_function_id += 1
+        failure_id = failure_ids[mode.get('functional_failure_id')]
+        mode_counts[failure_id] = mode_counts.get(failure_id, 0) + 1
+        mode_ids[mode['id']] = f"FM-{failure_id}-{mode_counts[failure_id]}"
+        failure_modes.append(dict(mode, id=mode_ids[mode['id']], functional_failure_id=failure_id))
+    
+    analysis_results = [dict(result, failure_mode_id=mode_ids.get(result.get('failure_mode_id'), result.get('failure_mode_id')))
+                        for result in source.get('analysis_results', [])]
+    
+    return {
+        'functions': functions,
+        'functional_failures': functional_failures,
+        'failure_modes': failure_modes,
+        'analysis_results': analysis_results
+    }
+
+def clone_asset_analysis(source, target, replace=False):
+    """Return a copy of target carrying source's full analysis tree
+    
+    When the target has no analysis (or replace is set) the clone shares the source's lists and
+    records outright; Stage 2 copies them when the asset is opened for editing, so clones only
+    take memory once they diverge. Otherwise the source analysis is appended with renumbered ids.
+    Source components missing from the target are added, since failure modes refer to them.
+    """
+    cloned = dict(target)
+    cloned['components'] = list(target.get('components', []))
+    for component in source.get('components', []):
+        if component not in cloned['components']:
+            cloned['components'].append(component)
+    
+    if replace or not asset_has_analysis(target):
+        for key in ANALYSIS_KEYS:
+            cloned[key] = source.get(key, [])
+    else:
+        function_id_offset = max([function['id'] for function in target.get('functions', [])], default=0)
+        remapped = remap_analysis_ids(source, function_id_offset)
+        for key in ANALYSIS_KEYS:
+            cloned[key] = target.get(key, []) + remapped[key]
+    
+    if replace or not target.get('operating_context'):
+        cloned['operating_context'] = source.get('operating_context', {})
+    return cloned
+
+def apply_asset_template(source_index, target_indices, new_copies=0, replace=False):
+    """Clone an asset's analysis into existing assets and/or new copies of the asset in one batch"""
+    assets = list(st.session_state.assets)
+    source = assets[source_index]
+    for idx in target_indices:
+        if idx != source_index:
+            assets[idx] = clone_asset_analysis(source, assets[idx], replace)
+    
+    for copy_number in range(1, new_copies + 1):
+        new_asset = {key: value for key, value in source.items() if key not in ANALYSIS_KEYS}
+        new_asset['asset_name'] = f"{source['asset_name']} (Copy {copy_number})"
+        new_asset['components'] = []
+        new_asset['operating_context'] = {}
+        assets.append(clone_asset_analysis(source, new_asset))
+    st.session_state.assets = assets
+    
+    if 'last_loaded_asset' in st.session_state:
+        del st.session_state.last_loaded_asset
+    st.session_state.asset_register_version += 1
+    invalidate_analysis_tables()
+
 # Registration Management Functions
 def get_registration_path():
     """Get the path for the registration file"""
@@ -682,10 +2079,261 @@ def get_registration_details():
         print(f"Error loading registration: {str(e)}")
     return {}
 
-# User Authentication Functions
-def get_users_path():
-    """Get the path for the users database file"""
-    return os.path.join(os.path.dirname(__file__), '.users.json')
+# Password Hashing Functions
+def _pbkdf2_sha256_digest(password, salt, params):
+    """Derive a PBKDF2-HMAC-SHA256 digest; params = (iterations,)"""
+    (iterations,) = params
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+def _scrypt_digest(password, salt, params):
+    """Derive a scrypt digest; params = (n, r, p)"""
+    n, r, p = params
+    # scrypt needs roughly 128 * n * r bytes; allow headroom above OpenSSL's 32 MB default
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=max(256 * n * r, 32 * 1024 * 1024), dklen=32)
+
+# Registered password hashers: scheme name -> digest function
+# Stored hashes are encoded as "<scheme>$<param>[$<param>...]$<salt hex>$<digest hex>"
+PASSWORD_HASHERS = {
+    'pbkdf2_sha256': _pbkdf2_sha256_digest,
+    'scrypt': _scrypt_digest
+}
+
+def get_password_hasher_params(scheme):
+    """Get the configured work factor parameters for a password hashing scheme"""
+    if scheme == 'scrypt':
+        return (config_data['SCRYPT_N'], config_data['SCRYPT_R'], config_data['SCRYPT_P'])
+    return (config_data['PBKDF2_ITERATIONS'],)
+
+def get_password_hasher_scheme():
+    """Get the configured password hashing scheme (falls back to PBKDF2 if unknown)"""
+    scheme = config_data['PASSWORD_HASHER']
+    return scheme if scheme in PASSWORD_HASHERS else 'pbkdf2_sha256'
+
+def hash_password(password):
+    """Hash a password with a random salt using the configured scheme and work factor"""
+    scheme = get_password_hasher_scheme()
+    params = get_password_hasher_params(scheme)
+    salt = secrets.token_bytes(16)
+    digest = PASSWORD_HASHERS[scheme](password, salt, params)
+    return '$'.join([scheme] + [str(p) for p in params] + [salt.hex(), digest.hex()])
+
+def verify_password(password, stored_hash):
+    """Verify a password against a stored hash
+    
+    Returns (matches, needs_rehash). Legacy unsalted SHA-256 hashes are still accepted
+    but always flagged for rehashing, as are hashes made with an outdated scheme or work factor.
+    """
+    if not stored_hash:
+        return False, False
+    
+    if '$' not in stored_hash:
+        # Legacy format: single-round unsalted SHA-256 hex digest
+        legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy_hash, stored_hash), True
+    
+    try:
+        scheme, *params, salt_hex, digest_hex = stored_hash.split('$')
+        params = tuple(int(p) for p in params)
+        digest = PASSWORD_HASHERS[scheme](password, bytes.fromhex(salt_hex), params)
+    except (KeyError, ValueError) as e:
+        print(f"Unrecognised password hash format: {str(e)}")
+        return False, False
+    
+    matches = hmac.compare_digest(digest.hex(), digest_hex)
+    needs_rehash = scheme != get_password_hasher_scheme() or params != get_password_hasher_params(scheme)
+    return matches, needs_rehash
+
+# Verified Session Functions
+def get_session_secret_path():
+    """Get the path for the session token signing key"""
+    return os.path.join(os.path.dirname(__file__), '.session_secret')
+
+@st.cache_resource
+def get_session_signing_key():
+    """Load (or create on first use) the HMAC key used to sign session tokens"""
+    secret_path = get_session_secret_path()
+    try:
+        if os.path.exists(secret_path):
+            with open(secret_path, 'r') as f:
+                key = bytes.fromhex(f.read().strip())
+            if key:
+                return key
+    except Exception as e:
+        print(f"Error loading session secret: {str(e)}")
+    
+    key = secrets.token_bytes(32)
+    try:
+        # Owner read/write only - anyone holding this key can forge sessions
+        fd = os.open(secret_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(key.hex())
+    except Exception as e:
+        print(f"Error saving session secret: {str(e)}")
+    return key
+
+@st.cache_resource
+def get_verified_sessions():
+    """Process-wide cache of verified login sessions: session token -> {username, expires}
+    
+    Shared by all browser sessions served by this process, so the password KDF only runs
+    on an actual login and every rerun after that is a dictionary lookup. The user's profile
+    and role are not cached; they are read from the users database when a login is resumed.
+    """
+    return {}
+
+def get_revoked_sessions_path():
+    """Get the path for the ids of revoked (logged out) session tokens, kept next to the signing key"""
+    return os.path.join(os.path.dirname(__file__), '.session_revoked')
+
+@st.cache_resource
+def get_revoked_session_ids():
+    """Process-wide revocation set for signed session tokens: token id -> expiry timestamp
+    
+    Loaded from disk on first use, so a token logged out before a server restart stays revoked
+    until it expires.
+    """
+    try:
+        revoked_path = get_revoked_sessions_path()
+        if os.path.exists(revoked_path):
+            with open(revoked_path, 'r') as f:
+                now = time.time()
+                return {jti: exp for jti, exp in json.load(f).items() if exp > now}
+    except Exception as e:
+        print(f"Error loading revoked sessions: {str(e)}")
+    return {}
+
+def save_revoked_session_ids(revoked):
+    """Write the revoked token ids to disk (owner read/write only), replacing the previous file"""
+    try:
+        revoked_path = get_revoked_sessions_path()
+        temp_path = f"{revoked_path}.tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(revoked, f)
+        os.replace(temp_path, revoked_path)
+    except Exception as e:
+        print(f"Error saving revoked sessions: {str(e)}")
+
+def _b64_encode(raw):
+    """URL-safe base64 without padding (safe to place in a query string)"""
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _b64_decode(text):
+    """Decode URL-safe base64 with the padding restored"""
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign_session_payload(payload):
+    """HMAC-SHA256 signature of a session token payload"""
+    return hmac.new(get_session_signing_key(), payload, hashlib.sha256).digest()
+
+def create_session_token(username):
+    """Create a signed, expiring session token: <base64 claims>.<base64 signature>"""
+    claims = {
+        'u': username,
+        'exp': int(time.time()) + config_data['SESSION_TIMEOUT_MINUTES'] * 60,
+        'jti': secrets.token_urlsafe(12)
+    }
+    payload = json.dumps(claims, separators=(',', ':')).encode()
+    return f"{_b64_encode(payload)}.{_b64_encode(_sign_session_payload(payload))}"
+
+def validate_session_token(token):
+    """Return the claims of a session token if its signature is valid, it is unexpired
+    and it has not been revoked; otherwise None"""
+    try:
+        payload_b64, signature_b64 = token.split('.')
+        payload = _b64_decode(payload_b64)
+        # Constant-time comparison so the signature cannot be recovered by timing
+        if not hmac.compare_digest(_sign_session_payload(payload), _b64_decode(signature_b64)):
+            return None
+        claims = json.loads(payload)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    
+    if not isinstance(claims, dict) or claims.get('exp', 0) <= time.time():
+        return None
+    if claims.get('jti') in get_revoked_session_ids():
+        return None
+    return claims
+
+def start_verified_session(username):
+    """Issue a signed session token for a verified login and register it in the session cache"""
+    sessions = get_verified_sessions()
+    now = time.time()
+    
+    # Drop expired entries so the cache stays bounded by the number of live sessions
+    for token in [t for t, s in list(sessions.items()) if s['expires'] <= now]:
+        sessions.pop(token, None)
+    
+    token = create_session_token(username)
+    sessions[token] = {
+        'username': username,
+        'expires': validate_session_token(token)['exp']
+    }
+    return token
+
+def end_verified_session(token):
+    """Remove a session token from the cache and revoke it so it cannot be replayed"""
+    if not token:
+        return
+    get_verified_sessions().pop(token, None)
+    
+    claims = validate_session_token(token)
+    if claims:
+        revoked = get_revoked_session_ids()
+        now = time.time()
+        for jti in [j for j, exp in list(revoked.items()) if exp <= now]:
+            revoked.pop(jti, None)
+        revoked[claims['jti']] = claims['exp']
+        save_revoked_session_ids(revoked)
+
+def is_verified_session(token, username):
+    """Check that a session token is cached, unexpired and belongs to the given user"""
+    session = get_verified_sessions().get(token) if token else None
+    return session is not None and session['username'] == username and session['expires'] > time.time()
+
+def resume_signed_session():
+    """Restore a login from the signed session token in the URL (e.g. after a browser refresh)
+    
+    Tokens issued by this process are resolved from the session cache without checking the
+    signature again; tokens from before a restart are validated once. The user's profile and
+    role are always read from the users database, so a changed role applies on the next
+    refresh and a deleted user cannot resume.
+    """
+    token = st.query_params.get('session')
+    if not token or is_user_logged_in():
+        return False
+    
+    session = get_verified_sessions().get(token)
+    if session is not None and session['expires'] > time.time():
+        username = session['username']
+    else:
+        claims = validate_session_token(token)
+        username = claims.get('u') if claims else None
+        if not isinstance(username, str):
+            del st.query_params['session']
+            return False
+        get_verified_sessions()[token] = {
+            'username': username,
+            'expires': claims['exp']
+        }
+    
+    user_data = load_users().get(username)
+    if not user_data:
+        get_verified_sessions().pop(token, None)
+        del st.query_params['session']
+        return False
+    
+    st.session_state.logged_in = True
+    st.session_state.current_user = username
+    st.session_state.user_data = user_data
+    st.session_state.session_token = token
+    return True
+
+# User Authentication Functions
+def get_users_path():
+    """Get the path for the users database file"""
+    return os.path.join(os.path.dirname(__file__), '.users.json')
 
 def migrate_user_database():
     """Migrate old user database format (is_admin) to new format (user_type) and add login_count"""
@@ -741,7 +2389,7 @@ def initialize_users_db():
         # Create default admin user (hidden) with Administrator role
         default_users = {
             "admin": {
-                "password": hashlib.sha256("odyssey".encode()).hexdigest(),
+                "password": hash_password("odyssey"),
                 "position": "System Administrator",
                 "created_date": datetime.now().isoformat(),
                 "user_type": "Administrator",
@@ -774,8 +2422,8 @@ def save_user(username, password, full_name, position, user_type="User"):
         if username.lower() in [u.lower() for u in users.keys()]:
             return False, "Username already exists"
         
-        # Hash the password
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+        # Hash the password with a per-user salt and the configured work factor
+        hashed_password = hash_password(password)
         
         users[username] = {
             "password": hashed_password,
@@ -794,15 +2442,19 @@ def save_user(username, password, full_name, position, user_type="User"):
         return False, f"Error saving user: {str(e)}"
 
 def authenticate_user(username, password):
-    """Authenticate user credentials and increment login counter"""
+    """Authenticate user credentials, increment login counter and upgrade outdated password hashes"""
     users = load_users()
     
     if username not in users:
         return False, None
     
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
+    matches, needs_rehash = verify_password(password, users[username].get('password', ''))
     
-    if users[username]['password'] == hashed_password:
+    if matches:
+        # Transparently migrate legacy or outdated hashes to the configured scheme
+        if needs_rehash:
+            users[username]['password'] = hash_password(password)
+        
         # Increment login counter
         if 'login_count' not in users[username]:
             users[username]['login_count'] = 0
@@ -823,8 +2475,10 @@ def authenticate_user(username, password):
     return False, None
 
 def is_user_logged_in():
-    """Check if a user is logged in"""
-    return st.session_state.get('logged_in', False) and st.session_state.get('current_user', None) is not None
+    """Check if a user is logged in with a verified, unexpired session token"""
+    return (st.session_state.get('logged_in', False)
+            and st.session_state.get('current_user', None) is not None
+            and is_verified_session(st.session_state.get('session_token'), st.session_state.current_user))
 
 def get_user_type():
     """Get the current user's type"""
@@ -909,6 +2563,9 @@ def show_login_form():
                         st.session_state.logged_in = True
                         st.session_state.current_user = username
                         st.session_state.user_data = user_data
+                        st.session_state.session_token = start_verified_session(username)
+                        # Keep the signed token in the URL so a page refresh resumes this login
+                        st.query_params['session'] = st.session_state.session_token
                         st.success(f"✅ Welcome back, {user_data.get('full_name', username)}!")
                         time.sleep(0.5)
                         st.rerun()
@@ -1015,6 +2672,10 @@ def show_logout_button():
         st.sidebar.markdown(f"**User Type:** {user_data.get('user_type', 'User')}")
         
         if st.sidebar.button("🚪 Logout", use_container_width=True):
+            end_verified_session(st.session_state.get('session_token'))
+            st.session_state.session_token = None
+            if 'session' in st.query_params:
+                del st.query_params['session']
             st.session_state.logged_in = False
             st.session_state.current_user = None
             st.session_state.user_data = None
@@ -1188,6 +2849,67 @@ def sidebar_navigation():
         except Exception as e:
             st.sidebar.error(f"❌ Error loading file: {str(e)}")
     
+    # Undo/Redo
+    history = st.session_state.history
+    col_undo, col_redo = st.sidebar.columns(2)
+    with col_undo:
+        if st.button("↶ Undo", use_container_width=True, disabled=not history['undo'],
+                     help=f"Undo: {history['undo'][-1]['label']}" if history['undo'] else "Nothing to undo"):
+            step_history(undo=True)
+            st.rerun()
+    with col_redo:
+        if st.button("↷ Redo", use_container_width=True, disabled=not history['redo'],
+                     help=f"Redo: {history['redo'][-1]['label']}" if history['redo'] else "Nothing to redo"):
+            step_history(undo=False)
+            st.rerun()
+    if history['undo'] or history['redo']:
+        history_kb = sum(entry['size'] for entry in history['undo'] + history['redo']) / 1024
+        st.sidebar.caption(f"History: {len(history['undo'])} undo / {len(history['redo'])} redo step(s), ~{history_kb:,.0f} KB")
+    
+    # Project workspace
+    with st.sidebar.expander("🗂️ Projects"):
+        catalogue = load_workspace_catalogue()
+        workspace_search = st.text_input("Search projects", key="workspace_search",
+                                         placeholder="Project no. or description")
+        matches = search_workspace_catalogue(catalogue, workspace_search)
+        if matches:
+            project_labels = {key: f"{entry['project_no']} - {entry.get('project_description', '')} ({entry.get('asset_count', 0)} assets)"
+                              for key, entry in matches}
+            selected_project = st.selectbox("Project", options=list(project_labels),
+                                            format_func=lambda key: project_labels[key], key="workspace_project")
+            if st.button("📂 Open Project", use_container_width=True):
+                opened = switch_workspace_project(selected_project)
+                if opened:
+                    st.session_state.current_stage = 1
+                    st.rerun()
+                elif opened is False:
+                    st.error("❌ Could not open the project")
+        elif catalogue:
+            st.caption("No matching projects")
+        else:
+            st.caption("No projects saved to the workspace yet")
+        
+        if st.button("💾 Save to Workspace", use_container_width=True):
+            if save_project_to_workspace():
+                st.success("✅ Project saved to workspace!")
+            elif st.session_state.project_data.get('project_no'):
+                st.error("❌ The project could not be saved to the workspace.")
+            else:
+                st.warning("⚠️ Enter and save a Project No. in Stage 1 first.")
+        if st.button("➕ New Project", use_container_width=True,
+                     help="Save the current project to the workspace and start an empty one"):
+            if switch_workspace_project(None):
+                st.session_state.current_stage = 1
+                st.rerun()
+    
+    # Failure mode library
+    if st.sidebar.button("📚 Save to Library", use_container_width=True,
+                         help="Add this project to the failure mode library used for Step 4 suggestions"):
+        if save_project_to_library():
+            st.sidebar.success("✅ Project saved to library!")
+        else:
+            st.sidebar.warning("⚠️ No data to save. Complete at least Stage 1.")
+    
     # Autosave Management
     if st.sidebar.button("🗑️ Clear Autosave", use_container_width=True, help="Clear automatically saved session data"):
         clear_autosave()
@@ -1255,7 +2977,6 @@ def sidebar_navigation():
         if REGISTERED_DATE:
             # Format the ISO date to be more readable
             try:
-                from datetime import datetime
                 reg_date_obj = datetime.fromisoformat(REGISTERED_DATE)
                 formatted_date = reg_date_obj.strftime('%d %B %Y')
                 st.markdown(f"**Registration Date:** {formatted_date}")
@@ -1276,6 +2997,8 @@ if not is_registered():
 initialize_users_db()
 
 # User Authentication Check - Must be logged in after registration
+# A valid signed session token in the URL (browser refresh/reconnect) skips the login form
+resume_signed_session()
 if not is_user_logged_in():
     show_login_form()
     # st.stop() is called in show_login_form() to prevent further execution
@@ -1288,6 +3011,9 @@ REGISTERED_CONTACT = registration_info.get('contact_person', '')
 REGISTERED_EMAIL = registration_info.get('contact_email', '')
 REGISTERED_DATE = registration_info.get('registration_date', '')
 
+# Record the changes made by the previous run before the Undo/Redo buttons are drawn
+record_history()
+
 sidebar_navigation()
 
 # Add logout button to sidebar
@@ -1960,34 +3686,67 @@ def stage_1_planning():
     st.markdown("---")
     st.markdown(f"### 🏭 Assets in Project: {st.session_state.project_data.get('project_no', '')}")
     
-    # Display existing assets
+    # Asset register: only the current page of the filtered, sorted register is rendered
     if st.session_state.assets:
-        st.markdown("**Existing Assets:**")
-        for idx, asset in enumerate(st.session_state.assets):
-            col_a, col_b, col_c, col_d = st.columns([3, 2, 1, 1])
+        assets = st.session_state.assets
+        
+        col_search, col_sort, col_order, col_size = st.columns([3, 2, 1, 1])
+        with col_search:
+            search_text = st.text_input(
+                "🔍 Search Assets",
+                placeholder="Name, class, type, location or component",
+                key="asset_register_search"
+            )
+        with col_sort:
+            sort_by = st.selectbox("Sort By", list(ASSET_REGISTER_SORT_FIELDS.keys()), key="asset_register_sort")
+        with col_order:
+            sort_order = st.selectbox("Order", ["Ascending", "Descending"], key="asset_register_order")
+        with col_size:
+            page_size = st.selectbox("Rows per Page", ASSET_REGISTER_PAGE_SIZES, key="asset_register_page_size")
+        
+        matching_indices = filter_asset_register(assets, search_text, sort_by, sort_order == "Descending")
+        total_pages = max(1, -(-len(matching_indices) // page_size))
+        if st.session_state.get('asset_register_page', 1) > total_pages:
+            st.session_state.asset_register_page = total_pages
+        
+        col_info, col_page = st.columns([5, 1])
+        with col_page:
+            page = st.number_input("Page", min_value=1, max_value=total_pages, step=1, key="asset_register_page")
+        page_indices = matching_indices[(page - 1) * page_size:page * page_size]
+        with col_info:
+            st.markdown("")
+            if page_indices:
+                st.markdown(f"**Existing Assets:** showing {(page - 1) * page_size + 1}-{(page - 1) * page_size + len(page_indices)} "
+                            f"of {len(matching_indices)} matching ({len(assets)} total). Select rows to edit or delete.")
+            else:
+                st.markdown(f"**Existing Assets:** no assets match the search ({len(assets)} total).")
+        
+        # The table key changes with the view, so a row selection never carries over to other rows
+        register_view = repr((search_text, sort_by, sort_order, page_size, page, st.session_state.asset_register_version))
+        register_event = st.dataframe(
+            build_asset_register_page(assets, page_indices),
+            use_container_width=True,
+            hide_index=True,
+            on_select="rerun",
+            selection_mode="multi-row",
+            key=f"asset_register_{hashlib.md5(register_view.encode()).hexdigest()[:12]}"
+        )
+        selected_indices = [page_indices[row] for row in register_event.selection.rows if row < len(page_indices)]
+        
+        if len(selected_indices) == 1:
+            idx = selected_indices[0]
+            asset = assets[idx]
+            
+            col_a, col_b = st.columns([3, 1])
             with col_a:
-                st.write(f"**{idx + 1}.** {asset['asset_name']}")
+                st.markdown(f"**Selected:** {idx + 1}. {asset['asset_name']} (_{asset['asset_class']}_)")
             with col_b:
-                st.write(f"_{asset['asset_class']}_")
-            with col_c:
-                if st.button("✏️ Edit", key=f"edit_asset_{idx}"):
+                if st.button("✏️ Edit Asset", key="edit_selected_asset", use_container_width=True):
                     st.session_state.current_asset_index = idx
                     st.session_state.editing_component = None  # Clear component editing
                     st.rerun()
-            with col_d:
-                if st.button("🗑️ Del", key=f"del_asset_{idx}"):
-                    # Check if asset has components
-                    components = asset.get('components', [])
-                    if components:
-                        st.error(f"⚠️ Cannot delete asset. Please delete all {len(components)} component(s) first to avoid orphaned data.")
-                    else:
-                        st.session_state.assets.pop(idx)
-                        if st.session_state.current_asset_index == idx:
-                            st.session_state.current_asset_index = None
-                        autosave_session_data()
-                        st.rerun()
             
-            # Display components under each asset with Edit/Delete buttons
+            # Components of the selected asset with Edit/Delete buttons
             components = asset.get('components', [])
             if components:
                 st.markdown(f"   **Components ({len(components)}):**")
@@ -2008,15 +3767,83 @@ def stage_1_planning():
                             st.rerun()
                     with col_comp_d:
                         if st.button("🗑️ Del", key=f"del_comp_{idx}_{comp_idx}"):
-                            st.session_state.assets[idx]['components'].pop(comp_idx)
+                            update_asset(idx, components=[c for i, c in enumerate(components) if i != comp_idx])
+                            st.session_state.asset_register_version += 1
                             autosave_session_data()
                             st.success(f"✅ Component '{comp}' deleted!")
                             st.rerun()
             else:
                 st.markdown(f"   _No components defined_")
             
-            # Add horizontal divider after each asset
-            st.markdown("---")
+            # Use the selected asset as a template for other assets
+            if asset_has_analysis(asset):
+                with st.expander("📋 Use as Template: Copy Full Analysis to Other Assets"):
+                    st.markdown("Copies functions, functional failures, failure modes, effects, consequences and tasks.")
+                    template_targets = st.multiselect(
+                        "Target Assets",
+                        [i for i in range(len(assets)) if i != idx],
+                        format_func=lambda i: f"{i + 1}. {assets[i]['asset_name']}",
+                        key="template_target_assets"
+                    )
+                    col_a, col_b = st.columns(2)
+                    with col_a:
+                        template_copies = st.number_input("New Copies of This Asset", min_value=0, max_value=100, step=1,
+                                                          key="template_new_copies")
+                    with col_b:
+                        template_mode = st.radio("Targets With Existing Analysis",
+                                                 ["Append (ids renumbered)", "Replace"],
+                                                 key="template_mode")
+                    
+                    if st.button("📋 Apply Template", use_container_width=True):
+                        if not template_targets and not template_copies:
+                            st.error("Select target assets or enter a number of new copies")
+                        else:
+                            apply_asset_template(idx, template_targets, int(template_copies), template_mode == "Replace")
+                            autosave_session_data()
+                            st.success(f"✅ Analysis copied to {len(template_targets) + int(template_copies)} asset(s)!")
+                            st.rerun()
+        
+        if selected_indices:
+            # Batch edit and delete of the selected assets
+            with st.expander(f"📝 Batch Edit / Delete {len(selected_indices)} Selected Asset(s)"):
+                asset_classes = ["Keep current", "Pump Station", "Water Treatment Plant", "Pipeline System",
+                                 "Storage Tank", "Distribution Network", "Control System", "Other"]
+                col_a, col_b = st.columns(2)
+                with col_a:
+                    bulk_class = st.selectbox("Set Asset Class", asset_classes, key="bulk_asset_class")
+                with col_b:
+                    bulk_location = st.text_input("Set Site Location", placeholder="Leave blank to keep current",
+                                                  key="bulk_site_location")
+                
+                if st.button("💾 Apply to Selected Assets", use_container_width=True):
+                    if bulk_class == "Keep current" and not bulk_location.strip():
+                        st.error("Choose an Asset Class or enter a Site Location to apply")
+                    else:
+                        bulk_changes = {}
+                        if bulk_class != "Keep current":
+                            bulk_changes['asset_class'] = bulk_class
+                        if bulk_location.strip():
+                            bulk_changes['site_location'] = bulk_location.strip()
+                        for idx in selected_indices:
+                            update_asset(idx, **bulk_changes)
+                        st.session_state.asset_register_version += 1
+                        autosave_session_data()
+                        st.success(f"✅ {len(selected_indices)} asset(s) updated!")
+                        st.rerun()
+                
+                st.markdown("---")
+                with_components = [idx for idx in selected_indices if assets[idx].get('components')]
+                deletable = [idx for idx in selected_indices if idx not in with_components]
+                if with_components:
+                    st.warning(f"⚠️ {len(with_components)} selected asset(s) still have components and will not be deleted. "
+                               "Delete their components first to avoid orphaned data.")
+                if deletable:
+                    confirm_delete = st.checkbox(f"Confirm deletion of {len(deletable)} asset(s)", key="confirm_bulk_asset_delete")
+                    if st.button("🗑️ Delete Selected Assets", disabled=not confirm_delete, use_container_width=True):
+                        delete_assets(deletable)
+                        autosave_session_data()
+                        st.success(f"✅ {len(deletable)} asset(s) deleted!")
+                        st.rerun()
     else:
         st.info("No assets added yet. Click 'Add New Asset' to begin.")
     
@@ -2040,7 +3867,10 @@ def stage_1_planning():
         with col2:
             if st.button("💾 Save", type="primary", use_container_width=True):
                 if new_comp_name and new_comp_name.strip():
-                    st.session_state.assets[asset_idx]['components'][comp_idx] = new_comp_name.strip()
+                    components = list(st.session_state.assets[asset_idx]['components'])
+                    components[comp_idx] = new_comp_name.strip()
+                    update_asset(asset_idx, components=components)
+                    st.session_state.asset_register_version += 1
                     autosave_session_data()
                     st.session_state.editing_component = None
                     st.success(f"✅ Component updated!")
@@ -2138,21 +3968,15 @@ def stage_1_planning():
         if st.session_state.current_asset_index is not None:
             if st.button("💾 Update Asset", type="primary", use_container_width=True):
                 if asset_name and asset_class != "Select...":
-                    st.session_state.assets[st.session_state.current_asset_index] = {
-                        'asset_name': asset_name,
-                        'asset_class': asset_class,
-                        'asset_type': asset_type,
-                        'site_location': site_location,
-                        'components': st.session_state.temp_components.copy(),
-                        'operating_context': current_asset.get('operating_context', {}),
-                        'functions': current_asset.get('functions', []),
-                        'functional_failures': current_asset.get('functional_failures', []),
-                        'failure_modes': current_asset.get('failure_modes', []),
-                        'analysis_results': current_asset.get('analysis_results', [])
-                    }
-                    # Clear cached asset data to force reload with new asset name
-                    if 'last_loaded_asset' in st.session_state:
-                        del st.session_state.last_loaded_asset
+                    update_asset(
+                        st.session_state.current_asset_index,
+                        asset_name=asset_name,
+                        asset_class=asset_class,
+                        asset_type=asset_type,
+                        site_location=site_location,
+                        components=st.session_state.temp_components.copy()
+                    )
+                    st.session_state.asset_register_version += 1
                     st.session_state.current_asset_index = None
                     st.session_state.temp_components = []
                     st.session_state.editing_component = None
@@ -2164,7 +3988,7 @@ def stage_1_planning():
         else:
             if st.button("💾 Save New Asset", type="primary", use_container_width=True):
                 if asset_name and asset_class != "Select...":
-                    st.session_state.assets.append({
+                    append_asset({
                         'asset_name': asset_name,
                         'asset_class': asset_class,
                         'asset_type': asset_type,
@@ -2176,6 +4000,7 @@ def stage_1_planning():
                         'failure_modes': [],
                         'analysis_results': []
                     })
+                    st.session_state.asset_register_version += 1
                     st.session_state.temp_components = []
                     st.session_state.editing_component = None
                     autosave_session_data()
@@ -2246,1705 +4071,1770 @@ def stage_2_analysis():
     
     # Load asset-specific data into session for analysis
     # This maintains compatibility with existing analysis code
+    # Records are copied one level deep because Stage 2 edits them in place, while the asset tree
+    # is shared (copy-on-write); nested effects/tasks are only ever replaced, never edited
     if 'components' not in st.session_state or st.session_state.get('last_loaded_asset') != selected_option:
-        st.session_state.components = current_asset.get('components', [])
-        st.session_state.functions = current_asset.get('functions', [])
-        st.session_state.functional_failures = current_asset.get('functional_failures', [])
-        st.session_state.failure_modes = current_asset.get('failure_modes', [])
-        st.session_state.analysis_results = current_asset.get('analysis_results', [])
-        st.session_state.operating_context = current_asset.get('operating_context', {})
+        st.session_state.components = list(current_asset.get('components', []))
+        st.session_state.functions = [dict(f) for f in current_asset.get('functions', [])]
+        st.session_state.functional_failures = [dict(f) for f in current_asset.get('functional_failures', [])]
+        st.session_state.failure_modes = [dict(m) for m in current_asset.get('failure_modes', [])]
+        st.session_state.analysis_results = [dict(r) for r in current_asset.get('analysis_results', [])]
+        st.session_state.operating_context = dict(current_asset.get('operating_context', {}))
         st.session_state.last_loaded_asset = selected_option
     
+    # Full-text search over the failure modes, effects and tasks of every asset in the project
+    with st.expander("🔍 Search Failure Modes Across All Assets"):
+        search_query = st.text_input(
+            "Search",
+            placeholder="e.g., mechanical seal, vibration, lubrication",
+            key="failure_mode_search"
+        )
+        if search_query.strip():
+            search_start = time.perf_counter()
+            results = search_failure_modes(search_query)
+            search_ms = (time.perf_counter() - search_start) * 1000
+            if results:
+                st.caption(f"{len(results)} best match(es) in {search_ms:.1f} ms")
+                st.dataframe(pd.DataFrame([{
+                    'Asset': f"{asset_idx + 1}. {st.session_state.assets[asset_idx]['asset_name']}",
+                    'Failure Mode ID': mode_id,
+                    'Component': doc['component'],
+                    'Description': doc['description'],
+                    'Task': doc['task'],
+                    'Score': round(score, 2)
+                } for score, asset_idx, mode_id, doc in results]), use_container_width=True, hide_index=True)
+            else:
+                st.info("No failure modes match the search.")
+    
     st.markdown("---")
     
-    # Analysis Steps Tabs
-    analysis_tab = st.tabs([
-        "Step 2: Functions",
-        "Step 3: Functional Failures", 
-        "Step 4: Failure Modes",
-        "Step 5: Failure Effects",
-        "Step 6: Consequences",
-        "Step 7: Task Selection"
-    ])
+    # Analysis step navigator: only the selected step is executed
+    analysis_steps = {
+        "Step 2: Functions": stage_2_step_functions,
+        "Step 3: Functional Failures": stage_2_step_functional_failures,
+        "Step 4: Failure Modes": stage_2_step_failure_modes,
+        "Step 5: Failure Effects": stage_2_step_failure_effects,
+        "Step 6: Consequences": stage_2_step_consequences,
+        "Step 7: Task Selection": stage_2_step_task_selection
+    }
+    
+    active_step = st.radio(
+        "Analysis Step",
+        list(analysis_steps.keys()),
+        horizontal=True,
+        label_visibility="collapsed",
+        key="stage2_active_step"
+    )
     
-    # Step 2: Functions
-    with analysis_tab[0]:
-        st.subheader("Step 2: Identify Functions")
+    analysis_steps[active_step]()
+
+# Stage 2 analysis steps
+# Each step is a fragment: widget interactions and button clicks inside a step
+# re-execute only that step instead of the whole script.
+def rerun_stage_2_step():
+    """Rerun only the current Stage 2 step after a button click"""
+    # Fragment reruns skip the top-level record_history() call, so record each save here
+    record_history()
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        # The click was handled during a full script run, where fragment scope is not allowed
+        st.rerun()
+
+@st.fragment
+def stage_2_step_functions():
+    """Step 2: Identify functions"""
+    st.subheader("Step 2: Identify Functions")
+    
+    st.markdown("**Function Format:** [Verb] + [Object] + [Performance Standard]")
+    st.markdown("**Example:** 'To pump water from Tank A to Tank B at 800 litres/second'")
+    
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        function_type = st.selectbox(
+            "Function Type",
+            ["Primary Function", "Environmental Integrity", "Safety/Structural Integrity",
+             "Control/Containment/Comfort", "Appearance", "Protection", "Economy/Efficiency"],
+            key="function_type_input"
+        )
         
-        st.markdown("**Function Format:** [Verb] + [Object] + [Performance Standard]")
-        st.markdown("**Example:** 'To pump water from Tank A to Tank B at 800 litres/second'")
+        function_verb = st.text_input("Verb", placeholder="e.g., To pump, To contain, To protect", key="function_verb_input")
+        function_object = st.text_input("Object", placeholder="e.g., water, pressure, personnel", key="function_object_input")
+        performance_std = st.text_input(
+            "Performance Standard", 
+            placeholder="e.g., at 250 L/s, between 500-600 kPa, within ±5%",
+            key="performance_std_input"
+        )
+    
+    with col2:
+        st.markdown("**Performance Standard Types:**")
+        st.markdown("""
+        - **Quantitative**: Numerical values
+        - **Qualitative**: Descriptive
+        - **Absolute**: Must be fully met
+        - **Variable**: Changes with conditions
+        - **Upper/Lower Limits**: Fixed boundaries
+        """)
+    
+    if st.button("➕ Add Function"):
+        if function_verb and function_object:
+            function = {
+                'id': len(st.session_state.functions) + 1,
+                'type': function_type,
+                'verb': function_verb,
+                'object': function_object,
+                'performance_standard': performance_std,
+                'full_statement': f"{function_verb} {function_object} {performance_std}".strip()
+            }
+            st.session_state.functions.append(function)
+            save_asset_analysis_data()
+            st.success(f"✅ Function {function['id']} added!")
+            rerun_stage_2_step()
+    
+    if st.session_state.functions:
+        st.markdown("---")
+        st.subheader("Defined Functions")
         
-        col1, col2 = st.columns([2, 1])
+        functions_df = get_cached_analysis_table(
+            ('functions',),
+            lambda: pd.DataFrame(st.session_state.functions)[['id', 'type', 'full_statement']]
+        )
+        st.dataframe(functions_df, use_container_width=True)
         
-        with col1:
-            function_type = st.selectbox(
-                "Function Type",
-                ["Primary Function", "Environmental Integrity", "Safety/Structural Integrity",
-                 "Control/Containment/Comfort", "Appearance", "Protection", "Economy/Efficiency"]
-            )
-            
-            function_verb = st.text_input("Verb", placeholder="e.g., To pump, To contain, To protect")
-            function_object = st.text_input("Object", placeholder="e.g., water, pressure, personnel")
-            performance_std = st.text_input(
-                "Performance Standard", 
-                placeholder="e.g., at 250 L/s, between 500-600 kPa, within ±5%"
-            )
+        # Delete function
+        func_to_delete = st.selectbox(
+            "Select function to delete",
+            ["None"] + [f"Function {f['id']}: {f['full_statement']}" for f in st.session_state.functions],
+            key="function_delete_select"
+        )
+        if func_to_delete != "None" and st.button("🗑️ Delete Selected Function"):
+            func_id = int(func_to_delete.split(":")[0].split()[-1])
+            cascade = cascade_delete_analysis(function_ids=[func_id])
+            st.success(f"Function deleted, with {len(cascade['functional_failures'])} functional failure(s) "
+                       f"and {len(cascade['failure_modes'])} failure mode(s)!")
+            rerun_stage_2_step()
+
+@st.fragment
+def stage_2_step_functional_failures():
+    """Step 3: Identify functional failures"""
+    st.subheader("Step 3: Identify Functional Failures")
+    
+    st.markdown("**Functional Failure:** The inability of an asset to fulfill its function at the required standard.")
+    st.markdown("**Examples:** 'Unable to pump any water', 'Pumps water at less than 250 L/s'")
+    
+    if not st.session_state.functions:
+        st.warning("⚠️ Please define functions first (Step 2)")
+    else:
+        selected_function = st.selectbox(
+            "Select Function",
+            [f"Function {f['id']}: {f['full_statement']}" for f in st.session_state.functions],
+            key="ff_function_select"
+        )
         
-        with col2:
-            st.markdown("**Performance Standard Types:**")
-            st.markdown("""
-            - **Quantitative**: Numerical values
-            - **Qualitative**: Descriptive
-            - **Absolute**: Must be fully met
-            - **Variable**: Changes with conditions
-            - **Upper/Lower Limits**: Fixed boundaries
-            """)
+        func_id = int(selected_function.split(":")[0].split()[-1])
         
-        if st.button("➕ Add Function"):
-            if function_verb and function_object:
-                function = {
-                    'id': len(st.session_state.functions) + 1,
-                    'type': function_type,
-                    'verb': function_verb,
-                    'object': function_object,
-                    'performance_standard': performance_std,
-                    'full_statement': f"{function_verb} {function_object} {performance_std}".strip()
+        # Filter failures for selected function
+        function_failures = [f for f in st.session_state.functional_failures if f['function_id'] == func_id]
+        
+        failure_description = st.text_area(
+            "Describe the Functional Failure",
+            help="How does the asset fail to meet this function?",
+            key="ff_description_input"
+        )
+        
+        failure_category = st.radio(
+            "Failure Category",
+            ["Complete loss of function", "Partial loss of function", "Exceeds upper limit", "Below lower limit"],
+            key="ff_category_input"
+        )
+        
+        # Add button
+        if st.button("➕ Add Functional Failure", use_container_width=True):
+            if failure_description:
+                failure = {
+                    'id': f"FF-{func_id}.{len([f for f in st.session_state.functional_failures if f['function_id'] == func_id]) + 1}",
+                    'function_id': func_id,
+                    'function_statement': next(f['full_statement'] for f in st.session_state.functions if f['id'] == func_id),
+                    'description': failure_description,
+                    'category': failure_category
                 }
-                st.session_state.functions.append(function)
+                st.session_state.functional_failures.append(failure)
                 save_asset_analysis_data()
-                st.success(f"✅ Function {function['id']} added!")
-                st.rerun()
+                st.success(f"✅ Functional Failure {failure['id']} added!")
+                rerun_stage_2_step()
         
-        if st.session_state.functions:
+        # Display table with selection
+        if function_failures:
             st.markdown("---")
-            st.subheader("Defined Functions")
-            
-            functions_df = pd.DataFrame(st.session_state.functions)
-            st.dataframe(functions_df[['id', 'type', 'full_statement']], use_container_width=True)
-            
-            # Delete function
-            func_to_delete = st.selectbox(
-                "Select function to delete",
-                ["None"] + [f"Function {f['id']}: {f['full_statement']}" for f in st.session_state.functions]
-            )
-            if func_to_delete != "None" and st.button("🗑️ Delete Selected Function"):
-                func_id = int(func_to_delete.split(":")[0].split()[-1])
-                st.session_state.functions = [f for f in st.session_state.functions if f['id'] != func_id]
-                save_asset_analysis_data()
-                st.success("Function deleted!")
-                st.rerun()
-    
-    # Step 3: Functional Failures
-    with analysis_tab[1]:
-        st.subheader("Step 3: Identify Functional Failures")
-        
-        st.markdown("**Functional Failure:** The inability of an asset to fulfill its function at the required standard.")
-        st.markdown("**Examples:** 'Unable to pump any water', 'Pumps water at less than 250 L/s'")
-        
-        if not st.session_state.functions:
-            st.warning("⚠️ Please define functions first (Step 2)")
-        else:
-            selected_function = st.selectbox(
-                "Select Function",
-                [f"Function {f['id']}: {f['full_statement']}" for f in st.session_state.functions]
-            )
-            
-            func_id = int(selected_function.split(":")[0].split()[-1])
-            
-            # Filter failures for selected function
-            function_failures = [f for f in st.session_state.functional_failures if f['function_id'] == func_id]
-            
-            failure_description = st.text_area(
-                "Describe the Functional Failure",
-                help="How does the asset fail to meet this function?",
-                key="ff_description_input"
-            )
+            st.subheader(f"View, Update or Delete Functional Failures for Function {func_id}")
             
-            failure_category = st.radio(
-                "Failure Category",
-                ["Complete loss of function", "Partial loss of function", "Exceeds upper limit", "Below lower limit"]
+            # Create selection interface using radio buttons
+            failure_options = ["None"] + [f"{f['id']}: {f['description']}" for f in function_failures]
+            selected_failure = st.radio(
+                "Select a Functional Failure to Update or Delete:",
+                failure_options,
+                key="ff_selection"
             )
             
-            # Add button
-            if st.button("➕ Add Functional Failure", use_container_width=True):
-                if failure_description:
-                    failure = {
-                        'id': f"FF-{func_id}.{len([f for f in st.session_state.functional_failures if f['function_id'] == func_id]) + 1}",
-                        'function_id': func_id,
-                        'function_statement': next(f['full_statement'] for f in st.session_state.functions if f['id'] == func_id),
-                        'description': failure_description,
-                        'category': failure_category
-                    }
-                    st.session_state.functional_failures.append(failure)
-                    save_asset_analysis_data()
-                    st.success(f"✅ Functional Failure {failure['id']} added!")
-                    st.rerun()
+            # Display table
+            failures_df = get_cached_analysis_table(('functional_failures', func_id), lambda: pd.DataFrame(function_failures))
+            st.dataframe(failures_df, use_container_width=True)
             
-            # Display table with selection
-            if function_failures:
-                st.markdown("---")
-                st.subheader(f"View, Update or Delete Functional Failures for Function {func_id}")
-                
-                # Create selection interface using radio buttons
-                failure_options = ["None"] + [f"{f['id']}: {f['description']}" for f in function_failures]
-                selected_failure = st.radio(
-                    "Select a Functional Failure to Update or Delete:",
-                    failure_options,
-                    key="ff_selection"
-                )
+            # Show Update/Delete options if a failure is selected
+            if selected_failure != "None":
+                selected_idx = failure_options.index(selected_failure) - 1
+                current_failure = function_failures[selected_idx]
+                # Find index in full list
+                failure_idx = next(i for i, f in enumerate(st.session_state.functional_failures) if f['id'] == current_failure['id'])
                 
-                # Display table
-                failures_df = pd.DataFrame(function_failures)
-                st.dataframe(failures_df, use_container_width=True)
+                # Update Section
+                if not st.session_state.get('editing_functional_failure', False):
+                    col_action1, col_action2 = st.columns(2)
+                    with col_action1:
+                        if st.button("✏️ Update Selected", use_container_width=True):
+                            st.session_state.editing_functional_failure = True
+                            rerun_stage_2_step()
+                    with col_action2:
+                        if st.button("🗑️ Delete Selected", use_container_width=True):
+                            st.session_state.deleting_functional_failure = True
+                            rerun_stage_2_step()
                 
-                # Show Update/Delete options if a failure is selected
-                if selected_failure != "None":
-                    selected_idx = failure_options.index(selected_failure) - 1
-                    current_failure = function_failures[selected_idx]
-                    # Find index in full list
-                    failure_idx = next(i for i, f in enumerate(st.session_state.functional_failures) if f['id'] == current_failure['id'])
+                # Update Form
+                if st.session_state.get('editing_functional_failure', False):
+                    st.markdown("---")
+                    st.markdown("### ✏️ Update Functional Failure")
                     
-                    # Update Section
-                    if not st.session_state.get('editing_functional_failure', False):
-                        col_action1, col_action2 = st.columns(2)
-                        with col_action1:
-                            if st.button("✏️ Update Selected", use_container_width=True):
-                                st.session_state.editing_functional_failure = True
-                                st.rerun()
-                        with col_action2:
-                            if st.button("🗑️ Delete Selected", use_container_width=True):
-                                st.session_state.deleting_functional_failure = True
-                                st.rerun()
+                    updated_description = st.text_area(
+                        "Update Description",
+                        value=current_failure['description'],
+                        key="update_ff_desc"
+                    )
                     
-                    # Update Form
-                    if st.session_state.get('editing_functional_failure', False):
-                        st.markdown("---")
-                        st.markdown("### ✏️ Update Functional Failure")
-                        
-                        updated_description = st.text_area(
-                            "Update Description",
-                            value=current_failure['description'],
-                            key="update_ff_desc"
-                        )
-                        
-                        updated_category = st.radio(
-                            "Update Category",
-                            ["Complete loss of function", "Partial loss of function", "Exceeds upper limit", "Below lower limit"],
-                            index=["Complete loss of function", "Partial loss of function", "Exceeds upper limit", "Below lower limit"].index(current_failure['category']),
-                            key="update_ff_cat"
-                        )
-                        
-                        col_update1, col_update2 = st.columns(2)
-                        with col_update1:
-                            if st.button("💾 Save Update", type="primary", use_container_width=True):
-                                if updated_description:
-                                    st.session_state.functional_failures[failure_idx]['description'] = updated_description
-                                    st.session_state.functional_failures[failure_idx]['category'] = updated_category
-                                    st.session_state.editing_functional_failure = False
-                                    save_asset_analysis_data()
-                                    st.success(f"✅ Functional Failure {current_failure['id']} updated!")
-                                    st.rerun()
-                                else:
-                                    st.error("Description cannot be empty")
-                        with col_update2:
-                            if st.button("❌ Cancel Update", use_container_width=True):
-                                st.session_state.editing_functional_failure = False
-                                st.rerun()
+                    updated_category = st.radio(
+                        "Update Category",
+                        ["Complete loss of function", "Partial loss of function", "Exceeds upper limit", "Below lower limit"],
+                        index=["Complete loss of function", "Partial loss of function", "Exceeds upper limit", "Below lower limit"].index(current_failure['category']),
+                        key="update_ff_cat"
+                    )
                     
-                    # Delete Confirmation
-                    if st.session_state.get('deleting_functional_failure', False):
-                        st.markdown("---")
-                        st.markdown("### 🗑️ Delete Functional Failure")
-                        st.warning("⚠️ Warning: Deleting a functional failure will also delete all associated failure modes!")
-                        
-                        # Count associated failure modes
-                        associated_modes = [fm for fm in st.session_state.failure_modes if fm.get('failure_id') == current_failure['id']]
-                        
-                        if associated_modes:
-                            st.info(f"ℹ️ This will delete {len(associated_modes)} associated failure mode(s)")
-                        
-                        col_del1, col_del2 = st.columns(2)
-                        with col_del1:
-                            if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True):
-                                # Delete associated failure modes
-                                st.session_state.failure_modes = [fm for fm in st.session_state.failure_modes 
-                                                                  if fm.get('failure_id') != current_failure['id']]
-                                # Delete the functional failure
-                                st.session_state.functional_failures.pop(failure_idx)
-                                st.session_state.deleting_functional_failure = False
+                    col_update1, col_update2 = st.columns(2)
+                    with col_update1:
+                        if st.button("💾 Save Update", type="primary", use_container_width=True):
+                            if updated_description:
+                                st.session_state.functional_failures[failure_idx]['description'] = updated_description
+                                st.session_state.functional_failures[failure_idx]['category'] = updated_category
+                                st.session_state.editing_functional_failure = False
                                 save_asset_analysis_data()
-                                st.success(f"✅ Functional Failure {current_failure['id']} deleted!")
-                                st.rerun()
-                        with col_del2:
-                            if st.button("❌ Cancel Delete", use_container_width=True):
-                                st.session_state.deleting_functional_failure = False
-                                st.rerun()
+                                st.success(f"✅ Functional Failure {current_failure['id']} updated!")
+                                rerun_stage_2_step()
+                            else:
+                                st.error("Description cannot be empty")
+                    with col_update2:
+                        if st.button("❌ Cancel Update", use_container_width=True):
+                            st.session_state.editing_functional_failure = False
+                            rerun_stage_2_step()
+                
+                # Delete Confirmation
+                if st.session_state.get('deleting_functional_failure', False):
+                    st.markdown("---")
+                    st.markdown("### 🗑️ Delete Functional Failure")
+                    st.warning("⚠️ Warning: Deleting a functional failure will also delete all associated failure modes!")
+                    
+                    # Count associated failure modes
+                    associated_modes = collect_cascade(get_reference_index(), failure_ids=[current_failure['id']])['failure_modes']
+                    
+                    if associated_modes:
+                        st.info(f"ℹ️ This will delete {len(associated_modes)} associated failure mode(s)")
+                    
+                    col_del1, col_del2 = st.columns(2)
+                    with col_del1:
+                        if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True):
+                            # Delete the functional failure with its failure modes and their results
+                            st.session_state.deleting_functional_failure = False
+                            cascade_delete_analysis(failure_ids=[current_failure['id']])
+                            st.success(f"✅ Functional Failure {current_failure['id']} deleted!")
+                            rerun_stage_2_step()
+                    with col_del2:
+                        if st.button("❌ Cancel Delete", use_container_width=True):
+                            st.session_state.deleting_functional_failure = False
+                            rerun_stage_2_step()
+
+@st.fragment
+def stage_2_step_failure_modes():
+    """Step 4: Identify failure modes"""
+    st.subheader("Step 4: Identify Failure Modes")
     
-    # Step 4: Failure Modes
-    with analysis_tab[2]:
-        st.subheader("Step 4: Identify Failure Modes")
+    st.markdown("**Failure Mode:** Any event which causes a functional failure.")
+    st.markdown("**Format:** [Component] + [What went wrong] + [Why/Cause if known]")
+    st.markdown("**Example:** 'Pump impeller worn due to normal wear'")
+    
+    if not st.session_state.functional_failures:
+        st.warning("⚠️ Please define functional failures first (Step 3)")
+    else:
+        # Show available components info
+        available_components = st.session_state.get('components', [])
+        if available_components:
+            st.info(f"ℹ️ {len(available_components)} component(s) available for this asset")
+        else:
+            st.warning("⚠️ No components defined for this asset. Please add components in Stage 1.")
+        col1, col2 = st.columns([3, 1])
+        
+        with col1:
+            selected_failure = st.selectbox(
+                "Select Functional Failure",
+                [f"{f['id']}: {f['description']}" for f in st.session_state.functional_failures],
+                key="fm_failure_select"
+            )
+            
+            failure_id = selected_failure.split(":")[0]
         
-        st.markdown("**Failure Mode:** Any event which causes a functional failure.")
-        st.markdown("**Format:** [Component] + [What went wrong] + [Why/Cause if known]")
-        st.markdown("**Example:** 'Pump impeller worn due to normal wear'")
+        with col2:
+            st.markdown("**Failure Categories:**")
+            st.markdown("""
+            - Deterioration
+            - Lubrication Failure
+            - Dirt/Contamination
+            - Disassembly
+            - Human Error
+            - Overloading
+            """)
         
-        if not st.session_state.functional_failures:
-            st.warning("⚠️ Please define functional failures first (Step 3)")
+        # Get components for the selected asset
+        available_components = st.session_state.get('components', [])
+        if available_components:
+            component_options = ["Select..."] + available_components
         else:
-            # Show available components info
-            available_components = st.session_state.get('components', [])
-            if available_components:
-                st.info(f"ℹ️ {len(available_components)} component(s) available for this asset")
-            else:
-                st.warning("⚠️ No components defined for this asset. Please add components in Stage 1.")
-            col1, col2 = st.columns([3, 1])
-            
-            with col1:
-                selected_failure = st.selectbox(
-                    "Select Functional Failure",
-                    [f"{f['id']}: {f['description']}" for f in st.session_state.functional_failures]
-                )
-                
-                failure_id = selected_failure.split(":")[0]
-            
-            with col2:
-                st.markdown("**Failure Categories:**")
-                st.markdown("""
-                - Deterioration
-                - Lubrication Failure
-                - Dirt/Contamination
-                - Disassembly
-                - Human Error
-                - Overloading
-                """)
-            
-            # Get components for the selected asset
-            available_components = st.session_state.get('components', [])
-            if available_components:
-                component_options = ["Select..."] + available_components
+            component_options = ["Define components in Stage 1"]
+        
+        component = st.selectbox(
+            "Component",
+            component_options,
+            key="fm_component_input"
+        )
+        
+        # Suggest similar failure modes analysed in saved projects
+        if component not in ("Select...", "Define components in Stage 1"):
+            suggestions = find_similar_failure_modes(component, st.session_state.get('fm_description_input', ''))
+            if suggestions:
+                with st.expander(f"📚 Similar failure modes from the library ({len(suggestions)})"):
+                    for i, (similarity, entry) in enumerate(suggestions):
+                        task = entry['management_task']
+                        col_a, col_b = st.columns([5, 1])
+                        with col_a:
+                            st.markdown(f"**{entry['component']}** - {entry['description']}  \n"
+                                        f"_{entry['category'] or 'No category'} · {entry['source']} · "
+                                        f"used {entry['occurrences']}x · similarity {similarity:.2f}_")
+                            if entry['effects'].get('evidence'):
+                                st.caption(f"Evidence: {entry['effects']['evidence']}")
+                            if task:
+                                st.caption(f"Task ({task.get('task_type', 'N/A')}): {task.get('description', '')}")
+                        with col_b:
+                            st.button("Use", key=f"use_library_mode_{i}", use_container_width=True,
+                                      on_click=apply_library_failure_mode, args=(entry,))
+        
+        failure_mode_desc = st.text_area(
+            "Failure Mode Description",
+            help="What went wrong and why? (e.g., 'Seized bearing due to lack of lubrication')",
+            key="fm_description_input"
+        )
+        
+        failure_mode_category = st.selectbox(
+            "Failure Mode Category",
+            FAILURE_MODE_CATEGORIES,
+            key="fm_category_input"
+        )
+        
+        # Filter failure modes for selected functional failure
+        functional_failure_modes = [m for m in st.session_state.failure_modes if m.get('functional_failure_id') == failure_id]
+        
+        # Add button
+        if st.button("➕ Add Failure Mode", use_container_width=True):
+            if component == "Define components in Stage 1":
+                st.error("⚠️ Please define components in Stage 1 first")
+            elif component == "Select...":
+                st.error("⚠️ Please select a component")
+            elif not failure_mode_desc:
+                st.error("⚠️ Please enter a failure mode description")
             else:
-                component_options = ["Define components in Stage 1"]
-            
-            component = st.selectbox(
-                "Component",
-                component_options
-            )
-            
-            failure_mode_desc = st.text_area(
-                "Failure Mode Description",
-                help="What went wrong and why? (e.g., 'Seized bearing due to lack of lubrication')"
-            )
+                mode = {
+                    'id': f"FM-{failure_id}-{len(functional_failure_modes) + 1}",
+                    'functional_failure_id': failure_id,
+                    'component': component,
+                    'description': failure_mode_desc,
+                    'category': failure_mode_category
+                }
+                st.session_state.failure_modes.append(mode)
+                save_asset_analysis_data()
+                st.success(f"✅ Failure Mode {mode['id']} added!")
+                rerun_stage_2_step()
+        
+        # Display table with selection
+        if functional_failure_modes:
+            st.markdown("---")
+            st.subheader(f"View, Update or Delete Failure Modes for Functional Failure {failure_id}")
             
-            failure_mode_category = st.selectbox(
-                "Failure Mode Category",
-                ["Select...", "Deterioration (wear, corrosion, fatigue)", 
-                 "Lubrication failure", "Dirt/contamination", "Disassembly (loose connections)",
-                 "Human error", "Overloading", "Other"]
+            # Create selection interface using radio buttons
+            mode_options = ["None"] + [f"{m['id']}: {m['component']} - {m['description']}" for m in functional_failure_modes]
+            selected_mode = st.radio(
+                "Select a Failure Mode to Update or Delete:",
+                mode_options,
+                key="fm_selection"
             )
             
-            # Filter failure modes for selected functional failure
-            functional_failure_modes = [m for m in st.session_state.failure_modes if m.get('functional_failure_id') == failure_id]
-            
-            # Add button
-            if st.button("➕ Add Failure Mode", use_container_width=True):
-                if component == "Define components in Stage 1":
-                    st.error("⚠️ Please define components in Stage 1 first")
-                elif component == "Select...":
-                    st.error("⚠️ Please select a component")
-                elif not failure_mode_desc:
-                    st.error("⚠️ Please enter a failure mode description")
-                else:
-                    mode = {
-                        'id': f"FM-{failure_id}-{len(functional_failure_modes) + 1}",
-                        'functional_failure_id': failure_id,
-                        'component': component,
-                        'description': failure_mode_desc,
-                        'category': failure_mode_category
-                    }
-                    st.session_state.failure_modes.append(mode)
-                    save_asset_analysis_data()
-                    st.success(f"✅ Failure Mode {mode['id']} added!")
-                    st.rerun()
+            # Display table
+            modes_df = get_cached_analysis_table(('failure_modes', failure_id), lambda: pd.DataFrame(functional_failure_modes))
+            st.dataframe(modes_df, use_container_width=True)
             
-            # Display table with selection
-            if functional_failure_modes:
-                st.markdown("---")
-                st.subheader(f"View, Update or Delete Failure Modes for Functional Failure {failure_id}")
+            # Show Update/Delete options if a mode is selected
+            if selected_mode != "None":
+                selected_idx = mode_options.index(selected_mode) - 1
+                current_mode = functional_failure_modes[selected_idx]
+                # Find index in full list
+                mode_idx = next(i for i, m in enumerate(st.session_state.failure_modes) if m['id'] == current_mode['id'])
                 
-                # Create selection interface using radio buttons
-                mode_options = ["None"] + [f"{m['id']}: {m['component']} - {m['description']}" for m in functional_failure_modes]
-                selected_mode = st.radio(
-                    "Select a Failure Mode to Update or Delete:",
-                    mode_options,
-                    key="fm_selection"
-                )
-                
-                # Display table
-                modes_df = pd.DataFrame(functional_failure_modes)
-                st.dataframe(modes_df, use_container_width=True)
+                # Update Section
+                if not st.session_state.get('editing_failure_mode', False):
+                    col_action1, col_action2 = st.columns(2)
+                    with col_action1:
+                        if st.button("✏️ Update Selected", use_container_width=True, key="update_fm_btn"):
+                            st.session_state.editing_failure_mode = True
+                            rerun_stage_2_step()
+                    with col_action2:
+                        if st.button("🗑️ Delete Selected", use_container_width=True, key="delete_fm_btn"):
+                            st.session_state.deleting_failure_mode = True
+                            rerun_stage_2_step()
                 
-                # Show Update/Delete options if a mode is selected
-                if selected_mode != "None":
-                    selected_idx = mode_options.index(selected_mode) - 1
-                    current_mode = functional_failure_modes[selected_idx]
-                    # Find index in full list
-                    mode_idx = next(i for i, m in enumerate(st.session_state.failure_modes) if m['id'] == current_mode['id'])
+                # Update Form
+                if st.session_state.get('editing_failure_mode', False):
+                    st.markdown("---")
+                    st.markdown("### ✏️ Update Failure Mode")
                     
-                    # Update Section
-                    if not st.session_state.get('editing_failure_mode', False):
-                        col_action1, col_action2 = st.columns(2)
-                        with col_action1:
-                            if st.button("✏️ Update Selected", use_container_width=True, key="update_fm_btn"):
-                                st.session_state.editing_failure_mode = True
-                                st.rerun()
-                        with col_action2:
-                            if st.button("🗑️ Delete Selected", use_container_width=True, key="delete_fm_btn"):
-                                st.session_state.deleting_failure_mode = True
-                                st.rerun()
+                    # Get components for the selected asset
+                    available_components_update = st.session_state.get('components', [])
+                    if available_components_update:
+                        component_options_update = ["Select..."] + available_components_update
+                        current_comp_idx = component_options_update.index(current_mode['component']) if current_mode['component'] in component_options_update else 0
+                    else:
+                        component_options_update = ["Define components in Stage 1"]
+                        current_comp_idx = 0
                     
-                    # Update Form
-                    if st.session_state.get('editing_failure_mode', False):
-                        st.markdown("---")
-                        st.markdown("### ✏️ Update Failure Mode")
-                        
-                        # Get components for the selected asset
-                        available_components_update = st.session_state.get('components', [])
-                        if available_components_update:
-                            component_options_update = ["Select..."] + available_components_update
-                            current_comp_idx = component_options_update.index(current_mode['component']) if current_mode['component'] in component_options_update else 0
-                        else:
-                            component_options_update = ["Define components in Stage 1"]
-                            current_comp_idx = 0
-                        
-                        updated_component = st.selectbox(
-                            "Update Component",
-                            component_options_update,
-                            index=current_comp_idx,
-                            key="update_fm_comp"
-                        )
-                        
-                        updated_description = st.text_area(
-                            "Update Description",
-                            value=current_mode['description'],
-                            key="update_fm_desc"
-                        )
-                        
-                        updated_category = st.selectbox(
-                            "Update Category",
-                            ["Select...", "Deterioration (wear, corrosion, fatigue)", 
-                             "Lubrication failure", "Dirt/contamination", "Disassembly (loose connections)",
-                             "Human error", "Overloading", "Other"],
-                            index=["Select...", "Deterioration (wear, corrosion, fatigue)", 
-                                   "Lubrication failure", "Dirt/contamination", "Disassembly (loose connections)",
-                                   "Human error", "Overloading", "Other"].index(current_mode['category']) if current_mode['category'] in ["Select...", "Deterioration (wear, corrosion, fatigue)", 
-                                   "Lubrication failure", "Dirt/contamination", "Disassembly (loose connections)",
-                                   "Human error", "Overloading", "Other"] else 0,
-                            key="update_fm_cat"
-                        )
-                        
-                        col_update1, col_update2 = st.columns(2)
-                        with col_update1:
-                            if st.button("💾 Save Update", type="primary", use_container_width=True, key="save_fm_update"):
-                                if updated_component == "Select..." or updated_component == "Define components in Stage 1":
-                                    st.error("Please select a valid component")
-                                elif not updated_description:
-                                    st.error("Description cannot be empty")
-                                else:
-                                    st.session_state.failure_modes[mode_idx]['component'] = updated_component
-                                    st.session_state.failure_modes[mode_idx]['description'] = updated_description
-                                    st.session_state.failure_modes[mode_idx]['category'] = updated_category
-                                    st.session_state.editing_failure_mode = False
-                                    save_asset_analysis_data()
-                                    st.success(f"✅ Failure Mode {current_mode['id']} updated!")
-                                    st.rerun()
-                        with col_update2:
-                            if st.button("❌ Cancel Update", use_container_width=True, key="cancel_fm_update"):
-                                st.session_state.editing_failure_mode = False
-                                st.rerun()
+                    updated_component = st.selectbox(
+                        "Update Component",
+                        component_options_update,
+                        index=current_comp_idx,
+                        key="update_fm_comp"
+                    )
                     
-                    # Delete Confirmation
-                    if st.session_state.get('deleting_failure_mode', False):
-                        st.markdown("---")
-                        st.markdown("### 🗑️ Delete Failure Mode")
-                        st.warning("⚠️ Warning: This will delete the selected failure mode!")
-                        
-                        col_del1, col_del2 = st.columns(2)
-                        with col_del1:
-                            if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True, key="confirm_fm_delete"):
-                                # Delete the failure mode
-                                st.session_state.failure_modes.pop(mode_idx)
-                                st.session_state.deleting_failure_mode = False
+                    updated_description = st.text_area(
+                        "Update Description",
+                        value=current_mode['description'],
+                        key="update_fm_desc"
+                    )
+                    
+                    updated_category = st.selectbox(
+                        "Update Category",
+                        ["Select...", "Deterioration (wear, corrosion, fatigue)", 
+                         "Lubrication failure", "Dirt/contamination", "Disassembly (loose connections)",
+                         "Human error", "Overloading", "Other"],
+                        index=["Select...", "Deterioration (wear, corrosion, fatigue)", 
+                               "Lubrication failure", "Dirt/contamination", "Disassembly (loose connections)",
+                               "Human error", "Overloading", "Other"].index(current_mode['category']) if current_mode['category'] in ["Select...", "Deterioration (wear, corrosion, fatigue)", 
+                               "Lubrication failure", "Dirt/contamination", "Disassembly (loose connections)",
+                               "Human error", "Overloading", "Other"] else 0,
+                        key="update_fm_cat"
+                    )
+                    
+                    col_update1, col_update2 = st.columns(2)
+                    with col_update1:
+                        if st.button("💾 Save Update", type="primary", use_container_width=True, key="save_fm_update"):
+                            if updated_component == "Select..." or updated_component == "Define components in Stage 1":
+                                st.error("Please select a valid component")
+                            elif not updated_description:
+                                st.error("Description cannot be empty")
+                            else:
+                                st.session_state.failure_modes[mode_idx]['component'] = updated_component
+                                st.session_state.failure_modes[mode_idx]['description'] = updated_description
+                                st.session_state.failure_modes[mode_idx]['category'] = updated_category
+                                st.session_state.editing_failure_mode = False
                                 save_asset_analysis_data()
-                                st.success(f"✅ Failure Mode {current_mode['id']} deleted!")
-                                st.rerun()
-                        with col_del2:
-                            if st.button("❌ Cancel Delete", use_container_width=True, key="cancel_fm_delete"):
-                                st.session_state.deleting_failure_mode = False
-                                st.rerun()
+                                st.success(f"✅ Failure Mode {current_mode['id']} updated!")
+                                rerun_stage_2_step()
+                    with col_update2:
+                        if st.button("❌ Cancel Update", use_container_width=True, key="cancel_fm_update"):
+                            st.session_state.editing_failure_mode = False
+                            rerun_stage_2_step()
+                
+                # Delete Confirmation
+                if st.session_state.get('deleting_failure_mode', False):
+                    st.markdown("---")
+                    st.markdown("### 🗑️ Delete Failure Mode")
+                    st.warning("⚠️ Warning: This will delete the selected failure mode!")
+                    
+                    col_del1, col_del2 = st.columns(2)
+                    with col_del1:
+                        if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True, key="confirm_fm_delete"):
+                            # Delete the failure mode and its analysis results
+                            st.session_state.deleting_failure_mode = False
+                            cascade_delete_analysis(mode_ids=[current_mode['id']])
+                            st.success(f"✅ Failure Mode {current_mode['id']} deleted!")
+                            rerun_stage_2_step()
+                    with col_del2:
+                        if st.button("❌ Cancel Delete", use_container_width=True, key="cancel_fm_delete"):
+                            st.session_state.deleting_failure_mode = False
+                            rerun_stage_2_step()
+
+@st.fragment
+def stage_2_step_failure_effects():
+    """Step 5: Identify failure effects"""
+    st.subheader("Step 5: Identify Failure Effects")
     
-    # Step 5: Failure Effects
-    with analysis_tab[3]:
-        st.subheader("Step 5: Identify Failure Effects")
+    st.markdown("**Failure Effect:** Describes what happens when a failure mode occurs.")
+    st.markdown("Document the **worst-case scenario** assuming nothing is being done to prevent the failure.")
+    
+    if not st.session_state.failure_modes:
+        st.warning("⚠️ Please define failure modes first (Step 4)")
+    else:
+        selected_mode = st.selectbox(
+            "Select Failure Mode",
+            [f"{m['id']}: {m['component']} - {m['description']}" for m in st.session_state.failure_modes],
+            key="effect_mode_select"
+        )
         
-        st.markdown("**Failure Effect:** Describes what happens when a failure mode occurs.")
-        st.markdown("Document the **worst-case scenario** assuming nothing is being done to prevent the failure.")
+        mode_id = selected_mode.split(":")[0]
         
-        if not st.session_state.failure_modes:
-            st.warning("⚠️ Please define failure modes first (Step 4)")
-        else:
-            selected_mode = st.selectbox(
-                "Select Failure Mode",
-                [f"{m['id']}: {m['component']} - {m['description']}" for m in st.session_state.failure_modes]
+        st.markdown("**Describe the failure effects in detail:**")
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            evidence = st.text_area(
+                "Evidence of Failure",
+                help="What signs indicate this failure? How is it detected?",
+                key="effect_evidence_input"
             )
             
-            mode_id = selected_mode.split(":")[0]
-            
-            st.markdown("**Describe the failure effects in detail:**")
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                evidence = st.text_area(
-                    "Evidence of Failure",
-                    help="What signs indicate this failure? How is it detected?"
-                )
-                
-                safety_impact = st.text_area(
-                    "Safety/Environmental Impact",
-                    help="Could someone be hurt/killed? Any environmental breach?"
-                )
-            
-            with col2:
-                operational_impact = st.text_area(
-                    "Operational Impact",
-                    help="Effect on production, quality, customer service, operating costs"
-                )
-                
-                physical_damage = st.text_area(
-                    "Physical Damage",
-                    help="Damage to this or other equipment"
-                )
-            
-            repair_action = st.text_area(
-                "Repair Action Required",
-                help="What must be done to fix it?"
+            safety_impact = st.text_area(
+                "Safety/Environmental Impact",
+                help="Could someone be hurt/killed? Any environmental breach?",
+                key="effect_safety_input"
+            )
+        
+        with col2:
+            operational_impact = st.text_area(
+                "Operational Impact",
+                help="Effect on production, quality, customer service, operating costs",
+                key="effect_operational_input"
             )
             
-            col1, col2 = st.columns(2)
-            with col1:
-                repair_time = st.number_input("Repair Time (hours)", min_value=0.0, step=0.5)
-            with col2:
-                downtime = st.number_input("Total Downtime (hours)", min_value=0.0, step=0.5,
-                                          help="Includes diagnosis, parts, repair, and recommissioning")
-            
-            # Check if effects already exist for this failure mode
-            current_mode = next((m for m in st.session_state.failure_modes if m['id'] == mode_id), None)
-            has_effects = current_mode and 'effects' in current_mode
+            physical_damage = st.text_area(
+                "Physical Damage",
+                help="Damage to this or other equipment",
+                key="effect_damage_input"
+            )
+        
+        repair_action = st.text_area(
+            "Repair Action Required",
+            help="What must be done to fix it?",
+            key="effect_repair_input"
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            repair_time = st.number_input("Repair Time (hours)", min_value=0.0, step=0.5, key="effect_repair_time_input")
+        with col2:
+            downtime = st.number_input("Total Downtime (hours)", min_value=0.0, step=0.5,
+                                      help="Includes diagnosis, parts, repair, and recommissioning",
+                                      key="effect_downtime_input")
+        
+        # Check if effects already exist for this failure mode
+        current_mode = next((m for m in st.session_state.failure_modes if m['id'] == mode_id), None)
+        has_effects = current_mode and 'effects' in current_mode
+        
+        # Add button
+        if st.button("➕ Add Failure Effect", use_container_width=True):
+            if not evidence:
+                st.error("⚠️ Please enter evidence of failure")
+            else:
+                # Find the failure mode to update
+                for mode in st.session_state.failure_modes:
+                    if mode['id'] == mode_id:
+                        mode['effects'] = {
+                            'evidence': evidence,
+                            'safety_impact': safety_impact,
+                            'operational_impact': operational_impact,
+                            'physical_damage': physical_damage,
+                            'repair_action': repair_action,
+                            'repair_time': repair_time,
+                            'downtime': downtime
+                        }
+                        save_asset_analysis_data()
+                        st.success(f"✅ Failure effects added to {mode_id}")
+                        rerun_stage_2_step()
+        
+        # Display table with selection for failure modes with effects
+        modes_with_effects = [m for m in st.session_state.failure_modes if 'effects' in m]
+        
+        if modes_with_effects:
+            st.markdown("---")
+            st.subheader(f"View, Update or Delete Failure Effects")
             
-            # Add button
-            if st.button("➕ Add Failure Effect", use_container_width=True):
-                if not evidence:
-                    st.error("⚠️ Please enter evidence of failure")
-                else:
-                    # Find the failure mode to update
-                    for mode in st.session_state.failure_modes:
-                        if mode['id'] == mode_id:
-                            mode['effects'] = {
-                                'evidence': evidence,
-                                'safety_impact': safety_impact,
-                                'operational_impact': operational_impact,
-                                'physical_damage': physical_damage,
-                                'repair_action': repair_action,
-                                'repair_time': repair_time,
-                                'downtime': downtime
-                            }
-                            save_asset_analysis_data()
-                            st.success(f"✅ Failure effects added to {mode_id}")
-                            st.rerun()
+            # Create selection interface using radio buttons
+            effect_options = ["None"] + [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_effects]
+            selected_effect = st.radio(
+                "Select a Failure Mode to View, Update or Delete its Effects:",
+                effect_options,
+                key="effect_selection"
+            )
             
-            # Display table with selection for failure modes with effects
-            modes_with_effects = [m for m in st.session_state.failure_modes if 'effects' in m]
+            # Display table of failure modes with effects
+            effects_df = get_cached_analysis_table(('effects',), lambda: build_failure_effects_table(modes_with_effects))
+            st.dataframe(effects_df, use_container_width=True, height=400)
             
-            if modes_with_effects:
+            # Show Update/Delete options if an effect is selected
+            if selected_effect != "None":
+                selected_mode_id = selected_effect.split(":")[0]
+                selected_mode = next(m for m in modes_with_effects if m['id'] == selected_mode_id)
+                mode_idx = next(i for i, m in enumerate(st.session_state.failure_modes) if m['id'] == selected_mode_id)
+                
+                # Display full effects
                 st.markdown("---")
-                st.subheader(f"View, Update or Delete Failure Effects")
+                st.markdown(f"### Effects for {selected_mode_id}")
+                effects = selected_mode['effects']
                 
-                # Create selection interface using radio buttons
-                effect_options = ["None"] + [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_effects]
-                selected_effect = st.radio(
-                    "Select a Failure Mode to View, Update or Delete its Effects:",
-                    effect_options,
-                    key="effect_selection"
-                )
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.markdown(f"**Evidence:** {effects.get('evidence', 'N/A')}")
+                    st.markdown(f"**Safety Impact:** {effects.get('safety_impact', 'N/A')}")
+                    st.markdown(f"**Operational Impact:** {effects.get('operational_impact', 'N/A')}")
+                with col2:
+                    st.markdown(f"**Physical Damage:** {effects.get('physical_damage', 'N/A')}")
+                    st.markdown(f"**Repair Action:** {effects.get('repair_action', 'N/A')}")
+                    st.markdown(f"**Repair Time:** {effects.get('repair_time', 0)} hours")
+                    st.markdown(f"**Downtime:** {effects.get('downtime', 0)} hours")
                 
-                # Display table of failure modes with effects
-                effects_display = []
-                for m in modes_with_effects:
-                    effects_display.append({
-                        'Failure Mode ID': m['id'],
-                        'Component': m['component'],
-                        'Description': m['description'],
-                        'Evidence': m['effects'].get('evidence', 'N/A'),
-                        'Safety Impact': m['effects'].get('safety_impact', 'N/A'),
-                        'Operational Impact': m['effects'].get('operational_impact', 'N/A'),
-                        'Physical Damage': m['effects'].get('physical_damage', 'N/A'),
-                        'Repair Action': m['effects'].get('repair_action', 'N/A'),
-                        'Repair Time (hrs)': m['effects'].get('repair_time', 0),
-                        'Downtime (hrs)': m['effects'].get('downtime', 0)
-                    })
-                effects_df = pd.DataFrame(effects_display)
-                st.dataframe(effects_df, use_container_width=True, height=400)
+                # Update Section
+                if not st.session_state.get('editing_failure_effect', False):
+                    col_action1, col_action2 = st.columns(2)
+                    with col_action1:
+                        if st.button("✏️ Update Selected", use_container_width=True, key="update_effect_btn"):
+                            st.session_state.editing_failure_effect = True
+                            rerun_stage_2_step()
+                    with col_action2:
+                        if st.button("🗑️ Delete Selected", use_container_width=True, key="delete_effect_btn"):
+                            st.session_state.deleting_failure_effect = True
+                            rerun_stage_2_step()
                 
-                # Show Update/Delete options if an effect is selected
-                if selected_effect != "None":
-                    selected_mode_id = selected_effect.split(":")[0]
-                    selected_mode = next(m for m in modes_with_effects if m['id'] == selected_mode_id)
-                    mode_idx = next(i for i, m in enumerate(st.session_state.failure_modes) if m['id'] == selected_mode_id)
-                    
-                    # Display full effects
+                # Update Form
+                if st.session_state.get('editing_failure_effect', False):
                     st.markdown("---")
-                    st.markdown(f"### Effects for {selected_mode_id}")
-                    effects = selected_mode['effects']
+                    st.markdown("### ✏️ Update Failure Effects")
                     
                     col1, col2 = st.columns(2)
+                    
                     with col1:
-                        st.markdown(f"**Evidence:** {effects.get('evidence', 'N/A')}")
-                        st.markdown(f"**Safety Impact:** {effects.get('safety_impact', 'N/A')}")
-                        st.markdown(f"**Operational Impact:** {effects.get('operational_impact', 'N/A')}")
+                        updated_evidence = st.text_area(
+                            "Update Evidence of Failure",
+                            value=effects.get('evidence', ''),
+                            key="update_effect_evidence"
+                        )
+                        
+                        updated_safety = st.text_area(
+                            "Update Safety/Environmental Impact",
+                            value=effects.get('safety_impact', ''),
+                            key="update_effect_safety"
+                        )
+                    
                     with col2:
-                        st.markdown(f"**Physical Damage:** {effects.get('physical_damage', 'N/A')}")
-                        st.markdown(f"**Repair Action:** {effects.get('repair_action', 'N/A')}")
-                        st.markdown(f"**Repair Time:** {effects.get('repair_time', 0)} hours")
-                        st.markdown(f"**Downtime:** {effects.get('downtime', 0)} hours")
+                        updated_operational = st.text_area(
+                            "Update Operational Impact",
+                            value=effects.get('operational_impact', ''),
+                            key="update_effect_operational"
+                        )
+                        
+                        updated_damage = st.text_area(
+                            "Update Physical Damage",
+                            value=effects.get('physical_damage', ''),
+                            key="update_effect_damage"
+                        )
                     
-                    # Update Section
-                    if not st.session_state.get('editing_failure_effect', False):
-                        col_action1, col_action2 = st.columns(2)
-                        with col_action1:
-                            if st.button("✏️ Update Selected", use_container_width=True, key="update_effect_btn"):
-                                st.session_state.editing_failure_effect = True
-                                st.rerun()
-                        with col_action2:
-                            if st.button("🗑️ Delete Selected", use_container_width=True, key="delete_effect_btn"):
-                                st.session_state.deleting_failure_effect = True
-                                st.rerun()
+                    updated_repair = st.text_area(
+                        "Update Repair Action Required",
+                        value=effects.get('repair_action', ''),
+                        key="update_effect_repair"
+                    )
                     
-                    # Update Form
-                    if st.session_state.get('editing_failure_effect', False):
-                        st.markdown("---")
-                        st.markdown("### ✏️ Update Failure Effects")
-                        
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            updated_evidence = st.text_area(
-                                "Update Evidence of Failure",
-                                value=effects.get('evidence', ''),
-                                key="update_effect_evidence"
-                            )
-                            
-                            updated_safety = st.text_area(
-                                "Update Safety/Environmental Impact",
-                                value=effects.get('safety_impact', ''),
-                                key="update_effect_safety"
-                            )
-                        
-                        with col2:
-                            updated_operational = st.text_area(
-                                "Update Operational Impact",
-                                value=effects.get('operational_impact', ''),
-                                key="update_effect_operational"
-                            )
-                            
-                            updated_damage = st.text_area(
-                                "Update Physical Damage",
-                                value=effects.get('physical_damage', ''),
-                                key="update_effect_damage"
-                            )
-                        
-                        updated_repair = st.text_area(
-                            "Update Repair Action Required",
-                            value=effects.get('repair_action', ''),
-                            key="update_effect_repair"
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        updated_repair_time = st.number_input(
+                            "Update Repair Time (hours)",
+                            min_value=0.0,
+                            step=0.5,
+                            value=float(effects.get('repair_time', 0)),
+                            key="update_effect_repair_time"
+                        )
+                    with col2:
+                        updated_downtime = st.number_input(
+                            "Update Total Downtime (hours)",
+                            min_value=0.0,
+                            step=0.5,
+                            value=float(effects.get('downtime', 0)),
+                            key="update_effect_downtime"
                         )
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            updated_repair_time = st.number_input(
-                                "Update Repair Time (hours)",
-                                min_value=0.0,
-                                step=0.5,
-                                value=float(effects.get('repair_time', 0)),
-                                key="update_effect_repair_time"
-                            )
-                        with col2:
-                            updated_downtime = st.number_input(
-                                "Update Total Downtime (hours)",
-                                min_value=0.0,
-                                step=0.5,
-                                value=float(effects.get('downtime', 0)),
-                                key="update_effect_downtime"
-                            )
-                        
-                        col_update1, col_update2 = st.columns(2)
-                        with col_update1:
-                            if st.button("💾 Save Update", type="primary", use_container_width=True, key="save_effect_update"):
-                                if not updated_evidence:
-                                    st.error("Evidence cannot be empty")
-                                else:
-                                    st.session_state.failure_modes[mode_idx]['effects'] = {
-                                        'evidence': updated_evidence,
-                                        'safety_impact': updated_safety,
-                                        'operational_impact': updated_operational,
-                                        'physical_damage': updated_damage,
-                                        'repair_action': updated_repair,
-                                        'repair_time': updated_repair_time,
-                                        'downtime': updated_downtime
-                                    }
-                                    st.session_state.editing_failure_effect = False
-                                    save_asset_analysis_data()
-                                    st.success(f"✅ Failure effects for {selected_mode_id} updated!")
-                                    st.rerun()
-                        with col_update2:
-                            if st.button("❌ Cancel Update", use_container_width=True, key="cancel_effect_update"):
-                                st.session_state.editing_failure_effect = False
-                                st.rerun()
                     
-                    # Delete Confirmation
-                    if st.session_state.get('deleting_failure_effect', False):
-                        st.markdown("---")
-                        st.markdown("### 🗑️ Delete Failure Effects")
-                        st.warning(f"⚠️ Warning: This will delete the failure effects for {selected_mode_id}!")
-                        
-                        col_del1, col_del2 = st.columns(2)
-                        with col_del1:
-                            if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True, key="confirm_effect_delete"):
-                                # Delete the effects
-                                if 'effects' in st.session_state.failure_modes[mode_idx]:
-                                    del st.session_state.failure_modes[mode_idx]['effects']
-                                st.session_state.deleting_failure_effect = False
+                    col_update1, col_update2 = st.columns(2)
+                    with col_update1:
+                        if st.button("💾 Save Update", type="primary", use_container_width=True, key="save_effect_update"):
+                            if not updated_evidence:
+                                st.error("Evidence cannot be empty")
+                            else:
+                                st.session_state.failure_modes[mode_idx]['effects'] = {
+                                    'evidence': updated_evidence,
+                                    'safety_impact': updated_safety,
+                                    'operational_impact': updated_operational,
+                                    'physical_damage': updated_damage,
+                                    'repair_action': updated_repair,
+                                    'repair_time': updated_repair_time,
+                                    'downtime': updated_downtime
+                                }
+                                st.session_state.editing_failure_effect = False
                                 save_asset_analysis_data()
-                                st.success(f"✅ Failure effects for {selected_mode_id} deleted!")
-                                st.rerun()
-                        with col_del2:
-                            if st.button("❌ Cancel Delete", use_container_width=True, key="cancel_effect_delete"):
-                                st.session_state.deleting_failure_effect = False
-                                st.rerun()
+                                st.success(f"✅ Failure effects for {selected_mode_id} updated!")
+                                rerun_stage_2_step()
+                    with col_update2:
+                        if st.button("❌ Cancel Update", use_container_width=True, key="cancel_effect_update"):
+                            st.session_state.editing_failure_effect = False
+                            rerun_stage_2_step()
+                
+                # Delete Confirmation
+                if st.session_state.get('deleting_failure_effect', False):
+                    st.markdown("---")
+                    st.markdown("### 🗑️ Delete Failure Effects")
+                    st.warning(f"⚠️ Warning: This will delete the failure effects for {selected_mode_id}!")
+                    
+                    col_del1, col_del2 = st.columns(2)
+                    with col_del1:
+                        if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True, key="confirm_effect_delete"):
+                            # Delete the effects
+                            if 'effects' in st.session_state.failure_modes[mode_idx]:
+                                del st.session_state.failure_modes[mode_idx]['effects']
+                            st.session_state.deleting_failure_effect = False
+                            save_asset_analysis_data()
+                            st.success(f"✅ Failure effects for {selected_mode_id} deleted!")
+                            rerun_stage_2_step()
+                    with col_del2:
+                        if st.button("❌ Cancel Delete", use_container_width=True, key="cancel_effect_delete"):
+                            st.session_state.deleting_failure_effect = False
+                            rerun_stage_2_step()
+
+@st.fragment
+def stage_2_step_consequences():
+    """Step 6: Categorize consequences"""
+    st.subheader("Step 6: Categorize Consequences")
+    
+    st.markdown("**Objective:** Determine the significance of each failure mode by categorizing its consequences.")
+    
+    # Filter failure modes that have effects defined
+    modes_with_effects = [m for m in st.session_state.failure_modes if 'effects' in m]
     
-    # Step 6: Consequence Categories
-    with analysis_tab[4]:
-        st.subheader("Step 6: Categorize Consequences")
+    if not modes_with_effects:
+        st.warning("⚠️ Please define failure effects first (Step 5)")
+    else:
+        selected_mode = st.selectbox(
+            "Select Failure Mode to Categorize",
+            [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_effects],
+            key="consequence_mode_select"
+        )
         
-        st.markdown("**Objective:** Determine the significance of each failure mode by categorizing its consequences.")
+        mode_id = selected_mode.split(":")[0]
+        current_mode = next(m for m in st.session_state.failure_modes if m['id'] == mode_id)
         
-        # Filter failure modes that have effects defined
-        modes_with_effects = [m for m in st.session_state.failure_modes if 'effects' in m]
+        # Display failure effects
+        st.markdown("**Failure Effects Summary:**")
+        if 'effects' in current_mode:
+            effects = current_mode['effects']
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown(f"**Evidence:** {effects.get('evidence', 'N/A')}")
+                st.markdown(f"**Safety Impact:** {effects.get('safety_impact', 'N/A')}")
+            with col2:
+                st.markdown(f"**Operational Impact:** {effects.get('operational_impact', 'N/A')}")
+                st.markdown(f"**Downtime:** {effects.get('downtime', 0)} hours")
         
-        if not modes_with_effects:
-            st.warning("⚠️ Please define failure effects first (Step 5)")
-        else:
-            selected_mode = st.selectbox(
-                "Select Failure Mode to Categorize",
-                [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_effects],
-                key="consequence_mode_select"
-            )
-            
-            mode_id = selected_mode.split(":")[0]
-            current_mode = next(m for m in st.session_state.failure_modes if m['id'] == mode_id)
+        st.markdown("---")
+        st.markdown("### Consequence Decision Logic")
+        
+        # Question 1: Evident or Hidden?
+        is_evident = st.radio(
+            "**Q1: Will the failure become evident to operators under normal circumstances?**",
+            ["Yes - Evident", "No - Hidden (failure of protective device)"],
+            help="Evident = operators will know it failed. Hidden = failure only discovered when needed or during testing",
+            key="consequence_evident_input"
+        )
+        
+        # Branch based on evident/hidden
+        if "Hidden" in is_evident:
+            st.info("This is a **Hidden Failure** - typically protective devices that fail silently")
             
-            # Display failure effects
-            st.markdown("**Failure Effects Summary:**")
-            if 'effects' in current_mode:
-                effects = current_mode['effects']
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.markdown(f"**Evidence:** {effects.get('evidence', 'N/A')}")
-                    st.markdown(f"**Safety Impact:** {effects.get('safety_impact', 'N/A')}")
-                with col2:
-                    st.markdown(f"**Operational Impact:** {effects.get('operational_impact', 'N/A')}")
-                    st.markdown(f"**Downtime:** {effects.get('downtime', 0)} hours")
+            hidden_consequence = st.radio(
+                "**Q2: If a multiple failure occurs (protected function fails while protective device is failed), what are the consequences?**",
+                ["Safety or Environmental impact", "Operational impact", "Non-operational (just repair cost)"],
+                key="consequence_hidden_type_input"
+            )
             
-            st.markdown("---")
-            st.markdown("### Consequence Decision Logic")
+            if "Safety" in hidden_consequence:
+                consequence_category = "Hidden (Safety/Environmental)"
+                color = "red"
+            elif "Operational" in hidden_consequence:
+                consequence_category = "Hidden (Operational)"
+                color = "orange"
+            else:
+                consequence_category = "Hidden (Non-operational)"
+                color = "yellow"
+        
+        else:  # Evident
+            st.info("This is an **Evident Failure** - operators will know when it occurs")
             
-            # Question 1: Evident or Hidden?
-            is_evident = st.radio(
-                "**Q1: Will the failure become evident to operators under normal circumstances?**",
-                ["Yes - Evident", "No - Hidden (failure of protective device)"],
-                help="Evident = operators will know it failed. Hidden = failure only discovered when needed or during testing"
+            evident_consequence = st.radio(
+                "**Q2: What are the consequences of this evident failure?**",
+                ["Safety or Environmental impact", 
+                 "Operational impact (affects output, quality, service, or operating costs)", 
+                 "Non-operational (only direct repair cost)"],
+                key="consequence_evident_type_input"
             )
             
-            # Branch based on evident/hidden
-            if "Hidden" in is_evident:
-                st.info("This is a **Hidden Failure** - typically protective devices that fail silently")
-                
-                hidden_consequence = st.radio(
-                    "**Q2: If a multiple failure occurs (protected function fails while protective device is failed), what are the consequences?**",
-                    ["Safety or Environmental impact", "Operational impact", "Non-operational (just repair cost)"]
-                )
-                
-                if "Safety" in hidden_consequence:
-                    consequence_category = "Hidden (Safety/Environmental)"
-                    color = "red"
-                elif "Operational" in hidden_consequence:
-                    consequence_category = "Hidden (Operational)"
-                    color = "orange"
-                else:
-                    consequence_category = "Hidden (Non-operational)"
-                    color = "yellow"
+            if "Safety" in evident_consequence:
+                consequence_category = "Evident (Safety/Environmental)"
+                color = "red"
+            elif "Operational" in evident_consequence:
+                consequence_category = "Evident (Operational)"
+                color = "orange"
+            else:
+                consequence_category = "Evident (Non-operational)"
+                color = "yellow"
+        
+        st.markdown(f"**Consequence Category:** {consequence_category}")
+        st.markdown("---")
+        
+        # Additional risk assessment for safety consequences
+        if "Safety" in consequence_category or "Environmental" in consequence_category:
+            st.markdown("")
+            st.markdown("#### Risk Assessment")
+            col1, col2, col3 = st.columns(3)
             
-            else:  # Evident
-                st.info("This is an **Evident Failure** - operators will know when it occurs")
-                
-                evident_consequence = st.radio(
-                    "**Q2: What are the consequences of this evident failure?**",
-                    ["Safety or Environmental impact", 
-                     "Operational impact (affects output, quality, service, or operating costs)", 
-                     "Non-operational (only direct repair cost)"]
+            with col1:
+                consequence_rating = st.select_slider(
+                    "Consequence Severity",
+                    options=["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"],
+                    key="consequence_rating_input"
                 )
-                
-                if "Safety" in evident_consequence:
-                    consequence_category = "Evident (Safety/Environmental)"
-                    color = "red"
-                elif "Operational" in evident_consequence:
-                    consequence_category = "Evident (Operational)"
-                    color = "orange"
-                else:
-                    consequence_category = "Evident (Non-operational)"
-                    color = "yellow"
             
-            st.markdown(f"**Consequence Category:** {consequence_category}")
-            st.markdown("---")
+            with col2:
+                likelihood_rating = st.select_slider(
+                    "Likelihood",
+                    options=["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"],
+                    key="likelihood_rating_input"
+                )
             
-            # Additional risk assessment for safety consequences
-            if "Safety" in consequence_category or "Environmental" in consequence_category:
-                st.markdown("")
-                st.markdown("#### Risk Assessment")
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    consequence_rating = st.select_slider(
-                        "Consequence Severity",
-                        options=["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"],
-                        value="3-Moderate"
-                    )
+            with col3:
+                # Calculate risk score
+                cons_num = int(consequence_rating[0])
+                like_num = int(likelihood_rating[0])
+                risk_score = cons_num + like_num
                 
-                with col2:
-                    likelihood_rating = st.select_slider(
-                        "Likelihood",
-                        options=["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"],
-                        value="3-Occasional"
-                    )
+                # Get risk level based on current thresholds
+                risk_level, risk_color = get_risk_level(risk_score)
                 
-                with col3:
-                    # Calculate risk score
-                    cons_num = int(consequence_rating[0])
-                    like_num = int(likelihood_rating[0])
-                    risk_score = cons_num + like_num
-                    
-                    # Get risk level based on current thresholds
-                    risk_level, risk_color = get_risk_level(risk_score)
-                    
-                    st.markdown(f"""
-                    <div style="background-color: {risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
-                    <strong>Risk Level: {risk_level}</strong><br>
-                    Score: {risk_score}
-                    </div>
-                    """, unsafe_allow_html=True)
+                st.markdown(f"""
+                <div style="background-color: {risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
+                <strong>Risk Level: {risk_level}</strong><br>
+                Score: {risk_score}
+                </div>
+                """, unsafe_allow_html=True)
+        
+        # Add/Save button
+        if st.button("💾 Save Consequence Category", use_container_width=True):
+            for mode in st.session_state.failure_modes:
+                if mode['id'] == mode_id:
+                    mode['consequence_category'] = consequence_category
+                    if "Safety" in consequence_category or "Environmental" in consequence_category:
+                        mode['risk_assessment'] = {
+                            'consequence': consequence_rating,
+                            'likelihood': likelihood_rating,
+                            'risk_score': risk_score,
+                            'risk_level': risk_level
+                        }
+                    save_asset_analysis_data()
+                    st.success(f"✅ Consequence category saved for {mode_id}")
+                    rerun_stage_2_step()
+        
+        # Display table with selection for failure modes with consequence categories
+        modes_with_consequences = [m for m in st.session_state.failure_modes if 'consequence_category' in m]
+        
+        if modes_with_consequences:
+            st.markdown("---")
+            st.subheader(f"View, Update or Delete Consequence Categories")
             
-            # Add/Save button
-            if st.button("💾 Save Consequence Category", use_container_width=True):
-                for mode in st.session_state.failure_modes:
-                    if mode['id'] == mode_id:
-                        mode['consequence_category'] = consequence_category
-                        if "Safety" in consequence_category or "Environmental" in consequence_category:
-                            mode['risk_assessment'] = {
-                                'consequence': consequence_rating,
-                                'likelihood': likelihood_rating,
-                                'risk_score': risk_score,
-                                'risk_level': risk_level
-                            }
-                        save_asset_analysis_data()
-                        st.success(f"✅ Consequence category saved for {mode_id}")
-                        st.rerun()
+            # Create selection interface using radio buttons
+            consequence_options = ["None"] + [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_consequences]
+            selected_consequence = st.radio(
+                "Select a Failure Mode to View, Update or Delete its Consequence Category:",
+                consequence_options,
+                key="consequence_selection"
+            )
             
-            # Display table with selection for failure modes with consequence categories
-            modes_with_consequences = [m for m in st.session_state.failure_modes if 'consequence_category' in m]
+            # Display table of failure modes with consequences
+            consequences_df = get_cached_analysis_table(('consequences',), lambda: build_consequences_table(modes_with_consequences))
+            st.dataframe(consequences_df, use_container_width=True)
             
-            if modes_with_consequences:
+            # Show Update/Delete options if a consequence is selected
+            if selected_consequence != "None":
+                selected_mode_id = selected_consequence.split(":")[0]
+                selected_mode = next(m for m in modes_with_consequences if m['id'] == selected_mode_id)
+                mode_idx = next(i for i, m in enumerate(st.session_state.failure_modes) if m['id'] == selected_mode_id)
+                
+                # Display full consequence details
                 st.markdown("---")
-                st.subheader(f"View, Update or Delete Consequence Categories")
+                st.markdown(f"### Consequence Category for {selected_mode_id}")
                 
-                # Create selection interface using radio buttons
-                consequence_options = ["None"] + [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_consequences]
-                selected_consequence = st.radio(
-                    "Select a Failure Mode to View, Update or Delete its Consequence Category:",
-                    consequence_options,
-                    key="consequence_selection"
-                )
+                st.markdown(f"**Consequence Category:** {selected_mode.get('consequence_category', 'N/A')}")
                 
-                # Display table of failure modes with consequences
-                consequences_display = []
-                for m in modes_with_consequences:
-                    consequences_display.append({
-                        'Failure Mode ID': m['id'],
-                        'Component': m['component'],
-                        'Description': m['description'],
-                        'Consequence Category': m.get('consequence_category', 'N/A'),
-                        'Risk Level': m.get('risk_assessment', {}).get('risk_level', 'N/A') if 'risk_assessment' in m else 'N/A'
-                    })
-                consequences_df = pd.DataFrame(consequences_display)
-                st.dataframe(consequences_df, use_container_width=True)
+                if 'risk_assessment' in selected_mode:
+                    risk = selected_mode['risk_assessment']
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.markdown(f"**Consequence:** {risk.get('consequence', 'N/A')}")
+                    with col2:
+                        st.markdown(f"**Likelihood:** {risk.get('likelihood', 'N/A')}")
+                    with col3:
+                        st.markdown(f"**Risk Level:** {risk.get('risk_level', 'N/A')} (Score: {risk.get('risk_score', 0)})")
                 
-                # Show Update/Delete options if a consequence is selected
-                if selected_consequence != "None":
-                    selected_mode_id = selected_consequence.split(":")[0]
-                    selected_mode = next(m for m in modes_with_consequences if m['id'] == selected_mode_id)
-                    mode_idx = next(i for i, m in enumerate(st.session_state.failure_modes) if m['id'] == selected_mode_id)
-                    
-                    # Display full consequence details
+                # Update Section
+                if not st.session_state.get('editing_consequence', False):
+                    col_action1, col_action2 = st.columns(2)
+                    with col_action1:
+                        if st.button("✏️ Update Selected", use_container_width=True, key="update_consequence_btn"):
+                            st.session_state.editing_consequence = True
+                            rerun_stage_2_step()
+                    with col_action2:
+                        if st.button("🗑️ Delete Selected", use_container_width=True, key="delete_consequence_btn"):
+                            st.session_state.deleting_consequence = True
+                            rerun_stage_2_step()
+                
+                # Update Form
+                if st.session_state.get('editing_consequence', False):
                     st.markdown("---")
-                    st.markdown(f"### Consequence Category for {selected_mode_id}")
+                    st.markdown("### ✏️ Update Consequence Category")
                     
-                    st.markdown(f"**Consequence Category:** {selected_mode.get('consequence_category', 'N/A')}")
+                    # Get current values
+                    current_category = selected_mode.get('consequence_category', '')
                     
-                    if 'risk_assessment' in selected_mode:
-                        risk = selected_mode['risk_assessment']
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.markdown(f"**Consequence:** {risk.get('consequence', 'N/A')}")
-                        with col2:
-                            st.markdown(f"**Likelihood:** {risk.get('likelihood', 'N/A')}")
-                        with col3:
-                            st.markdown(f"**Risk Level:** {risk.get('risk_level', 'N/A')} (Score: {risk.get('risk_score', 0)})")
+                    # Determine if it's hidden or evident
+                    is_hidden = "Hidden" in current_category
                     
-                    # Update Section
-                    if not st.session_state.get('editing_consequence', False):
-                        col_action1, col_action2 = st.columns(2)
-                        with col_action1:
-                            if st.button("✏️ Update Selected", use_container_width=True, key="update_consequence_btn"):
-                                st.session_state.editing_consequence = True
-                                st.rerun()
-                        with col_action2:
-                            if st.button("🗑️ Delete Selected", use_container_width=True, key="delete_consequence_btn"):
-                                st.session_state.deleting_consequence = True
-                                st.rerun()
+                    # Question 1: Evident or Hidden?
+                    updated_is_evident = st.radio(
+                        "**Q1: Will the failure become evident to operators under normal circumstances?**",
+                        ["Yes - Evident", "No - Hidden (failure of protective device)"],
+                        index=0 if not is_hidden else 1,
+                        key="update_is_evident"
+                    )
                     
-                    # Update Form
-                    if st.session_state.get('editing_consequence', False):
-                        st.markdown("---")
-                        st.markdown("### ✏️ Update Consequence Category")
-                        
-                        # Get current values
-                        current_category = selected_mode.get('consequence_category', '')
+                    # Branch based on evident/hidden
+                    if "Hidden" in updated_is_evident:
+                        st.info("This is a **Hidden Failure** - typically protective devices that fail silently")
                         
-                        # Determine if it's hidden or evident
-                        is_hidden = "Hidden" in current_category
+                        # Determine current consequence type
+                        if "Safety" in current_category:
+                            current_idx = 0
+                        elif "Operational" in current_category:
+                            current_idx = 1
+                        else:
+                            current_idx = 2
                         
-                        # Question 1: Evident or Hidden?
-                        updated_is_evident = st.radio(
-                            "**Q1: Will the failure become evident to operators under normal circumstances?**",
-                            ["Yes - Evident", "No - Hidden (failure of protective device)"],
-                            index=0 if not is_hidden else 1,
-                            key="update_is_evident"
+                        updated_hidden_consequence = st.radio(
+                            "**Q2: If a multiple failure occurs (protected function fails while protective device is failed), what are the consequences?**",
+                            ["Safety or Environmental impact", "Operational impact", "Non-operational (just repair cost)"],
+                            index=current_idx,
+                            key="update_hidden_consequence"
                         )
                         
-                        # Branch based on evident/hidden
-                        if "Hidden" in updated_is_evident:
-                            st.info("This is a **Hidden Failure** - typically protective devices that fail silently")
-                            
-                            # Determine current consequence type
-                            if "Safety" in current_category:
-                                current_idx = 0
-                            elif "Operational" in current_category:
-                                current_idx = 1
-                            else:
-                                current_idx = 2
-                            
-                            updated_hidden_consequence = st.radio(
-                                "**Q2: If a multiple failure occurs (protected function fails while protective device is failed), what are the consequences?**",
-                                ["Safety or Environmental impact", "Operational impact", "Non-operational (just repair cost)"],
-                                index=current_idx,
-                                key="update_hidden_consequence"
-                            )
-                            
-                            if "Safety" in updated_hidden_consequence:
-                                updated_consequence_category = "Hidden (Safety/Environmental)"
-                            elif "Operational" in updated_hidden_consequence:
-                                updated_consequence_category = "Hidden (Operational)"
-                            else:
-                                updated_consequence_category = "Hidden (Non-operational)"
-                        
-                        else:  # Evident
-                            st.info("This is an **Evident Failure** - operators will know when it occurs")
-                            
-                            # Determine current consequence type
-                            if "Safety" in current_category:
-                                current_idx = 0
-                            elif "Operational" in current_category:
-                                current_idx = 1
-                            else:
-                                current_idx = 2
-                            
-                            updated_evident_consequence = st.radio(
-                                "**Q2: What are the consequences of this evident failure?**",
-                                ["Safety or Environmental impact", 
-                                 "Operational impact (affects output, quality, service, or operating costs)", 
-                                 "Non-operational (only direct repair cost)"],
-                                index=current_idx,
-                                key="update_evident_consequence"
-                            )
-                            
-                            if "Safety" in updated_evident_consequence:
-                                updated_consequence_category = "Evident (Safety/Environmental)"
-                            elif "Operational" in updated_evident_consequence:
-                                updated_consequence_category = "Evident (Operational)"
-                            else:
-                                updated_consequence_category = "Evident (Non-operational)"
-                        
-                        st.markdown(f"**Updated Consequence Category:** {updated_consequence_category}")
+                        if "Safety" in updated_hidden_consequence:
+                            updated_consequence_category = "Hidden (Safety/Environmental)"
+                        elif "Operational" in updated_hidden_consequence:
+                            updated_consequence_category = "Hidden (Operational)"
+                        else:
+                            updated_consequence_category = "Hidden (Non-operational)"
+                    
+                    else:  # Evident
+                        st.info("This is an **Evident Failure** - operators will know when it occurs")
                         
-                        # Risk assessment for safety consequences
-                        if "Safety" in updated_consequence_category or "Environmental" in updated_consequence_category:
-                            st.markdown("#### Risk Assessment")
-                            col1, col2, col3 = st.columns(3)
-                            
-                            # Get current risk values
-                            current_risk = selected_mode.get('risk_assessment', {})
-                            current_cons = current_risk.get('consequence', '3-Moderate')
-                            current_like = current_risk.get('likelihood', '3-Occasional')
-                            
-                            with col1:
-                                updated_consequence_rating = st.select_slider(
-                                    "Consequence Severity",
-                                    options=["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"],
-                                    value=current_cons,
-                                    key="update_consequence_rating"
-                                )
-                            
-                            with col2:
-                                updated_likelihood_rating = st.select_slider(
-                                    "Likelihood",
-                                    options=["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"],
-                                    value=current_like,
-                                    key="update_likelihood_rating"
-                                )
-                            
-                            with col3:
-                                # Calculate risk score
-                                cons_num = int(updated_consequence_rating[0])
-                                like_num = int(updated_likelihood_rating[0])
-                                risk_score = cons_num + like_num
-                                
-                                # Get risk level based on current thresholds
-                                risk_level, risk_color = get_risk_level(risk_score)
-                                
-                                st.markdown(f"""
-                                <div style="background-color: {risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
-                                <strong>Risk Level: {risk_level}</strong><br>
-                                Score: {risk_score}
-                                </div>
-                                """, unsafe_allow_html=True)
+                        # Determine current consequence type
+                        if "Safety" in current_category:
+                            current_idx = 0
+                        elif "Operational" in current_category:
+                            current_idx = 1
+                        else:
+                            current_idx = 2
                         
-                        col_update1, col_update2 = st.columns(2)
-                        with col_update1:
-                            if st.button("💾 Save Update", type="primary", use_container_width=True, key="save_consequence_update"):
-                                st.session_state.failure_modes[mode_idx]['consequence_category'] = updated_consequence_category
-                                if "Safety" in updated_consequence_category or "Environmental" in updated_consequence_category:
-                                    st.session_state.failure_modes[mode_idx]['risk_assessment'] = {
-                                        'consequence': updated_consequence_rating,
-                                        'likelihood': updated_likelihood_rating,
-                                        'risk_score': risk_score,
-                                        'risk_level': risk_level
-                                    }
-                                else:
-                                    # Remove risk assessment if not safety/environmental
-                                    if 'risk_assessment' in st.session_state.failure_modes[mode_idx]:
-                                        del st.session_state.failure_modes[mode_idx]['risk_assessment']
-                                st.session_state.editing_consequence = False
-                                save_asset_analysis_data()
-                                st.success(f"✅ Consequence category for {selected_mode_id} updated!")
-                                st.rerun()
-                        with col_update2:
-                            if st.button("❌ Cancel Update", use_container_width=True, key="cancel_consequence_update"):
-                                st.session_state.editing_consequence = False
-                                st.rerun()
-                    
-                    # Delete Confirmation
-                    if st.session_state.get('deleting_consequence', False):
-                        st.markdown("---")
-                        st.markdown("### 🗑️ Delete Consequence Category")
-                        st.warning(f"⚠️ Warning: This will delete the consequence category for {selected_mode_id}!")
+                        updated_evident_consequence = st.radio(
+                            "**Q2: What are the consequences of this evident failure?**",
+                            ["Safety or Environmental impact", 
+                             "Operational impact (affects output, quality, service, or operating costs)", 
+                             "Non-operational (only direct repair cost)"],
+                            index=current_idx,
+                            key="update_evident_consequence"
+                        )
                         
-                        col_del1, col_del2 = st.columns(2)
-                        with col_del1:
-                            if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True, key="confirm_consequence_delete"):
-                                # Delete the consequence category
-                                if 'consequence_category' in st.session_state.failure_modes[mode_idx]:
-                                    del st.session_state.failure_modes[mode_idx]['consequence_category']
-                                if 'risk_assessment' in st.session_state.failure_modes[mode_idx]:
-                                    del st.session_state.failure_modes[mode_idx]['risk_assessment']
-                                st.session_state.deleting_consequence = False
-                                save_asset_analysis_data()
-                                st.success(f"✅ Consequence category for {selected_mode_id} deleted!")
-                                st.rerun()
-                        with col_del2:
-                            if st.button("❌ Cancel Delete", use_container_width=True, key="cancel_consequence_delete"):
-                                st.session_state.deleting_consequence = False
-                                st.rerun()
-    
-    # Step 7: Task Selection
-    with analysis_tab[5]:
-        st.subheader("Step 7: Select Failure Management Tasks")
-        
-        st.markdown("**Objective:** Determine appropriate maintenance strategy for each failure mode based on its consequences.")
-        
-        # Filter modes with consequence categories
-        modes_with_consequences = [m for m in st.session_state.failure_modes if 'consequence_category' in m]
-        
-        if not modes_with_consequences:
-            st.warning("⚠️ Please categorize consequences first (Step 6)")
-        else:
-            selected_mode = st.selectbox(
-                "Select Failure Mode for Task Selection",
-                [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_consequences],
-                key="task_mode_select"
-            )
-            
-            mode_id = selected_mode.split(":")[0]
-            current_mode = next(m for m in st.session_state.failure_modes if m['id'] == mode_id)
-            
-            # Display context
-            col1, col2 = st.columns(2)
-            with col1:
-                st.markdown(f"**Consequence:** {current_mode.get('consequence_category', 'N/A')}")
-            with col2:
-                if 'risk_assessment' in current_mode:
-                    st.markdown(f"**Risk Level:** {current_mode['risk_assessment']['risk_level']}")
-            
-            st.markdown("---")
-            st.markdown("### Risk Assessment")
-            
-            # Display Risk Matrix
-            st.markdown("**Risk Matrix:** Consequence + Likelihood = Risk Score")
-            
-            # Generate and display dynamic risk matrix based on current thresholds
-            st.markdown(generate_risk_matrix_html(), unsafe_allow_html=True)
-            
-            st.markdown("---")
-            st.markdown("### Task Selection Decision")
-            
-            # Build task type options based on consequence category
-            consequence_cat = current_mode.get('consequence_category', '')
-            task_type_options = ["Select...", 
-                                 "CBM - Condition Based Maintenance", 
-                                 "FTM - Fixed Time Maintenance",
-                                 "Redesign"]
-            
-            # Only add FF if consequence is Hidden
-            if "Hidden" in consequence_cat:
-                task_type_options.insert(3, "FF - Failure Finding")
-            
-            # Only add OTF if consequence is NOT Safety/Environmental
-            if "Safety" not in consequence_cat and "Environmental" not in consequence_cat:
-                task_type_options.append("OTF - Operate to Failure")
-            
-            task_type = st.selectbox(
-                "Select Task Type",
-                task_type_options
-            )
-            
-            if task_type != "Select...":
-                st.markdown(f"#### {task_type}")
-                
-                # Initialize post-risk assessment variables
-                post_consequence_rating = None
-                post_likelihood_rating = None
-                post_risk_score = None
-                post_risk_level = None
-                
-                # Task-specific inputs
-                if "CBM" in task_type:
-                    st.info("**CBM Task:** Monitor condition to predict when failure might occur")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        potential_failure = st.text_input("Potential Failure Condition", 
-                                                         help="What condition indicates failure is starting?")
-                        pf_interval = st.number_input("P-F Interval (days/hours)", min_value=0.0,
-                                                     help="Time between potential failure detection and functional failure")
-                    with col2:
-                        inspection_method = st.text_area("Inspection Method",
-                                                        help="How will condition be monitored?")
-                        inspection_frequency = st.number_input("Inspection Frequency (days/hours)", min_value=0.0,
-                                                              help="Should be 1/2 to 1/3 of P-F interval")
-                    
-                    task_description = f"Monitor {inspection_method} every {inspection_frequency} days/hours. Action when {potential_failure}"
-                
-                elif "FTM" in task_type:
-                    st.info("**FTM Task:** Overhaul or replace at fixed intervals")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        task_action = st.text_input("Task Action", 
-                                                   help="e.g., Replace bearing, Lubricate, Clean filter")
-                        interval_value = st.number_input("Interval", min_value=0.0)
-                    with col2:
-                        interval_unit = st.selectbox("Interval Unit", 
-                                                    ["hours", "days", "weeks", "months", "years", "operating hours", "cycles"])
-                        useful_life = st.number_input("Useful Life", min_value=0.0)
-                        mtbf = st.number_input("MTBF", min_value=0.0,
-                                             help="Mean time between failures")
+                        if "Safety" in updated_evident_consequence:
+                            updated_consequence_category = "Evident (Safety/Environmental)"
+                        elif "Operational" in updated_evident_consequence:
+                            updated_consequence_category = "Evident (Operational)"
+                        else:
+                            updated_consequence_category = "Evident (Non-operational)"
                     
-                    task_description = f"{task_action} every {interval_value} {interval_unit}"
+                    st.markdown(f"**Updated Consequence Category:** {updated_consequence_category}")
                     
-                    # Add risk assessment slider for Safety/Environmental consequences
-                    consequence_cat = current_mode.get('consequence_category', '')
-                    if "Safety" in consequence_cat or "Environmental" in consequence_cat:
-                        st.markdown("---")
-                        st.markdown("#### Risk after task implementation")
+                    # Risk assessment for safety consequences
+                    if "Safety" in updated_consequence_category or "Environmental" in updated_consequence_category:
+                        st.markdown("#### Risk Assessment")
                         col1, col2, col3 = st.columns(3)
                         
+                        # Get current risk values
+                        current_risk = selected_mode.get('risk_assessment', {})
+                        current_cons = current_risk.get('consequence', '3-Moderate')
+                        current_like = current_risk.get('likelihood', '3-Occasional')
+                        
                         with col1:
-                            post_consequence_rating = st.select_slider(
+                            updated_consequence_rating = st.select_slider(
                                 "Consequence Severity",
                                 options=["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"],
-                                value="3-Moderate",
-                                key="ftm_post_consequence"
+                                value=current_cons,
+                                key="update_consequence_rating"
                             )
                         
                         with col2:
-                            post_likelihood_rating = st.select_slider(
+                            updated_likelihood_rating = st.select_slider(
                                 "Likelihood",
                                 options=["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"],
-                                value="3-Occasional",
-                                key="ftm_post_likelihood"
+                                value=current_like,
+                                key="update_likelihood_rating"
                             )
                         
                         with col3:
                             # Calculate risk score
-                            post_cons_num = int(post_consequence_rating[0])
-                            post_like_num = int(post_likelihood_rating[0])
-                            post_risk_score = post_cons_num + post_like_num
+                            cons_num = int(updated_consequence_rating[0])
+                            like_num = int(updated_likelihood_rating[0])
+                            risk_score = cons_num + like_num
                             
                             # Get risk level based on current thresholds
-                            post_risk_level, post_risk_color = get_risk_level(post_risk_score)
+                            risk_level, risk_color = get_risk_level(risk_score)
                             
                             st.markdown(f"""
-                            <div style="background-color: {post_risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
-                            <strong>Risk Level: {post_risk_level}</strong><br>
-                            Score: {post_risk_score}
+                            <div style="background-color: {risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
+                            <strong>Risk Level: {risk_level}</strong><br>
+                            Score: {risk_score}
                             </div>
                             """, unsafe_allow_html=True)
+                    
+                    col_update1, col_update2 = st.columns(2)
+                    with col_update1:
+                        if st.button("💾 Save Update", type="primary", use_container_width=True, key="save_consequence_update"):
+                            st.session_state.failure_modes[mode_idx]['consequence_category'] = updated_consequence_category
+                            if "Safety" in updated_consequence_category or "Environmental" in updated_consequence_category:
+                                st.session_state.failure_modes[mode_idx]['risk_assessment'] = {
+                                    'consequence': updated_consequence_rating,
+                                    'likelihood': updated_likelihood_rating,
+                                    'risk_score': risk_score,
+                                    'risk_level': risk_level
+                                }
+                            else:
+                                # Remove risk assessment if not safety/environmental
+                                if 'risk_assessment' in st.session_state.failure_modes[mode_idx]:
+                                    del st.session_state.failure_modes[mode_idx]['risk_assessment']
+                            st.session_state.editing_consequence = False
+                            save_asset_analysis_data()
+                            st.success(f"✅ Consequence category for {selected_mode_id} updated!")
+                            rerun_stage_2_step()
+                    with col_update2:
+                        if st.button("❌ Cancel Update", use_container_width=True, key="cancel_consequence_update"):
+                            st.session_state.editing_consequence = False
+                            rerun_stage_2_step()
                 
-                elif "FF" in task_type:
-                    st.info("**FF Task:** A more informal approach to setting the FFI for Consequences that are not severe")
+                # Delete Confirmation
+                if st.session_state.get('deleting_consequence', False):
+                    st.markdown("---")
+                    st.markdown("### 🗑️ Delete Consequence Category")
+                    st.warning(f"⚠️ Warning: This will delete the consequence category for {selected_mode_id}!")
                     
-                    st.markdown("""
-                    **This approach involves:**
-                    - Determining the Mean Time Between Failures (MTBF) of the Protective Device (Years)
-                    - Deciding on a required Availability for the Protective Device (ratio of time it is functional to the total time required (%))
-                    - Using a table to determine the FFI as a % of the MTBF of the Protective Device
-                    """)
+                    col_del1, col_del2 = st.columns(2)
+                    with col_del1:
+                        if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True, key="confirm_consequence_delete"):
+                            # Delete the consequence category
+                            if 'consequence_category' in st.session_state.failure_modes[mode_idx]:
+                                del st.session_state.failure_modes[mode_idx]['consequence_category']
+                            if 'risk_assessment' in st.session_state.failure_modes[mode_idx]:
+                                del st.session_state.failure_modes[mode_idx]['risk_assessment']
+                            st.session_state.deleting_consequence = False
+                            save_asset_analysis_data()
+                            st.success(f"✅ Consequence category for {selected_mode_id} deleted!")
+                            rerun_stage_2_step()
+                    with col_del2:
+                        if st.button("❌ Cancel Delete", use_container_width=True, key="cancel_consequence_delete"):
+                            st.session_state.deleting_consequence = False
+                            rerun_stage_2_step()
+
+@st.fragment
+def stage_2_step_task_selection():
+    """Step 7: Select failure management tasks"""
+    st.subheader("Step 7: Select Failure Management Tasks")
+    
+    st.markdown("**Objective:** Determine appropriate maintenance strategy for each failure mode based on its consequences.")
+    
+    # Filter modes with consequence categories
+    modes_with_consequences = [m for m in st.session_state.failure_modes if 'consequence_category' in m]
+    
+    if not modes_with_consequences:
+        st.warning("⚠️ Please categorize consequences first (Step 6)")
+    else:
+        selected_mode = st.selectbox(
+            "Select Failure Mode for Task Selection",
+            [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_consequences],
+            key="task_mode_select"
+        )
+        
+        mode_id = selected_mode.split(":")[0]
+        current_mode = next(m for m in st.session_state.failure_modes if m['id'] == mode_id)
+        
+        # Display context
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown(f"**Consequence:** {current_mode.get('consequence_category', 'N/A')}")
+        with col2:
+            if 'risk_assessment' in current_mode:
+                st.markdown(f"**Risk Level:** {current_mode['risk_assessment']['risk_level']}")
+        
+        st.markdown("---")
+        st.markdown("### Risk Assessment")
+        
+        # Display Risk Matrix
+        st.markdown("**Risk Matrix:** Consequence + Likelihood = Risk Score")
+        
+        # Generate and display dynamic risk matrix based on current thresholds
+        st.markdown(generate_risk_matrix_html(), unsafe_allow_html=True)
+        
+        st.markdown("---")
+        st.markdown("### Task Selection Decision")
+        
+        # Build task type options based on consequence category
+        consequence_cat = current_mode.get('consequence_category', '')
+        task_type_options = ["Select...", 
+                             "CBM - Condition Based Maintenance", 
+                             "FTM - Fixed Time Maintenance",
+                             "Redesign"]
+        
+        # Only add FF if consequence is Hidden
+        if "Hidden" in consequence_cat:
+            task_type_options.insert(3, "FF - Failure Finding")
+        
+        # Only add OTF if consequence is NOT Safety/Environmental
+        if "Safety" not in consequence_cat and "Environmental" not in consequence_cat:
+            task_type_options.append("OTF - Operate to Failure")
+        
+        task_type = st.selectbox(
+            "Select Task Type",
+            task_type_options,
+            key="task_type_input"
+        )
+        
+        if task_type != "Select...":
+            st.markdown(f"#### {task_type}")
+            
+            # Structured interval of recurring tasks, used by the maintenance calendar
+            task_interval = None
+            
+            # Initialize post-risk assessment variables
+            post_consequence_rating = None
+            post_likelihood_rating = None
+            post_risk_score = None
+            post_risk_level = None
+            
+            # Task-specific inputs
+            if "CBM" in task_type:
+                st.info("**CBM Task:** Monitor condition to predict when failure might occur")
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    potential_failure = st.text_input("Potential Failure Condition", 
+                                                     help="What condition indicates failure is starting?",
+                                                     key="cbm_potential_failure_input")
+                    pf_interval = st.number_input("P-F Interval (days/hours)", min_value=0.0,
+                                                 help="Time between potential failure detection and functional failure",
+                                                 key="cbm_pf_interval_input")
+                with col2:
+                    inspection_method = st.text_area("Inspection Method",
+                                                    help="How will condition be monitored?",
+                                                    key="cbm_inspection_method_input")
+                    inspection_frequency = st.number_input("Inspection Frequency", min_value=0.0,
+                                                          help="Should be 1/2 to 1/3 of P-F interval",
+                                                          key="cbm_inspection_frequency_input")
+                    inspection_unit = st.selectbox("Inspection Frequency Unit",
+                                                   ["hours", "days", "weeks", "months", "years", "operating hours"],
+                                                   index=1, key="cbm_inspection_unit_input")
+                
+                task_description = f"Monitor {inspection_method} every {inspection_frequency} {inspection_unit}. Action when {potential_failure}"
+                task_interval = {'value': inspection_frequency, 'unit': inspection_unit}
+            
+            elif "FTM" in task_type:
+                st.info("**FTM Task:** Overhaul or replace at fixed intervals")
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    task_action = st.text_input("Task Action", 
+                                               help="e.g., Replace bearing, Lubricate, Clean filter",
+                                               key="ftm_task_action_input")
+                    interval_value = st.number_input("Interval", min_value=0.0, key="ftm_interval_value_input")
+                with col2:
+                    interval_unit = st.selectbox("Interval Unit", 
+                                                ["hours", "days", "weeks", "months", "years", "operating hours", "cycles"],
+                                                key="ftm_interval_unit_input")
+                    useful_life = st.number_input("Useful Life", min_value=0.0, key="ftm_useful_life_input")
+                    mtbf = st.number_input("MTBF", min_value=0.0,
+                                         help="Mean time between failures",
+                                         key="ftm_mtbf_input")
+                
+                task_description = f"{task_action} every {interval_value} {interval_unit}"
+                task_interval = {'value': interval_value, 'unit': interval_unit}
+                
+                # Add risk assessment slider for Safety/Environmental consequences
+                consequence_cat = current_mode.get('consequence_category', '')
+                if "Safety" in consequence_cat or "Environmental" in consequence_cat:
+                    st.markdown("---")
+                    st.markdown("#### Risk after task implementation")
+                    col1, col2, col3 = st.columns(3)
                     
-                    col1, col2 = st.columns(2)
                     with col1:
-                        test_method = st.text_area("Test Method",
-                                                  help="How to check if protective device is functional")
-                        mtbf_protective = st.number_input("MTBF of Protective Device (years)", min_value=0.0,
-                                                         help="Mean Time Between Failures of the protective device in years")
+                        post_consequence_rating = st.select_slider(
+                            "Consequence Severity",
+                            options=["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"],
+                            key="ftm_post_consequence"
+                        )
+                    
                     with col2:
-                        # Availability lookup table
-                        availability_options = {
-                            "99.99%": 0.0002,  # 0.02% FFI
-                            "99.95%": 0.001,   # 0.1% FFI
-                            "99.9%": 0.002,    # 0.2% FFI
-                            "99.5%": 0.01,     # 1% FFI
-                            "99%": 0.02,       # 2% FFI
-                            "98%": 0.04,       # 4% FFI
-                            "95%": 0.10        # 10% FFI
-                        }
-                        
-                        availability_required = st.selectbox(
-                            "Required Availability for Protective Device",
-                            options=list(availability_options.keys()),
-                            help="Ratio of time the protective device is functional to total time required"
+                        post_likelihood_rating = st.select_slider(
+                            "Likelihood",
+                            options=["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"],
+                            key="ftm_post_likelihood"
                         )
+                    
+                    with col3:
+                        # Calculate risk score
+                        post_cons_num = int(post_consequence_rating[0])
+                        post_like_num = int(post_likelihood_rating[0])
+                        post_risk_score = post_cons_num + post_like_num
                         
-                        # Calculate FFI based on availability
-                        ffi_percentage = availability_options[availability_required]
-                        
-                        # Display the FFI percentage from table
-                        st.info(f"**FFI (as % of MTBF):** {ffi_percentage * 100}%")
+                        # Get risk level based on current thresholds
+                        post_risk_level, post_risk_color = get_risk_level(post_risk_score)
                         
-                        # Calculate FFI in days
-                        if mtbf_protective > 0:
-                            mtbf_days = mtbf_protective * 365.25  # Convert years to days
-                            ff_interval = mtbf_days * ffi_percentage
-                            st.success(f"**Calculated FFI:** {ff_interval:.1f} days")
-                        else:
-                            ff_interval = 0.0
-                            st.warning("Enter MTBF to calculate Failure Finding Interval")
+                        st.markdown(f"""
+                        <div style="background-color: {post_risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
+                        <strong>Risk Level: {post_risk_level}</strong><br>
+                        Score: {post_risk_score}
+                        </div>
+                        """, unsafe_allow_html=True)
+            
+            elif "FF" in task_type:
+                st.info("**FF Task:** A more informal approach to setting the FFI for Consequences that are not severe")
+                
+                st.markdown("""
+                **This approach involves:**
+                - Determining the Mean Time Between Failures (MTBF) of the Protective Device (Years)
+                - Deciding on a required Availability for the Protective Device (ratio of time it is functional to the total time required (%))
+                - Using a table to determine the FFI as a % of the MTBF of the Protective Device
+                """)
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    test_method = st.text_area("Test Method",
+                                              help="How to check if protective device is functional",
+                                              key="ff_test_method_input")
+                    mtbf_protective = st.number_input("MTBF of Protective Device (years)", min_value=0.0,
+                                                     help="Mean Time Between Failures of the protective device in years",
+                                                     key="ff_mtbf_protective_input")
+                with col2:
+                    # Availability lookup table
+                    availability_options = {
+                        "99.99%": 0.0002,  # 0.02% FFI
+                        "99.95%": 0.001,   # 0.1% FFI
+                        "99.9%": 0.002,    # 0.2% FFI
+                        "99.5%": 0.01,     # 1% FFI
+                        "99%": 0.02,       # 2% FFI
+                        "98%": 0.04,       # 4% FFI
+                        "95%": 0.10        # 10% FFI
+                    }
+                    
+                    availability_required = st.selectbox(
+                        "Required Availability for Protective Device",
+                        options=list(availability_options.keys()),
+                        help="Ratio of time the protective device is functional to total time required",
+                        key="ff_availability_input"
+                    )
                     
-                    task_description = f"Test {test_method} every {ff_interval:.1f} days (based on {availability_required} availability)"
+                    # Calculate FFI based on availability
+                    ffi_percentage = availability_options[availability_required]
+                    
+                    # Display the FFI percentage from table
+                    st.info(f"**FFI (as % of MTBF):** {ffi_percentage * 100}%")
+                    
+                    # Calculate FFI in days
+                    if mtbf_protective > 0:
+                        mtbf_days = mtbf_protective * 365.25  # Convert years to days
+                        ff_interval = mtbf_days * ffi_percentage
+                        st.success(f"**Calculated FFI:** {ff_interval:.1f} days")
+                    else:
+                        ff_interval = 0.0
+                        st.warning("Enter MTBF to calculate Failure Finding Interval")
                 
-                elif "Redesign" in task_type:
-                    st.info("**Redesign:** One-off change to equipment, process, or procedure")
+                task_description = f"Test {test_method} every {ff_interval:.1f} days (based on {availability_required} availability)"
+                task_interval = {'value': round(ff_interval, 1), 'unit': 'days'}
+            
+            elif "Redesign" in task_type:
+                st.info("**Redesign:** One-off change to equipment, process, or procedure")
+                
+                redesign_type = st.radio("Redesign Type",
+                                       ["Equipment modification", "Process change", "Procedure update", "Training"],
+                                       key="redesign_type_input")
+                task_description = st.text_area("Describe the Redesign",
+                                               help="What specific change will be made?",
+                                               key="redesign_description_input")
+                
+                # Add risk assessment slider for Safety/Environmental consequences
+                consequence_cat = current_mode.get('consequence_category', '')
+                if "Safety" in consequence_cat or "Environmental" in consequence_cat:
+                    st.markdown("---")
+                    st.markdown("#### Risk after task implementation")
+                    col1, col2, col3 = st.columns(3)
                     
-                    redesign_type = st.radio("Redesign Type",
-                                           ["Equipment modification", "Process change", "Procedure update", "Training"])
-                    task_description = st.text_area("Describe the Redesign",
-                                                   help="What specific change will be made?")
+                    with col1:
+                        post_consequence_rating = st.select_slider(
+                            "Consequence Severity",
+                            options=["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"],
+                            key="redesign_post_consequence"
+                        )
                     
-                    # Add risk assessment slider for Safety/Environmental consequences
-                    consequence_cat = current_mode.get('consequence_category', '')
-                    if "Safety" in consequence_cat or "Environmental" in consequence_cat:
-                        st.markdown("---")
-                        st.markdown("#### Risk after task implementation")
-                        col1, col2, col3 = st.columns(3)
-                        
-                        with col1:
-                            post_consequence_rating = st.select_slider(
-                                "Consequence Severity",
-                                options=["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"],
-                                value="3-Moderate",
-                                key="redesign_post_consequence"
-                            )
+                    with col2:
+                        post_likelihood_rating = st.select_slider(
+                            "Likelihood",
+                            options=["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"],
+                            key="redesign_post_likelihood"
+                        )
+                    
+                    with col3:
+                        # Calculate risk score
+                        post_cons_num = int(post_consequence_rating[0])
+                        post_like_num = int(post_likelihood_rating[0])
+                        post_risk_score = post_cons_num + post_like_num
                         
-                        with col2:
-                            post_likelihood_rating = st.select_slider(
-                                "Likelihood",
-                                options=["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"],
-                                value="3-Occasional",
-                                key="redesign_post_likelihood"
-                            )
+                        # Get risk level based on current thresholds
+                        post_risk_level, post_risk_color = get_risk_level(post_risk_score)
                         
-                        with col3:
-                            # Calculate risk score
-                            post_cons_num = int(post_consequence_rating[0])
-                            post_like_num = int(post_likelihood_rating[0])
-                            post_risk_score = post_cons_num + post_like_num
-                            
-                            # Get risk level based on current thresholds
-                            post_risk_level, post_risk_color = get_risk_level(post_risk_score)
-                            
-                            st.markdown(f"""
-                            <div style="background-color: {post_risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
-                            <strong>Risk Level: {post_risk_level}</strong><br>
-                            Score: {post_risk_score}
-                            </div>
-                            """, unsafe_allow_html=True)
+                        st.markdown(f"""
+                        <div style="background-color: {post_risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
+                        <strong>Risk Level: {post_risk_level}</strong><br>
+                        Score: {post_risk_score}
+                        </div>
+                        """, unsafe_allow_html=True)
+            
+            else:  # OTF
+                st.info("**Operate to Failure:** Conscious decision to let failure occur and repair when it does")
                 
-                else:  # OTF
-                    st.info("**Operate to Failure:** Conscious decision to let failure occur and repair when it does")
-                    
-                    st.markdown("**Justification for OTF:**")
-                    otf_reason = st.radio("Reason for OTF",
-                                        ["No effective proactive task available",
-                                         "Cost of proactive maintenance exceeds cost of failure",
-                                         "Low consequence failure"])
-                    task_description = f"Operate to failure. Reason: {otf_reason}"
+                st.markdown("**Justification for OTF:**")
+                otf_reason = st.radio("Reason for OTF",
+                                    ["No effective proactive task available",
+                                     "Cost of proactive maintenance exceeds cost of failure",
+                                     "Low consequence failure"],
+                                    key="otf_reason_input")
+                task_description = f"Operate to failure. Reason: {otf_reason}"
+            
+            # Technical feasibility and worth doing assessment
+            st.markdown("---")
+            st.markdown("### Task Validation")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                technically_feasible = st.radio("Technically Feasible?", ["Yes", "No"],
+                                               help="Can this task actually be performed?",
+                                               key="technically_feasible_input")
+            with col2:
+                worth_doing = st.radio("Worth Doing?", ["Yes", "No"],
+                                     help="Does it effectively address the consequences?",
+                                     key="worth_doing_input")
+            
+            justification = st.text_area("Justification",
+                                       help="Explain why this task is feasible and worth doing",
+                                       key="justification_input")
+            
+            # Check if consequence is operational or non-operational AND task is not OTF
+            consequence_cat = current_mode.get('consequence_category', '')
+            show_cost_fields = ('Operational' in consequence_cat or 'Non-operational' in consequence_cat) and 'OTF' not in task_type
+            
+            # Initialize cost variables
+            labour_cost = 0.0
+            parts_cost = 0.0
+            other_cost = 0.0
+            failure_labour_cost = 0.0
+            failure_parts_cost = 0.0
+            failure_other_cost = 0.0
+            total_cost = 0.0
+            total_failure_cost = 0.0
+            
+            if show_cost_fields:
+                # Cost of Task
+                st.markdown("### Cost of Task")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    labour_cost = st.number_input("Labour Cost ($)", min_value=0.0, key="task_labour")
+                with col2:
+                    parts_cost = st.number_input("Parts Cost ($)", min_value=0.0, key="task_parts")
+                with col3:
+                    other_cost = st.number_input("Other Cost ($)", min_value=0.0, key="task_other")
                 
-                # Technical feasibility and worth doing assessment
-                st.markdown("---")
-                st.markdown("### Task Validation")
+                total_cost = labour_cost + parts_cost + other_cost
+                st.markdown(f"**Total Task Cost:** ${total_cost:,.2f}")
                 
-                col1, col2 = st.columns(2)
+                # Cost of Failure
+                st.markdown("### Cost of Failure")
+                col1, col2, col3 = st.columns(3)
                 with col1:
-                    technically_feasible = st.radio("Technically Feasible?", ["Yes", "No"],
-                                                   help="Can this task actually be performed?")
+                    failure_labour_cost = st.number_input("Labour Cost ($)", min_value=0.0, key="failure_labour")
                 with col2:
-                    worth_doing = st.radio("Worth Doing?", ["Yes", "No"],
-                                         help="Does it effectively address the consequences?")
+                    failure_parts_cost = st.number_input("Parts Cost ($)", min_value=0.0, key="failure_parts")
+                with col3:
+                    failure_other_cost = st.number_input("Other Cost ($)", min_value=0.0, key="failure_other")
                 
-                justification = st.text_area("Justification",
-                                           help="Explain why this task is feasible and worth doing")
+                total_failure_cost = failure_labour_cost + failure_parts_cost + failure_other_cost
+                st.markdown(f"**Total Failure Cost:** ${total_failure_cost:,.2f}")
+            
+            crew_hours = 0.0
+            if 'OTF' not in task_type:
+                crew_hours = st.number_input("Annual Crew Hours", min_value=0.0, key="task_crew_hours",
+                                             help="Labour hours per year to carry out the task, used by budget optimization")
+            
+            if st.button("💾 Save Failure Management Task"):
+                if technically_feasible == "Yes" and worth_doing == "Yes":
+                    task = {
+                        'task_type': task_type,
+                        'description': task_description,
+                        'technically_feasible': technically_feasible,
+                        'worth_doing': worth_doing,
+                        'justification': justification,
+                        'cost': total_cost,
+                        'failure_cost': total_failure_cost,
+                        'crew_hours': crew_hours
+                    }
+                    if task_interval and task_interval['value']:
+                        task['interval'] = task_interval
+                    
+                    # Add post-implementation risk assessment for FTM and Redesign Safety/Environmental tasks
+                    if ("FTM" in task_type or "Redesign" in task_type) and ("Safety" in current_mode.get('consequence_category', '') or "Environmental" in current_mode.get('consequence_category', '')):
+                        task['post_risk_assessment'] = {
+                            'consequence': post_consequence_rating,
+                            'likelihood': post_likelihood_rating,
+                            'risk_score': post_risk_score,
+                            'risk_level': post_risk_level
+                        }
+                    
+                    # Add to failure mode
+                    for mode in st.session_state.failure_modes:
+                        if mode['id'] == mode_id:
+                            mode['management_task'] = task
+                            # The analysis results row is derived from the task when the asset is saved
+                            save_asset_analysis_data()
+                            st.success(f"✅ Task saved for {mode_id}")
+                            rerun_stage_2_step()
+                else:
+                    st.error("Task must be both technically feasible and worth doing!")
+        
+        # Display table with selection for failure modes with tasks
+        modes_with_tasks = [m for m in st.session_state.failure_modes if 'management_task' in m]
+        
+        if modes_with_tasks:
+            st.markdown("---")
+            st.subheader(f"View, Update or Delete Tasks")
+            
+            # Create selection interface using radio buttons
+            task_options = ["None"] + [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_tasks]
+            selected_task = st.radio(
+                "Select a Failure Mode to View, Update or Delete its Task:",
+                task_options,
+                key="task_selection"
+            )
+            
+            # Display table of failure modes with tasks
+            tasks_df = get_cached_analysis_table(('tasks',), lambda: build_tasks_table(modes_with_tasks))
+            st.dataframe(tasks_df, use_container_width=False, height=400)
+            
+            # Show Update/Delete options if a task is selected
+            if selected_task != "None":
+                selected_task_mode_id = selected_task.split(":")[0]
+                selected_task_mode = next(m for m in modes_with_tasks if m['id'] == selected_task_mode_id)
+                task_mode_idx = next(i for i, m in enumerate(st.session_state.failure_modes) if m['id'] == selected_task_mode_id)
                 
-                # Check if consequence is operational or non-operational AND task is not OTF
-                consequence_cat = current_mode.get('consequence_category', '')
-                show_cost_fields = ('Operational' in consequence_cat or 'Non-operational' in consequence_cat) and 'OTF' not in task_type
+                # Display full task details
+                st.markdown("---")
+                st.markdown(f"### Task for {selected_task_mode_id}")
                 
-                # Initialize cost variables
-                labour_cost = 0.0
-                parts_cost = 0.0
-                other_cost = 0.0
-                failure_labour_cost = 0.0
-                failure_parts_cost = 0.0
-                failure_other_cost = 0.0
-                total_cost = 0.0
-                total_failure_cost = 0.0
+                task = selected_task_mode.get('management_task', {})
+                st.markdown(f"**Task Type:** {task.get('task_type', 'N/A')}")
+                st.markdown(f"**Description:** {task.get('description', 'N/A')}")
+                st.markdown(f"**Technically Feasible:** {task.get('technically_feasible', 'N/A')}")
+                st.markdown(f"**Worth Doing:** {task.get('worth_doing', 'N/A')}")
+                st.markdown(f"**Justification:** {task.get('justification', 'N/A')}")
+                st.markdown(f"**Cost:** ${task.get('cost', 0):,.2f}")
+                st.markdown(f"**Failure Cost:** ${task.get('failure_cost', 0):,.2f}")
+                st.markdown(f"**Annual Crew Hours:** {task.get('crew_hours', 0):,.1f}")
                 
-                if show_cost_fields:
-                    # Cost of Task
-                    st.markdown("### Cost of Task")
+                if 'post_risk_assessment' in task:
+                    st.markdown("**Post-Implementation Risk Assessment:**")
+                    post_risk = task['post_risk_assessment']
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        labour_cost = st.number_input("Labour Cost ($)", min_value=0.0, key="task_labour")
+                        st.markdown(f"**Consequence:** {post_risk.get('consequence', 'N/A')}")
                     with col2:
-                        parts_cost = st.number_input("Parts Cost ($)", min_value=0.0, key="task_parts")
+                        st.markdown(f"**Likelihood:** {post_risk.get('likelihood', 'N/A')}")
                     with col3:
-                        other_cost = st.number_input("Other Cost ($)", min_value=0.0, key="task_other")
-                    
-                    total_cost = labour_cost + parts_cost + other_cost
-                    st.markdown(f"**Total Task Cost:** ${total_cost:,.2f}")
-                    
-                    # Cost of Failure
-                    st.markdown("### Cost of Failure")
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        failure_labour_cost = st.number_input("Labour Cost ($)", min_value=0.0, key="failure_labour")
-                    with col2:
-                        failure_parts_cost = st.number_input("Parts Cost ($)", min_value=0.0, key="failure_parts")
-                    with col3:
-                        failure_other_cost = st.number_input("Other Cost ($)", min_value=0.0, key="failure_other")
-                    
-                    total_failure_cost = failure_labour_cost + failure_parts_cost + failure_other_cost
-                    st.markdown(f"**Total Failure Cost:** ${total_failure_cost:,.2f}")
-                
-                if st.button("💾 Save Failure Management Task"):
-                    if technically_feasible == "Yes" and worth_doing == "Yes":
-                        task = {
-                            'task_type': task_type,
-                            'description': task_description,
-                            'technically_feasible': technically_feasible,
-                            'worth_doing': worth_doing,
-                            'justification': justification,
-                            'cost': total_cost,
-                            'failure_cost': total_failure_cost
-                        }
-                        
-                        # Add post-implementation risk assessment for FTM and Redesign Safety/Environmental tasks
-                        if ("FTM" in task_type or "Redesign" in task_type) and ("Safety" in current_mode.get('consequence_category', '') or "Environmental" in current_mode.get('consequence_category', '')):
-                            task['post_risk_assessment'] = {
-                                'consequence': post_consequence_rating,
-                                'likelihood': post_likelihood_rating,
-                                'risk_score': post_risk_score,
-                                'risk_level': post_risk_level
-                            }
-                        
-                        # Add to failure mode
-                        for mode in st.session_state.failure_modes:
-                            if mode['id'] == mode_id:
-                                mode['management_task'] = task
-                                
-                                # Also add to analysis results
-                                result = {
-                                    'failure_mode_id': mode_id,
-                                    'component': mode['component'],
-                                    'failure_mode': mode['description'],
-                                    'consequence': mode.get('consequence_category', 'N/A'),
-                                    'task_type': task_type,
-                                    'task_description': task_description,
-                                    'frequency': task_description,
-                                    'cost': total_cost
-                                }
-                                st.session_state.analysis_results.append(result)
-                                save_asset_analysis_data()
-                                st.success(f"✅ Task saved for {mode_id}")
-                                st.rerun()
-                    else:
-                        st.error("Task must be both technically feasible and worth doing!")
-            
-            # Display table with selection for failure modes with tasks
-            modes_with_tasks = [m for m in st.session_state.failure_modes if 'management_task' in m]
-            
-            if modes_with_tasks:
-                st.markdown("---")
-                st.subheader(f"View, Update or Delete Tasks")
+                        st.markdown(f"**Risk Level:** {post_risk.get('risk_level', 'N/A')} (Score: {post_risk.get('risk_score', 0)})")
                 
-                # Create selection interface using radio buttons
-                task_options = ["None"] + [f"{m['id']}: {m['component']} - {m['description']}" for m in modes_with_tasks]
-                selected_task = st.radio(
-                    "Select a Failure Mode to View, Update or Delete its Task:",
-                    task_options,
-                    key="task_selection"
-                )
+                # Update Section
+                if not st.session_state.get('editing_task', False):
+                    col_action1, col_action2 = st.columns(2)
+                    with col_action1:
+                        if st.button("✏️ Update Selected", use_container_width=True, key="update_task_btn"):
+                            st.session_state.editing_task = True
+                            rerun_stage_2_step()
+                    with col_action2:
+                        if st.button("🗑️ Delete Selected", use_container_width=True, key="delete_task_btn"):
+                            st.session_state.deleting_task = True
+                            rerun_stage_2_step()
                 
-                # Display table of failure modes with tasks
-                tasks_display = []
-                for m in modes_with_tasks:
-                    task = m.get('management_task', {})
-                    post_risk = task.get('post_risk_assessment', {})
+                # Update Form
+                if st.session_state.get('editing_task', False):
+                    st.markdown("---")
+                    st.markdown("### ✏️ Update Task")
                     
-                    task_data = {
-                        'Failure Mode ID': m['id'],
-                        'Component': m['component'],
-                        'Description': m['description'],
-                        'Consequence': m.get('consequence_category', 'N/A'),
-                        'Task Type': task.get('task_type', 'N/A'),
-                        'Task Description': task.get('description', 'N/A'),
-                        'Technically Feasible': task.get('technically_feasible', 'N/A'),
-                        'Worth Doing': task.get('worth_doing', 'N/A'),
-                        'Justification': task.get('justification', 'N/A'),
-                        'Task Cost': f"${task.get('cost', 0):,.2f}",
-                        'Failure Cost': f"${task.get('failure_cost', 0):,.2f}"
-                    }
+                    # Get current task values
+                    current_task = selected_task_mode.get('management_task', {})
+                    current_task_type = current_task.get('task_type', 'Select...')
                     
-                    # Add post-risk assessment data if available
-                    if post_risk:
-                        task_data['Post-Risk Consequence'] = post_risk.get('consequence', 'N/A')
-                        task_data['Post-Risk Likelihood'] = post_risk.get('likelihood', 'N/A')
-                        task_data['Post-Risk Level'] = post_risk.get('risk_level', 'N/A')
-                        task_data['Post-Risk Score'] = post_risk.get('risk_score', 'N/A')
-                    else:
-                        task_data['Post-Risk Consequence'] = 'N/A'
-                        task_data['Post-Risk Likelihood'] = 'N/A'
-                        task_data['Post-Risk Level'] = 'N/A'
-                        task_data['Post-Risk Score'] = 'N/A'
+                    # Build task type options based on consequence category
+                    consequence_cat = selected_task_mode.get('consequence_category', '')
+                    update_task_type_options = ["Select...", 
+                                                "CBM - Condition Based Maintenance", 
+                                                "FTM - Fixed Time Maintenance",
+                                                "Redesign"]
                     
-                    tasks_display.append(task_data)
-                
-                tasks_df = pd.DataFrame(tasks_display)
-                st.dataframe(tasks_df, use_container_width=False, height=400)
-                
-                # Show Update/Delete options if a task is selected
-                if selected_task != "None":
-                    selected_task_mode_id = selected_task.split(":")[0]
-                    selected_task_mode = next(m for m in modes_with_tasks if m['id'] == selected_task_mode_id)
-                    task_mode_idx = next(i for i, m in enumerate(st.session_state.failure_modes) if m['id'] == selected_task_mode_id)
+                    # Only add FF if consequence is Hidden
+                    if "Hidden" in consequence_cat:
+                        update_task_type_options.insert(3, "FF - Failure Finding")
                     
-                    # Display full task details
-                    st.markdown("---")
-                    st.markdown(f"### Task for {selected_task_mode_id}")
+                    # Only add OTF if consequence is NOT Safety/Environmental
+                    if "Safety" not in consequence_cat and "Environmental" not in consequence_cat:
+                        update_task_type_options.append("OTF - Operate to Failure")
                     
-                    task = selected_task_mode.get('management_task', {})
-                    st.markdown(f"**Task Type:** {task.get('task_type', 'N/A')}")
-                    st.markdown(f"**Description:** {task.get('description', 'N/A')}")
-                    st.markdown(f"**Technically Feasible:** {task.get('technically_feasible', 'N/A')}")
-                    st.markdown(f"**Worth Doing:** {task.get('worth_doing', 'N/A')}")
-                    st.markdown(f"**Justification:** {task.get('justification', 'N/A')}")
-                    st.markdown(f"**Cost:** ${task.get('cost', 0):,.2f}")
-                    st.markdown(f"**Failure Cost:** ${task.get('failure_cost', 0):,.2f}")
+                    # Calculate index for current task type
+                    if current_task_type in update_task_type_options:
+                        current_index = update_task_type_options.index(current_task_type)
+                    else:
+                        current_index = 0
                     
-                    if 'post_risk_assessment' in task:
-                        st.markdown("**Post-Implementation Risk Assessment:**")
-                        post_risk = task['post_risk_assessment']
-                        col1, col2, col3 = st.columns(3)
+                    # Task type selection
+                    updated_task_type = st.selectbox(
+                        "Select Task Type",
+                        update_task_type_options,
+                        index=current_index,
+                        key="update_task_type"
+                    )
+                    
+                    if updated_task_type != "Select...":
+                        updated_task_description = st.text_area(
+                            "Task Description",
+                            value=current_task.get('description', ''),
+                            key="update_task_description"
+                        )
+                        
+                        col1, col2 = st.columns(2)
                         with col1:
-                            st.markdown(f"**Consequence:** {post_risk.get('consequence', 'N/A')}")
+                            updated_technically_feasible = st.radio(
+                                "Technically Feasible?",
+                                ["Yes", "No"],
+                                index=0 if current_task.get('technically_feasible') == "Yes" else 1,
+                                key="update_technically_feasible"
+                            )
                         with col2:
-                            st.markdown(f"**Likelihood:** {post_risk.get('likelihood', 'N/A')}")
-                        with col3:
-                            st.markdown(f"**Risk Level:** {post_risk.get('risk_level', 'N/A')} (Score: {post_risk.get('risk_score', 0)})")
-                    
-                    # Update Section
-                    if not st.session_state.get('editing_task', False):
-                        col_action1, col_action2 = st.columns(2)
-                        with col_action1:
-                            if st.button("✏️ Update Selected", use_container_width=True, key="update_task_btn"):
-                                st.session_state.editing_task = True
-                                st.rerun()
-                        with col_action2:
-                            if st.button("🗑️ Delete Selected", use_container_width=True, key="delete_task_btn"):
-                                st.session_state.deleting_task = True
-                                st.rerun()
-                    
-                    # Update Form
-                    if st.session_state.get('editing_task', False):
-                        st.markdown("---")
-                        st.markdown("### ✏️ Update Task")
+                            updated_worth_doing = st.radio(
+                                "Worth Doing?",
+                                ["Yes", "No"],
+                                index=0 if current_task.get('worth_doing') == "Yes" else 1,
+                                key="update_worth_doing"
+                            )
                         
-                        # Get current task values
-                        current_task = selected_task_mode.get('management_task', {})
-                        current_task_type = current_task.get('task_type', 'Select...')
+                        updated_justification = st.text_area(
+                            "Justification",
+                            value=current_task.get('justification', ''),
+                            key="update_justification"
+                        )
                         
-                        # Build task type options based on consequence category
+                        # Check if consequence is operational or non-operational AND task is not OTF
                         consequence_cat = selected_task_mode.get('consequence_category', '')
-                        update_task_type_options = ["Select...", 
-                                                    "CBM - Condition Based Maintenance", 
-                                                    "FTM - Fixed Time Maintenance",
-                                                    "Redesign"]
+                        show_cost_fields = ('Operational' in consequence_cat or 'Non-operational' in consequence_cat) and 'OTF' not in updated_task_type
                         
-                        # Only add FF if consequence is Hidden
-                        if "Hidden" in consequence_cat:
-                            update_task_type_options.insert(3, "FF - Failure Finding")
+                        # Initialize cost variables
+                        updated_labour_cost = 0.0
+                        updated_parts_cost = 0.0
+                        updated_other_cost = 0.0
+                        updated_failure_labour_cost = 0.0
+                        updated_failure_parts_cost = 0.0
+                        updated_failure_other_cost = 0.0
+                        updated_total_cost = 0.0
+                        updated_total_failure_cost = 0.0
                         
-                        # Only add OTF if consequence is NOT Safety/Environmental
-                        if "Safety" not in consequence_cat and "Environmental" not in consequence_cat:
-                            update_task_type_options.append("OTF - Operate to Failure")
+                        if show_cost_fields:
+                            st.markdown("### Cost of Task")
+                            col1, col2, col3 = st.columns(3)
+                            with col1:
+                                updated_labour_cost = st.number_input("Labour Cost ($)", min_value=0.0, value=float(current_task.get('cost', 0)), key="update_task_labour")
+                            with col2:
+                                updated_parts_cost = st.number_input("Parts Cost ($)", min_value=0.0, key="update_task_parts")
+                            with col3:
+                                updated_other_cost = st.number_input("Other Cost ($)", min_value=0.0, key="update_task_other")
+                            
+                            updated_total_cost = updated_labour_cost + updated_parts_cost + updated_other_cost
+                            st.markdown(f"**Total Task Cost:** ${updated_total_cost:,.2f}")
+                            
+                            st.markdown("### Cost of Failure")
+                            col1, col2, col3 = st.columns(3)
+                            with col1:
+                                updated_failure_labour_cost = st.number_input("Labour Cost ($)", min_value=0.0, value=float(current_task.get('failure_cost', 0)), key="update_failure_labour")
+                            with col2:
+                                updated_failure_parts_cost = st.number_input("Parts Cost ($)", min_value=0.0, key="update_failure_parts")
+                            with col3:
+                                updated_failure_other_cost = st.number_input("Other Cost ($)", min_value=0.0, key="update_failure_other")
+                            
+                            updated_total_failure_cost = updated_failure_labour_cost + updated_failure_parts_cost + updated_failure_other_cost
+                            st.markdown(f"**Total Failure Cost:** ${updated_total_failure_cost:,.2f}")
                         
-                        # Calculate index for current task type
-                        if current_task_type in update_task_type_options:
-                            current_index = update_task_type_options.index(current_task_type)
-                        else:
-                            current_index = 0
+                        updated_crew_hours = 0.0
+                        if 'OTF' not in updated_task_type:
+                            updated_crew_hours = st.number_input("Annual Crew Hours", min_value=0.0,
+                                                                 value=float(current_task.get('crew_hours', 0)),
+                                                                 key="update_task_crew_hours")
                         
-                        # Task type selection
-                        updated_task_type = st.selectbox(
-                            "Select Task Type",
-                            update_task_type_options,
-                            index=current_index,
-                            key="update_task_type"
-                        )
+                        # Risk assessment for FTM and Redesign Safety/Environmental tasks
+                        updated_post_consequence_rating = None
+                        updated_post_likelihood_rating = None
+                        updated_post_risk_score = None
+                        updated_post_risk_level = None
                         
-                        if updated_task_type != "Select...":
-                            updated_task_description = st.text_area(
-                                "Task Description",
-                                value=current_task.get('description', ''),
-                                key="update_task_description"
-                            )
+                        if ("FTM" in updated_task_type or "Redesign" in updated_task_type) and ("Safety" in consequence_cat or "Environmental" in consequence_cat):
+                            st.markdown("---")
+                            st.markdown("#### Risk after task implementation")
+                            col1, col2, col3 = st.columns(3)
+                            
+                            # Get current post-risk values
+                            current_post_risk = current_task.get('post_risk_assessment', {})
+                            current_post_cons = current_post_risk.get('consequence', '3-Moderate')
+                            current_post_like = current_post_risk.get('likelihood', '3-Occasional')
                             
-                            col1, col2 = st.columns(2)
                             with col1:
-                                updated_technically_feasible = st.radio(
-                                    "Technically Feasible?",
-                                    ["Yes", "No"],
-                                    index=0 if current_task.get('technically_feasible') == "Yes" else 1,
-                                    key="update_technically_feasible"
+                                updated_post_consequence_rating = st.select_slider(
+                                    "Consequence Severity",
+                                    options=["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"],
+                                    value=current_post_cons,
+                                    key="update_ftm_post_consequence"
                                 )
+                            
                             with col2:
-                                updated_worth_doing = st.radio(
-                                    "Worth Doing?",
-                                    ["Yes", "No"],
-                                    index=0 if current_task.get('worth_doing') == "Yes" else 1,
-                                    key="update_worth_doing"
+                                updated_post_likelihood_rating = st.select_slider(
+                                    "Likelihood",
+                                    options=["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"],
+                                    value=current_post_like,
+                                    key="update_ftm_post_likelihood"
                                 )
                             
-                            updated_justification = st.text_area(
-                                "Justification",
-                                value=current_task.get('justification', ''),
-                                key="update_justification"
-                            )
-                            
-                            # Check if consequence is operational or non-operational AND task is not OTF
-                            consequence_cat = selected_task_mode.get('consequence_category', '')
-                            show_cost_fields = ('Operational' in consequence_cat or 'Non-operational' in consequence_cat) and 'OTF' not in updated_task_type
-                            
-                            # Initialize cost variables
-                            updated_labour_cost = 0.0
-                            updated_parts_cost = 0.0
-                            updated_other_cost = 0.0
-                            updated_failure_labour_cost = 0.0
-                            updated_failure_parts_cost = 0.0
-                            updated_failure_other_cost = 0.0
-                            updated_total_cost = 0.0
-                            updated_total_failure_cost = 0.0
-                            
-                            if show_cost_fields:
-                                st.markdown("### Cost of Task")
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    updated_labour_cost = st.number_input("Labour Cost ($)", min_value=0.0, value=float(current_task.get('cost', 0)), key="update_task_labour")
-                                with col2:
-                                    updated_parts_cost = st.number_input("Parts Cost ($)", min_value=0.0, key="update_task_parts")
-                                with col3:
-                                    updated_other_cost = st.number_input("Other Cost ($)", min_value=0.0, key="update_task_other")
-                                
-                                updated_total_cost = updated_labour_cost + updated_parts_cost + updated_other_cost
-                                st.markdown(f"**Total Task Cost:** ${updated_total_cost:,.2f}")
-                                
-                                st.markdown("### Cost of Failure")
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    updated_failure_labour_cost = st.number_input("Labour Cost ($)", min_value=0.0, value=float(current_task.get('failure_cost', 0)), key="update_failure_labour")
-                                with col2:
-                                    updated_failure_parts_cost = st.number_input("Parts Cost ($)", min_value=0.0, key="update_failure_parts")
-                                with col3:
-                                    updated_failure_other_cost = st.number_input("Other Cost ($)", min_value=0.0, key="update_failure_other")
-                                
-                                updated_total_failure_cost = updated_failure_labour_cost + updated_failure_parts_cost + updated_failure_other_cost
-                                st.markdown(f"**Total Failure Cost:** ${updated_total_failure_cost:,.2f}")
-                            
-                            # Risk assessment for FTM and Redesign Safety/Environmental tasks
-                            updated_post_consequence_rating = None
-                            updated_post_likelihood_rating = None
-                            updated_post_risk_score = None
-                            updated_post_risk_level = None
-                            
-                            if ("FTM" in updated_task_type or "Redesign" in updated_task_type) and ("Safety" in consequence_cat or "Environmental" in consequence_cat):
-                                st.markdown("---")
-                                st.markdown("#### Risk after task implementation")
-                                col1, col2, col3 = st.columns(3)
+                            with col3:
+                                # Calculate risk score
+                                updated_post_cons_num = int(updated_post_consequence_rating[0])
+                                updated_post_like_num = int(updated_post_likelihood_rating[0])
+                                updated_post_risk_score = updated_post_cons_num + updated_post_like_num
                                 
-                                # Get current post-risk values
-                                current_post_risk = current_task.get('post_risk_assessment', {})
-                                current_post_cons = current_post_risk.get('consequence', '3-Moderate')
-                                current_post_like = current_post_risk.get('likelihood', '3-Occasional')
+                                # Get risk level based on current thresholds
+                                updated_post_risk_level, updated_post_risk_color = get_risk_level(updated_post_risk_score)
                                 
-                                with col1:
-                                    updated_post_consequence_rating = st.select_slider(
-                                        "Consequence Severity",
-                                        options=["1-Insignificant", "2-Minor", "3-Moderate", "4-High", "5-Catastrophic"],
-                                        value=current_post_cons,
-                                        key="update_ftm_post_consequence"
-                                    )
+                                st.markdown(f"""
+                                <div style="background-color: {updated_post_risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
+                                <strong>Risk Level: {updated_post_risk_level}</strong><br>
+                                Score: {updated_post_risk_score}
+                                </div>
+                                """, unsafe_allow_html=True)
+                        
+                        col_update1, col_update2 = st.columns(2)
+                        with col_update1:
+                            if st.button("💾 Save Update", type="primary", use_container_width=True, key="save_task_update"):
+                                updated_task = {
+                                    'task_type': updated_task_type,
+                                    'description': updated_task_description,
+                                    'technically_feasible': updated_technically_feasible,
+                                    'worth_doing': updated_worth_doing,
+                                    'justification': updated_justification,
+                                    'cost': updated_total_cost,
+                                    'failure_cost': updated_total_failure_cost,
+                                    'crew_hours': updated_crew_hours
+                                }
                                 
-                                with col2:
-                                    updated_post_likelihood_rating = st.select_slider(
-                                        "Likelihood",
-                                        options=["1-Rare", "2-Unlikely", "3-Occasional", "4-Likely", "5-Almost Certain"],
-                                        value=current_post_like,
-                                        key="update_ftm_post_likelihood"
-                                    )
+                                # The recorded interval only still applies while the task is unchanged
+                                if ('interval' in current_task and updated_task_type == current_task_type
+                                        and updated_task_description == current_task.get('description', '')):
+                                    updated_task['interval'] = current_task['interval']
                                 
-                                with col3:
-                                    # Calculate risk score
-                                    updated_post_cons_num = int(updated_post_consequence_rating[0])
-                                    updated_post_like_num = int(updated_post_likelihood_rating[0])
-                                    updated_post_risk_score = updated_post_cons_num + updated_post_like_num
-                                    
-                                    # Get risk level based on current thresholds
-                                    updated_post_risk_level, updated_post_risk_color = get_risk_level(updated_post_risk_score)
-                                    
-                                    st.markdown(f"""
-                                    <div style="background-color: {updated_post_risk_color}; color: white; padding: 10px; border-radius: 5px; text-align: center;">
-                                    <strong>Risk Level: {updated_post_risk_level}</strong><br>
-                                    Score: {updated_post_risk_score}
-                                    </div>
-                                    """, unsafe_allow_html=True)
-                            
-                            col_update1, col_update2 = st.columns(2)
-                            with col_update1:
-                                if st.button("💾 Save Update", type="primary", use_container_width=True, key="save_task_update"):
-                                    updated_task = {
-                                        'task_type': updated_task_type,
-                                        'description': updated_task_description,
-                                        'technically_feasible': updated_technically_feasible,
-                                        'worth_doing': updated_worth_doing,
-                                        'justification': updated_justification,
-                                        'cost': updated_total_cost,
-                                        'failure_cost': updated_total_failure_cost
+                                # Add post-implementation risk assessment if applicable
+                                if ("FTM" in updated_task_type or "Redesign" in updated_task_type) and ("Safety" in consequence_cat or "Environmental" in consequence_cat):
+                                    updated_task['post_risk_assessment'] = {
+                                        'consequence': updated_post_consequence_rating,
+                                        'likelihood': updated_post_likelihood_rating,
+                                        'risk_score': updated_post_risk_score,
+                                        'risk_level': updated_post_risk_level
                                     }
-                                    
-                                    # Add post-implementation risk assessment if applicable
-                                    if ("FTM" in updated_task_type or "Redesign" in updated_task_type) and ("Safety" in consequence_cat or "Environmental" in consequence_cat):
-                                        updated_task['post_risk_assessment'] = {
-                                            'consequence': updated_post_consequence_rating,
-                                            'likelihood': updated_post_likelihood_rating,
-                                            'risk_score': updated_post_risk_score,
-                                            'risk_level': updated_post_risk_level
-                                        }
-                                    
-                                    st.session_state.failure_modes[task_mode_idx]['management_task'] = updated_task
-                                    st.session_state.editing_task = False
-                                    save_asset_analysis_data()
-                                    st.success(f"✅ Task for {selected_task_mode_id} updated!")
-                                    st.rerun()
-                            with col_update2:
-                                if st.button("❌ Cancel Update", use_container_width=True, key="cancel_task_update"):
-                                    st.session_state.editing_task = False
-                                    st.rerun()
-                    
-                    # Delete Confirmation
-                    if st.session_state.get('deleting_task', False):
-                        st.markdown("---")
-                        st.markdown("### 🗑️ Delete Task")
-                        st.warning(f"⚠️ Warning: This will delete the task for {selected_task_mode_id}!")
-                        
-                        col_del1, col_del2 = st.columns(2)
-                        with col_del1:
-                            if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True, key="confirm_task_delete"):
-                                # Delete the task
-                                if 'management_task' in st.session_state.failure_modes[task_mode_idx]:
-                                    del st.session_state.failure_modes[task_mode_idx]['management_task']
-                                st.session_state.deleting_task = False
+                                
+                                st.session_state.failure_modes[task_mode_idx]['management_task'] = updated_task
+                                st.session_state.editing_task = False
                                 save_asset_analysis_data()
-                                st.success(f"✅ Task for {selected_task_mode_id} deleted!")
-                                st.rerun()
-                        with col_del2:
-                            if st.button("❌ Cancel Delete", use_container_width=True, key="cancel_task_delete"):
-                                st.session_state.deleting_task = False
-                                st.rerun()
+                                st.success(f"✅ Task for {selected_task_mode_id} updated!")
+                                rerun_stage_2_step()
+                        with col_update2:
+                            if st.button("❌ Cancel Update", use_container_width=True, key="cancel_task_update"):
+                                st.session_state.editing_task = False
+                                rerun_stage_2_step()
+                
+                # Delete Confirmation
+                if st.session_state.get('deleting_task', False):
+                    st.markdown("---")
+                    st.markdown("### 🗑️ Delete Task")
+                    st.warning(f"⚠️ Warning: This will delete the task for {selected_task_mode_id}!")
+                    
+                    col_del1, col_del2 = st.columns(2)
+                    with col_del1:
+                        if st.button("🗑️ Confirm Delete", type="primary", use_container_width=True, key="confirm_task_delete"):
+                            # Delete the task; its analysis results row goes with it when the asset is saved
+                            if 'management_task' in st.session_state.failure_modes[task_mode_idx]:
+                                del st.session_state.failure_modes[task_mode_idx]['management_task']
+                            st.session_state.deleting_task = False
+                            save_asset_analysis_data()
+                            st.success(f"✅ Task for {selected_task_mode_id} deleted!")
+                            rerun_stage_2_step()
+                    with col_del2:
+                        if st.button("❌ Cancel Delete", use_container_width=True, key="cancel_task_delete"):
+                            st.session_state.deleting_task = False
+                            rerun_stage_2_step()
 
 # Stage 3: Implementation
 def stage_3_implementation():
@@ -4000,7 +5890,9 @@ def stage_3_implementation():
     st.markdown(f"**Planning for Asset:** {current_asset['asset_name']}")
     st.markdown("**Objective:** Plan implementation of the failure management tasks identified in the analysis.")
     
-    tab1, tab2, tab3 = st.tabs(["Maintenance Schedule", "One-off Changes", "Implementation Checklist"])
+    tab1, tab2, tab3, tab_budget, tab_calendar = st.tabs(["Maintenance Schedule", "One-off Changes",
+                                                          "Implementation Checklist", "Budget Optimization",
+                                                          "Maintenance Calendar"])
     
     with tab1:
         st.subheader("Maintenance Schedule")
@@ -4080,6 +5972,181 @@ def stage_3_implementation():
         
         for i, item in enumerate(checklist_items):
             st.checkbox(item, key=f"checklist_{i}")
+    
+    with tab_budget:
+        st.subheader("Budget Optimization")
+        st.markdown("Choose which failure management tasks of all assets in the project to fund when the "
+                    "annual budget or the crew hours do not cover them all.")
+        
+        candidates = get_task_candidates()
+        if len(candidates['cost']):
+            total_task_cost = float(candidates['cost'].sum())
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                objective = st.radio("Maximise", list(OBJECTIVES), format_func=OBJECTIVES.get, key="budget_objective")
+            with col2:
+                budget = st.number_input("Annual Budget ($)", min_value=0.0, value=round(total_task_cost / 2, 2),
+                                         step=1000.0, key="budget_amount")
+            with col3:
+                hours_limit = st.number_input("Annual Crew Hours Limit", min_value=0.0, step=100.0,
+                                              key="budget_hours_limit", help="0 means no limit")
+            st.caption(f"{len(candidates['cost'])} task(s) costing ${total_task_cost:,.2f} and "
+                       f"{candidates['hours'].sum():,.0f} crew hours per year")
+            
+            result = get_budget_optimization(objective, budget, hours_limit or None)
+            greedy = result['greedy']
+            optimal = result['optimal']
+            value_format = "{:,.0f}" if objective == 'risk' else "${:,.0f}"
+            
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric(f"{OBJECTIVES[objective]} (Greedy)", value_format.format(greedy['value']))
+            with col2:
+                st.metric(f"{OBJECTIVES[objective]} (Optimized)", value_format.format(optimal['value']),
+                          delta=value_format.format(optimal['value'] - greedy['value']) if optimal['value'] > greedy['value'] else None)
+            with col3:
+                st.metric("Budget Used", f"${optimal['cost']:,.0f}")
+            with col4:
+                st.metric("Crew Hours Used", f"{optimal['hours']:,.0f}")
+            if optimal['method'] == 'greedy':
+                st.caption("The greedy selection is the best selection found.")
+            elif optimal['exact']:
+                st.caption("The optimized selection is optimal.")
+            else:
+                st.caption("The optimized selection is near-optimal: costs are rounded to budget steps"
+                           + (" and crew hours are priced" if hours_limit else "") + ".")
+            
+            st.markdown("#### Efficient Frontier")
+            budgets, frontier_values = result['frontier']
+            st.line_chart(pd.DataFrame({OBJECTIVES[objective]: frontier_values},
+                                       index=pd.Index(budgets, name="Annual Budget ($)")))
+            st.caption("Best value reachable at each budget, without the crew hours limit.")
+            
+            task_rows = []
+            for row in np.flatnonzero(candidates[objective] > 0):
+                asset = st.session_state.assets[candidates['asset_index'][row]]
+                mode = asset['failure_modes'][candidates['mode_position'][row]]
+                task_rows.append({
+                    'Funded': bool(optimal['selected'][row]),
+                    'Asset Name': asset.get('asset_name', ''),
+                    'Failure Mode ID': mode.get('id', ''),
+                    'Failure Mode': mode.get('description', ''),
+                    'Task Type': mode['management_task'].get('task_type', ''),
+                    'Task Cost ($)': candidates['cost'][row],
+                    'Crew Hours': candidates['hours'][row],
+                    'Risk Addressed': candidates['risk'][row],
+                    'Failure Cost ($)': candidates['failure_cost'][row]
+                })
+            df_tasks = pd.DataFrame(task_rows)
+            if not df_tasks.empty:
+                df_tasks = df_tasks.sort_values('Risk Addressed' if objective == 'risk' else 'Failure Cost ($)',
+                                                ascending=False)
+                st.markdown(f"#### Funded Tasks ({int(df_tasks['Funded'].sum())})")
+                st.dataframe(df_tasks[df_tasks['Funded']].drop(columns='Funded'), use_container_width=True, hide_index=True)
+                st.markdown(f"#### Deferred Tasks ({int((~df_tasks['Funded']).sum())})")
+                st.dataframe(df_tasks[~df_tasks['Funded']].drop(columns='Funded'), use_container_width=True, hide_index=True)
+        else:
+            st.info("No failure management tasks defined yet.")
+    
+    with tab_calendar:
+        st.subheader("Maintenance Calendar")
+        st.markdown("Occurrences of the CBM, FTM and FF tasks of all assets over the planning horizon, levelled "
+                    "against the crew hours available per site and week. Work that does not fit is carried "
+                    "over to the following weeks, highest risk first.")
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            today = datetime.now().date()
+            schedule_start = st.date_input("Start Date", value=today.fromordinal(today.toordinal() - today.weekday()),
+                                           key="schedule_start_date")
+        with col2:
+            horizon_years = st.number_input("Horizon (Years)", min_value=1, max_value=30,
+                                            value=config_data['SCHEDULE_HORIZON_YEARS'], key="schedule_horizon_years")
+        with col3:
+            operating_hours_per_week = st.number_input("Operating Hours per Week", min_value=1.0, max_value=168.0,
+                                                       value=168.0, key="schedule_operating_hours",
+                                                       help="Converts intervals in operating hours to calendar time")
+        with col4:
+            default_task_hours = st.number_input("Crew Hours per Occurrence", min_value=0.0, value=2.0,
+                                                 key="schedule_default_task_hours",
+                                                 help="Used for tasks without annual crew hours")
+        
+        sites = list(dict.fromkeys(asset.get('site_location', '') or 'Unassigned' for asset in st.session_state.assets))
+        site_capacity = st.data_editor(
+            pd.DataFrame({'Site': sites, 'Weekly Crew Hours': [config_data['SCHEDULE_CREW_HOURS']] * len(sites)}),
+            disabled=['Site'], hide_index=True, key="schedule_site_capacity",
+            column_config={'Weekly Crew Hours': st.column_config.NumberColumn(min_value=0.0, help="0 means no limit")}
+        )
+        capacity_by_site = {row['Site']: float(row['Weekly Crew Hours']) if row['Weekly Crew Hours'] else np.inf
+                            for _, row in site_capacity.iterrows()}
+        
+        try:
+            schedule = get_maintenance_schedule(schedule_start, int(horizon_years), capacity_by_site,
+                                                operating_hours_per_week, default_task_hours)
+        except ValueError as e:
+            st.error(str(e))
+            schedule = None
+        
+        if schedule is not None and len(schedule['interval_days']):
+            summary = schedule_summary(schedule)
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Recurring Tasks", summary['tasks'])
+            with col2:
+                st.metric("Occurrences", f"{summary['occurrences']:,}")
+            with col3:
+                st.metric("Deferred Occurrences", f"{summary['deferred']:,}",
+                          help=f"Longest deferral: {summary['max_deferral_weeks']} week(s)")
+            with col4:
+                st.metric("Not Done Within Horizon", f"{summary['beyond_horizon']:,}")
+            
+            if schedule['unscheduled']:
+                with st.expander(f"⚠️ {len(schedule['unscheduled'])} task(s) without a usable interval"):
+                    st.dataframe(pd.DataFrame([{
+                        'Asset Name': st.session_state.assets[asset_index].get('asset_name', ''),
+                        'Failure Mode ID': st.session_state.assets[asset_index]['failure_modes'][mode_position].get('id', ''),
+                        'Reason': reason
+                    } for asset_index, mode_position, reason in schedule['unscheduled']]),
+                        use_container_width=True, hide_index=True)
+            
+            site_index = st.selectbox("Site", range(len(schedule['sites'])),
+                                      format_func=lambda i: schedule['sites'][i], key="schedule_site")
+            st.markdown("#### Weekly Crew Hours")
+            capacity = schedule['capacity'][site_index]
+            df_load = pd.DataFrame({'Due': schedule['demand'][site_index],
+                                    'Scheduled': schedule['scheduled_hours'][site_index],
+                                    'Backlog': schedule['backlog'][site_index]},
+                                   index=pd.Index(schedule['week_start'], name="Week"))
+            if np.isfinite(capacity):
+                df_load['Capacity'] = capacity
+            st.line_chart(df_load)
+            
+            st.markdown("#### Calendar")
+            years = sorted(set((schedule['week_start'].astype('datetime64[Y]').astype(int) + 1970).tolist()))
+            calendar_year = st.selectbox("Year", years, key="schedule_year")
+            year_start = np.datetime64(f"{calendar_year}-01-01")
+            year_end = np.datetime64(f"{calendar_year + 1}-01-01")
+            task_site = schedule['site'][schedule['task_index']]
+            scheduled = np.minimum(schedule['scheduled_week'], schedule['weeks'] - 1)
+            scheduled_start = schedule['week_start'][scheduled]
+            occurrences = np.flatnonzero((task_site == site_index) & (scheduled_start >= year_start)
+                                         & (scheduled_start < year_end) & (schedule['scheduled_week'] < schedule['weeks']))
+            occurrences = occurrences[np.argsort(scheduled_start[occurrences], kind='stable')]
+            df_calendar = pd.DataFrame(calendar_rows(schedule, st.session_state.assets, occurrences))
+            if not df_calendar.empty:
+                st.caption(f"{len(df_calendar):,} occurrence(s)" + (", showing the first 1,000" if len(df_calendar) > 1000 else ""))
+                st.dataframe(df_calendar.head(1000), use_container_width=True, hide_index=True)
+                st.download_button(
+                    label="📥 Download Calendar (CSV)",
+                    data=df_calendar.to_csv(index=False),
+                    file_name=f"maintenance_calendar_{schedule['sites'][site_index]}_{calendar_year}.csv",
+                    mime="text/csv",
+                    key="download_schedule_calendar"
+                )
+            else:
+                st.info("No occurrences scheduled at this site in this year")
+        elif schedule is not None:
+            st.info("No recurring CBM, FTM or FF tasks with an interval defined yet.")
 
 # Stage 4: Reports and Export
 def stage_4_reports():
@@ -4106,57 +6173,77 @@ def stage_4_reports():
     st.markdown(f"### 📁 Project: {st.session_state.project_data['project_no']} - {st.session_state.project_data.get('project_description', '')}")
     st.markdown(f"**Total Assets:** {len(st.session_state.assets)}")
     
-    tab1, tab2, tab3 = st.tabs(["Project Summary", "Asset Reports", "Export Data"])
+    tab1, tab2, tab_heat_map, tab_reduction, tab3 = st.tabs(
+        ["Project Summary", "Asset Reports", "Risk Heat Map", "Risk Reduction", "Export Data"])
     
     with tab1:
         st.subheader("Project-Level Summary Report")
         
-        # Aggregate statistics across all assets
-        total_functions = 0
-        total_failures = 0
-        total_modes = 0
-        total_tasks = 0
-        total_cost = 0
-        
-        for asset in st.session_state.assets:
-            total_functions += len(asset.get('functions', []))
-            total_failures += len(asset.get('functional_failures', []))
-            total_modes += len(asset.get('failure_modes', []))
-            total_tasks += len(asset.get('analysis_results', []))
-            total_cost += sum([r.get('cost', 0) for r in asset.get('analysis_results', [])])
+        # Aggregate statistics across all assets (only changed assets are recounted)
+        aggregates = get_project_aggregates()
+        totals = aggregates['totals']
         
         st.markdown("### Overall Project Statistics")
         col1, col2, col3, col4, col5 = st.columns(5)
         with col1:
             st.metric("Assets", len(st.session_state.assets))
         with col2:
-            st.metric("Functions", total_functions)
+            st.metric("Functions", totals['functions'])
         with col3:
-            st.metric("Failure Modes", total_modes)
+            st.metric("Failure Modes", totals['failure_modes'])
         with col4:
-            st.metric("Tasks", total_tasks)
+            st.metric("Tasks", totals['tasks'])
         with col5:
-            st.metric("Annual Cost", f"${total_cost:,.0f}")
+            st.metric("Annual Cost", f"${totals['annual_cost']:,.0f}")
         
         # Asset summary table
         st.markdown("---")
         st.markdown("### Assets Overview")
         
-        asset_summary = []
-        for asset in st.session_state.assets:
-            asset_cost = sum([r.get('cost', 0) for r in asset.get('analysis_results', [])])
-            asset_summary.append({
-                'Asset Name': asset['asset_name'],
-                'Class': asset['asset_class'],
-                'Components': len(asset.get('components', [])),
-                'Failure Modes': len(asset.get('failure_modes', [])),
-                'Tasks': len(asset.get('analysis_results', [])),
-                'Annual Cost ($)': asset_cost
-            })
-        
-        if asset_summary:
-            df_summary = pd.DataFrame(asset_summary)
+        df_summary = aggregates['summary']
+        if not df_summary.empty:
             st.dataframe(df_summary, use_container_width=True)
+        
+        # Risk, cost and task analytics across all assets (parallel for large portfolios)
+        st.markdown("---")
+        st.markdown("### Portfolio Analytics")
+        analytics = get_portfolio_analytics()
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            high_risks = analytics['risk_levels']['High']
+            st.metric("High Risks", high_risks,
+                      delta=f"{analytics['residual_risk_levels']['High'] - high_risks} after tasks", delta_color="inverse")
+        with col2:
+            moderate_risks = analytics['risk_levels']['Moderate']
+            st.metric("Moderate Risks", moderate_risks,
+                      delta=f"{analytics['residual_risk_levels']['Moderate'] - moderate_risks} after tasks",
+                      delta_color="inverse")
+        with col3:
+            st.metric("Annual Task Cost", f"${analytics['task_cost']:,.0f}")
+        with col4:
+            st.metric("Failure Cost Addressed", f"${analytics['failure_cost']:,.0f}")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("#### Risk Score Distribution")
+            score_rows = risk_score_rows(analytics)
+            if score_rows:
+                st.bar_chart(pd.DataFrame(score_rows).set_index('Risk Score'))
+            else:
+                st.info("No risk assessments yet")
+        with col2:
+            st.markdown("#### Tasks by Type")
+            type_rows = task_type_rows(analytics)
+            if type_rows:
+                st.dataframe(pd.DataFrame(type_rows), use_container_width=True, hide_index=True)
+            else:
+                st.info("No maintenance tasks yet")
+        
+        top_rows = top_risk_rows(analytics)
+        if top_rows:
+            st.markdown(f"#### Top {len(top_rows)} Risks")
+            st.dataframe(pd.DataFrame(top_rows), use_container_width=True, hide_index=True)
     
     with tab2:
         st.subheader("Individual Asset Reports")
@@ -4213,58 +6300,7 @@ def stage_4_reports():
             st.markdown("---")
             st.markdown("### Detailed FMECA Analysis")
             
-            detailed_data = []
-            for mode in current_asset['failure_modes']:
-                row = {
-                    'Failure Mode ID': mode['id'],
-                    'Functional Failure ID': mode.get('functional_failure_id', ''),
-                    'Component': mode['component'],
-                    'Failure Mode': mode['description'],
-                    'Failure Mode Category': mode.get('category', ''),
-                }
-                
-                # Add effects data
-                if 'effects' in mode:
-                    effects = mode['effects']
-                    row['Evidence of Failure'] = effects.get('evidence', '')
-                    row['Safety/Environmental Impact'] = effects.get('safety_impact', '')
-                    row['Operational Impact'] = effects.get('operational_impact', '')
-                    row['Physical Damage'] = effects.get('physical_damage', '')
-                    row['Repair Action'] = effects.get('repair_action', '')
-                    row['Repair Time (hrs)'] = effects.get('repair_time', 0)
-                    row['Downtime (hrs)'] = effects.get('downtime', 0)
-                
-                # Add consequence data
-                row['Consequence Category'] = mode.get('consequence_category', 'Not categorized')
-                
-                # Add risk assessment data (for safety/environmental)
-                if 'risk_assessment' in mode:
-                    risk = mode['risk_assessment']
-                    row['Risk Consequence'] = risk.get('consequence', '')
-                    row['Risk Likelihood'] = risk.get('likelihood', '')
-                    row['Risk Score'] = risk.get('risk_score', '')
-                    row['Risk Level'] = risk.get('risk_level', '')
-                
-                # Add management task data
-                if 'management_task' in mode:
-                    task = mode['management_task']
-                    row['Task Type'] = task.get('task_type', '')
-                    row['Task Description'] = task.get('description', '')
-                    row['Technically Feasible'] = task.get('technically_feasible', '')
-                    row['Worth Doing'] = task.get('worth_doing', '')
-                    row['Justification'] = task.get('justification', '')
-                    row['Task Cost ($)'] = task.get('cost', 0)
-                    row['Failure Cost ($)'] = task.get('failure_cost', 0)
-                    
-                    # Add post-implementation risk assessment if exists
-                    if 'post_risk_assessment' in task:
-                        post_risk = task['post_risk_assessment']
-                        row['Post-Task Risk Consequence'] = post_risk.get('consequence', '')
-                        row['Post-Task Risk Likelihood'] = post_risk.get('likelihood', '')
-                        row['Post-Task Risk Score'] = post_risk.get('risk_score', '')
-                        row['Post-Task Risk Level'] = post_risk.get('risk_level', '')
-                
-                detailed_data.append(row)
+            detailed_data = [flatten_failure_mode(mode) for mode in current_asset['failure_modes']]
             
             df_detailed = pd.DataFrame(detailed_data)
             
@@ -4279,6 +6315,129 @@ def stage_4_reports():
             
             st.dataframe(df_detailed, use_container_width=True)
     
+    with tab_heat_map:
+        st.subheader("Risk Heat Map")
+        st.markdown("Number of failure modes in each cell of the risk matrix, before and after their maintenance tasks. "
+                    "After tasks, failure modes with a post-task risk assessment are counted at their post-task rating.")
+        
+        risk_ratings = get_risk_ratings()
+        ratings = risk_ratings['ratings']
+        moderate_threshold = st.session_state.risk_moderate_threshold
+        high_threshold = st.session_state.risk_high_threshold
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("#### Current Risk")
+            st.markdown(generate_risk_heat_map_html(risk_heat_map(ratings[:, 0:2])), unsafe_allow_html=True)
+        with col2:
+            st.markdown("#### After Tasks")
+            st.markdown(generate_risk_heat_map_html(risk_heat_map(residual_ratings(ratings))), unsafe_allow_html=True)
+        
+        # Failure modes by risk level before (rows) and after tasks (columns)
+        migration = risk_migration(ratings, moderate_threshold, high_threshold)
+        st.markdown("#### Risk Migration")
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            st.dataframe(pd.DataFrame(migration, index=["Low", "Moderate", "High"],
+                                      columns=["→ Low", "→ Moderate", "→ High"]).rename_axis("Current"),
+                         use_container_width=True)
+        with col2:
+            st.metric("Reduced to a Lower Risk Level", int(np.tril(migration, -1).sum()))
+        
+        # Drill-down to the failure modes of one cell
+        st.markdown("#### Failure Modes in a Cell")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            cell_consequence = st.selectbox("Consequence", options=range(1, len(CONSEQUENCE_RATINGS) + 1),
+                                            format_func=lambda x: CONSEQUENCE_RATINGS[x - 1], index=4,
+                                            key="heat_map_consequence")
+        with col2:
+            cell_likelihood = st.selectbox("Likelihood", options=range(1, len(LIKELIHOOD_RATINGS) + 1),
+                                           format_func=lambda x: LIKELIHOOD_RATINGS[x - 1], index=4,
+                                           key="heat_map_likelihood")
+        with col3:
+            cell_view = st.radio("Risk", ["Current", "After Tasks"], horizontal=True, key="heat_map_view")
+        
+        cell_rows = risk_cell_rows(ratings, cell_consequence, cell_likelihood, after_tasks=cell_view == "After Tasks")
+        if len(cell_rows):
+            cell_modes = []
+            for row in cell_rows[:500]:
+                asset = st.session_state.assets[risk_ratings['asset_index'][row]]
+                mode = asset['failure_modes'][risk_ratings['mode_position'][row]]
+                task = mode.get('management_task') or {}
+                cell_modes.append({
+                    'Asset Name': asset.get('asset_name', ''),
+                    'Failure Mode ID': mode.get('id', ''),
+                    'Component': mode.get('component', ''),
+                    'Failure Mode': mode.get('description', ''),
+                    'Risk Score': (mode.get('risk_assessment') or {}).get('risk_score', ''),
+                    'Task Type': task.get('task_type', ''),
+                    'Post-Task Risk Score': (task.get('post_risk_assessment') or {}).get('risk_score', '')
+                })
+            st.caption(f"{len(cell_rows)} failure mode(s)" + (", showing the first 500" if len(cell_rows) > 500 else ""))
+            st.dataframe(pd.DataFrame(cell_modes), use_container_width=True, hide_index=True)
+        else:
+            st.info("No failure modes in this cell")
+    
+    with tab_reduction:
+        st.subheader("Risk Reduction")
+        st.markdown("Reduction of the risk score from the current risk assessment to the post-task risk assessment, "
+                    "recorded for FTM and Redesign tasks of safety and environmental failure modes.")
+        
+        risk_ratings = get_risk_ratings()
+        risk_reduction = get_risk_reduction()
+        reduction_totals = risk_reduction['totals']
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Failure Modes with Reduced Risk", int(reduction_totals['modes_reduced']))
+        with col2:
+            st.metric("Lower Risk Level", int(reduction_totals['levels_reduced']))
+        with col3:
+            score_before = reduction_totals['score_before']
+            st.metric("Total Risk Score Reduction", int(reduction_totals['reduction']),
+                      delta=f"-{reduction_totals['reduction'] / score_before:.1%}" if score_before else None,
+                      delta_color="inverse")
+        with col4:
+            st.metric("Reduction per $1,000",
+                      f"{reduction_totals['reduction'] / reduction_totals['task_cost'] * 1000:,.2f}"
+                      if reduction_totals['task_cost'] else "N/A")
+        
+        if reduction_totals['modes_reduced']:
+            st.markdown("#### Most Cost-Effective Tasks")
+            top_tasks = []
+            for row in rank_cost_effective_tasks(risk_reduction, risk_ratings['task_costs']):
+                asset = st.session_state.assets[risk_ratings['asset_index'][row]]
+                mode = asset['failure_modes'][risk_ratings['mode_position'][row]]
+                cost = risk_ratings['task_costs'][row]
+                per_cost = reduction_per_cost(np.array([risk_reduction['reduction'][row]]), np.array([cost]))[0]
+                top_tasks.append({
+                    'Asset Name': asset.get('asset_name', ''),
+                    'Failure Mode ID': mode.get('id', ''),
+                    'Failure Mode': mode.get('description', ''),
+                    'Task Type': mode['management_task'].get('task_type', ''),
+                    'Risk Score': f"{risk_reduction['score_before'][row]} → {risk_reduction['score_after'][row]}",
+                    'Task Cost ($)': cost,
+                    'Reduction per $1,000': per_cost * 1000
+                })
+            st.dataframe(pd.DataFrame(top_tasks), use_container_width=True, hide_index=True)
+            
+            st.markdown("#### Risk Reduction by Asset")
+            by_asset = risk_reduction['by_asset']
+            df_reduction = pd.DataFrame({
+                'Asset Name': [asset.get('asset_name', '') for asset in st.session_state.assets],
+                'Modes Reduced': by_asset['modes_reduced'],
+                'Lower Risk Level': by_asset['levels_reduced'],
+                'Risk Score Reduction': by_asset['reduction'].astype(int),
+                'Risk-Reducing Task Cost ($)': by_asset['task_cost']
+            })
+            df_reduction = df_reduction[df_reduction['Modes Reduced'] > 0].sort_values(
+                'Risk Score Reduction', ascending=False)
+            st.dataframe(df_reduction, use_container_width=True, hide_index=True)
+        else:
+            st.info("No post-task risk assessments yet. They are recorded in Step 7 for FTM and Redesign tasks of "
+                    "safety and environmental failure modes.")
+    
     with tab3:
         st.subheader("Export Project Data")
         
@@ -4288,74 +6447,15 @@ def stage_4_reports():
             st.markdown("#### Export Complete Project (Excel)")
             
             if st.session_state.assets:
-                # Compile all failure modes from all assets into one comprehensive dataset
-                all_data = []
-                for asset in st.session_state.assets:
-                    if asset.get('failure_modes'):
-                        for mode in asset['failure_modes']:
-                            row = {
-                                'Asset Name': asset['asset_name'],
-                                'Asset Class': asset.get('asset_class', ''),
-                                'Asset Type': asset.get('asset_type', ''),
-                                'Site Location': asset.get('site_location', ''),
-                                'Failure Mode ID': mode['id'],
-                                'Functional Failure ID': mode.get('functional_failure_id', ''),
-                                'Component': mode['component'],
-                                'Failure Mode': mode['description'],
-                                'Failure Mode Category': mode.get('category', ''),
-                            }
-                            
-                            # Add effects data
-                            if 'effects' in mode:
-                                effects = mode['effects']
-                                row['Evidence of Failure'] = effects.get('evidence', '')
-                                row['Safety/Environmental Impact'] = effects.get('safety_impact', '')
-                                row['Operational Impact'] = effects.get('operational_impact', '')
-                                row['Physical Damage'] = effects.get('physical_damage', '')
-                                row['Repair Action'] = effects.get('repair_action', '')
-                                row['Repair Time (hrs)'] = effects.get('repair_time', 0)
-                                row['Downtime (hrs)'] = effects.get('downtime', 0)
-                            
-                            # Add consequence data
-                            row['Consequence Category'] = mode.get('consequence_category', 'Not categorized')
-                            
-                            # Add risk assessment data
-                            if 'risk_assessment' in mode:
-                                risk = mode['risk_assessment']
-                                row['Risk Consequence'] = risk.get('consequence', '')
-                                row['Risk Likelihood'] = risk.get('likelihood', '')
-                                row['Risk Score'] = risk.get('risk_score', '')
-                                row['Risk Level'] = risk.get('risk_level', '')
-                            
-                            # Add management task data
-                            if 'management_task' in mode:
-                                task = mode['management_task']
-                                row['Task Type'] = task.get('task_type', '')
-                                row['Task Description'] = task.get('description', '')
-                                row['Technically Feasible'] = task.get('technically_feasible', '')
-                                row['Worth Doing'] = task.get('worth_doing', '')
-                                row['Justification'] = task.get('justification', '')
-                                row['Task Cost ($)'] = task.get('cost', 0)
-                                row['Failure Cost ($)'] = task.get('failure_cost', 0)
-                                
-                                # Add post-implementation risk assessment if exists
-                                if 'post_risk_assessment' in task:
-                                    post_risk = task['post_risk_assessment']
-                                    row['Post-Task Risk Consequence'] = post_risk.get('consequence', '')
-                                    row['Post-Task Risk Likelihood'] = post_risk.get('likelihood', '')
-                                    row['Post-Task Risk Score'] = post_risk.get('risk_score', '')
-                                    row['Post-Task Risk Level'] = post_risk.get('risk_level', '')
-                            
-                            all_data.append(row)
+                failure_mode_count = sum(len(asset.get('failure_modes', [])) for asset in st.session_state.assets)
                 
-                if all_data:
-                    df_complete = pd.DataFrame(all_data)
-                    
-                    # Convert to Excel
-                    output = io.BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        df_complete.to_excel(writer, sheet_name='Complete FMECA Analysis', index=False)
-                    output.seek(0)
+                if failure_mode_count:
+                    # Formatted FMECA workbook of all assets, unless it is cached
+                    project_data = st.session_state.project_data
+                    output = get_cached_workbook(
+                        ('project', project_data.get('project_no', ''),
+                         tuple(get_asset_digest(asset) for asset in st.session_state.assets)),
+                        lambda: build_fmeca_workbook(st.session_state.assets, project_data))
                     
                     st.download_button(
                         label="📥 Download Complete Project (Excel)",
@@ -4364,7 +6464,7 @@ def stage_4_reports():
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         use_container_width=True
                     )
-                    st.info(f"Includes all {len(st.session_state.assets)} assets and {len(all_data)} failure modes")
+                    st.info(f"Includes all {len(st.session_state.assets)} assets and {failure_mode_count} failure modes")
                 else:
                     st.warning("No failure mode data available to export")
             else:
@@ -4384,71 +6484,11 @@ def stage_4_reports():
                 selected_asset = st.session_state.assets[asset_for_export]
                 
                 if selected_asset.get('failure_modes'):
-                    # Compile failure modes data for this asset
-                    asset_data = []
-                    for mode in selected_asset['failure_modes']:
-                        row = {
-                            'Asset Name': selected_asset['asset_name'],
-                            'Asset Class': selected_asset.get('asset_class', ''),
-                            'Asset Type': selected_asset.get('asset_type', ''),
-                            'Site Location': selected_asset.get('site_location', ''),
-                            'Failure Mode ID': mode['id'],
-                            'Functional Failure ID': mode.get('functional_failure_id', ''),
-                            'Component': mode['component'],
-                            'Failure Mode': mode['description'],
-                            'Failure Mode Category': mode.get('category', ''),
-                        }
-                        
-                        # Add effects data
-                        if 'effects' in mode:
-                            effects = mode['effects']
-                            row['Evidence of Failure'] = effects.get('evidence', '')
-                            row['Safety/Environmental Impact'] = effects.get('safety_impact', '')
-                            row['Operational Impact'] = effects.get('operational_impact', '')
-                            row['Physical Damage'] = effects.get('physical_damage', '')
-                            row['Repair Action'] = effects.get('repair_action', '')
-                            row['Repair Time (hrs)'] = effects.get('repair_time', 0)
-                            row['Downtime (hrs)'] = effects.get('downtime', 0)
-                        
-                        # Add consequence data
-                        row['Consequence Category'] = mode.get('consequence_category', 'Not categorized')
-                        
-                        # Add risk assessment data
-                        if 'risk_assessment' in mode:
-                            risk = mode['risk_assessment']
-                            row['Risk Consequence'] = risk.get('consequence', '')
-                            row['Risk Likelihood'] = risk.get('likelihood', '')
-                            row['Risk Score'] = risk.get('risk_score', '')
-                            row['Risk Level'] = risk.get('risk_level', '')
-                        
-                        # Add management task data
-                        if 'management_task' in mode:
-                            task = mode['management_task']
-                            row['Task Type'] = task.get('task_type', '')
-                            row['Task Description'] = task.get('description', '')
-                            row['Technically Feasible'] = task.get('technically_feasible', '')
-                            row['Worth Doing'] = task.get('worth_doing', '')
-                            row['Justification'] = task.get('justification', '')
-                            row['Task Cost ($)'] = task.get('cost', 0)
-                            row['Failure Cost ($)'] = task.get('failure_cost', 0)
-                            
-                            # Add post-implementation risk assessment if exists
-                            if 'post_risk_assessment' in task:
-                                post_risk = task['post_risk_assessment']
-                                row['Post-Task Risk Consequence'] = post_risk.get('consequence', '')
-                                row['Post-Task Risk Likelihood'] = post_risk.get('likelihood', '')
-                                row['Post-Task Risk Score'] = post_risk.get('risk_score', '')
-                                row['Post-Task Risk Level'] = post_risk.get('risk_level', '')
-                        
-                        asset_data.append(row)
-                    
-                    df_asset = pd.DataFrame(asset_data)
-                    
-                    # Convert to Excel
-                    output = io.BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        df_asset.to_excel(writer, sheet_name=selected_asset['asset_name'][:31], index=False)
-                    output.seek(0)
+                    # Formatted FMECA workbook of this asset, unless it is cached
+                    project_data = st.session_state.project_data
+                    output = get_cached_workbook(
+                        ('asset', project_data.get('project_no', ''), get_asset_digest(selected_asset)),
+                        lambda: build_fmeca_workbook([selected_asset], project_data))
                     
                     st.download_button(
                         label=f"📥 Download {selected_asset['asset_name']} (Excel)",
@@ -4457,10 +6497,61 @@ def stage_4_reports():
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         use_container_width=True
                     )
-                    st.info(f"Includes {len(asset_data)} failure modes for {selected_asset['asset_name']}")
+                    st.info(f"Includes {len(selected_asset['failure_modes'])} failure modes for {selected_asset['asset_name']}")
                 else:
                     st.info("No failure mode data available for this asset yet.")
         
+        st.markdown("---")
+        st.markdown("#### PDF Reports")
+        
+        if st.session_state.assets:
+            project_data = st.session_state.project_data
+            project_no = project_data.get('project_no', '')
+            thresholds = (st.session_state.risk_moderate_threshold, st.session_state.risk_high_threshold)
+            pdf_workers = config_data['PDF_WORKERS'] or None
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                # Summary pages and one section per asset; sections are laid out in a process pool.
+                # The cover page shows the description and last modified date, so they are in the key
+                report_key = ('pdf-project', project_no, project_data.get('project_description', ''),
+                              str(project_data.get('last_modified') or ''), thresholds,
+                              tuple(get_asset_digest(asset) for asset in st.session_state.assets))
+                if has_cached_workbook(report_key) or st.button("📄 Generate Project Report (PDF)", use_container_width=True):
+                    with st.spinner(f"Generating report of {len(st.session_state.assets)} assets..."):
+                        report = get_cached_workbook(report_key, lambda: build_pdf_report(
+                            st.session_state.assets, project_data, *thresholds, workers=pdf_workers))
+                    st.download_button(
+                        label="📥 Download Project Report (PDF)",
+                        data=report,
+                        file_name=f"rcm_report_{project_no or 'project'}_{datetime.now().strftime('%Y%m%d')}.pdf",
+                        mime="application/pdf",
+                        use_container_width=True
+                    )
+            
+            with col2:
+                pdf_asset_index = st.selectbox(
+                    "Select Asset for PDF Report",
+                    options=range(len(st.session_state.assets)),
+                    format_func=lambda x: st.session_state.assets[x]['asset_name'],
+                    key="pdf_export_selector"
+                )
+                pdf_asset = st.session_state.assets[pdf_asset_index]
+                # An asset report only shows the project number (in its title), so only that is passed
+                report_key = ('pdf-asset', project_no, thresholds, get_asset_digest(pdf_asset))
+                if has_cached_workbook(report_key) or st.button("📄 Generate Asset Report (PDF)", use_container_width=True):
+                    report = get_cached_workbook(report_key, lambda: build_pdf_report(
+                        [pdf_asset], {'project_no': project_no}, *thresholds, include_summary=False))
+                    st.download_button(
+                        label=f"📥 Download {pdf_asset['asset_name']} Report (PDF)",
+                        data=report,
+                        file_name=f"rcm_report_{pdf_asset['asset_name']}_{datetime.now().strftime('%Y%m%d')}.pdf",
+                        mime="application/pdf",
+                        use_container_width=True
+                    )
+        else:
+            st.warning("No assets available to report")
+        
         st.markdown("---")
         st.markdown("#### Import Project Data")
         
@@ -4469,7 +6560,23 @@ def stage_4_reports():
             try:
                 imported_data = json.load(uploaded_file)
                 
+                # Orphaned and duplicate records left by older versions
+                integrity_report = check_project_integrity(imported_data)
+                repair_on_import = False
+                if integrity_report:
+                    issue_count = sum(len(issues) for _, issues in integrity_report)
+                    st.warning(f"⚠️ The file has {issue_count} referential integrity issue(s)")
+                    with st.expander("View integrity issues"):
+                        for label, issues in integrity_report:
+                            st.markdown(f"**{label}**")
+                            for issue in issues:
+                                st.markdown(f"- {issue['message']}")
+                    repair_on_import = st.checkbox("Remove orphaned, stale and duplicate records on import", value=True,
+                                                   key="repair_on_import")
+                
                 if st.button("📥 Import Project Data"):
+                    if repair_on_import:
+                        imported_data = repair_project(imported_data)
                     load_import_data(imported_data)
                     autosave_session_data()
                     st.success("✅ Project data imported successfully!")
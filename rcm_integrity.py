@@ -0,0 +1,246 @@
+"""Referential integrity for FMECA & RCM analysis data
+
+An asset's analysis is a tree held in flat lists that refer to each other by id:
+functions <- functional failures (function_id) <- failure modes (functional_failure_id)
+<- analysis results (failure_mode_id). This module builds reverse indexes over those lists,
+computes cascading deletes from them, and checks/repairs exported project files.
+
+It does not depend on Streamlit and can be run offline:
+
+    python rcm_integrity.py project.json                  # report integrity issues
+    python rcm_integrity.py project.json --repair -o fixed.json
+"""
+import argparse
+import json
+import sys
+
+ANALYSIS_KEYS = ['functions', 'functional_failures', 'failure_modes', 'analysis_results']
+
+# Reverse Index Functions
+def build_reference_index(functional_failures, failure_modes, analysis_results):
+    """Build parent -> children reverse indexes for one asset's analysis
+
+    Returns a dict of {parent id: [child ids]} maps: 'failures_by_function',
+    'modes_by_failure' and 'results_by_mode' (result positions in analysis_results).
+    """
+    failures_by_function = {}
+    for failure in functional_failures:
+        failures_by_function.setdefault(failure.get('function_id'), []).append(failure.get('id'))
+
+    modes_by_failure = {}
+    for mode in failure_modes:
+        modes_by_failure.setdefault(mode.get('functional_failure_id'), []).append(mode.get('id'))
+
+    results_by_mode = {}
+    for position, result in enumerate(analysis_results):
+        results_by_mode.setdefault(result.get('failure_mode_id'), []).append(position)
+
+    return {
+        'failures_by_function': failures_by_function,
+        'modes_by_failure': modes_by_failure,
+        'results_by_mode': results_by_mode
+    }
+
+def collect_cascade(reference_index, function_ids=(), failure_ids=(), mode_ids=()):
+    """Collect everything a delete reaches, walking the reverse indexes
+
+    Only the deleted records and their descendants are visited. Returns sets of function ids,
+    functional failure ids, failure mode ids and analysis result positions.
+    """
+    functions = set(function_ids)
+    failures = set(failure_ids)
+    modes = set(mode_ids)
+    for function_id in functions:
+        failures.update(reference_index['failures_by_function'].get(function_id, []))
+    for failure_id in failures:
+        modes.update(reference_index['modes_by_failure'].get(failure_id, []))
+    results = set()
+    for mode_id in modes:
+        results.update(reference_index['results_by_mode'].get(mode_id, []))
+    return {
+        'functions': functions,
+        'functional_failures': failures,
+        'failure_modes': modes,
+        'analysis_results': results
+    }
+
+def apply_cascade(analysis, cascade):
+    """Return the analysis lists without the records in a cascade; the input lists are not modified"""
+    if not any(cascade.values()):
+        return {key: analysis.get(key, []) for key in ANALYSIS_KEYS}
+    return {
+        'functions': [f for f in analysis.get('functions', []) if f.get('id') not in cascade['functions']],
+        'functional_failures': [f for f in analysis.get('functional_failures', [])
+                                if f.get('id') not in cascade['functional_failures']],
+        'failure_modes': [m for m in analysis.get('failure_modes', []) if m.get('id') not in cascade['failure_modes']],
+        'analysis_results': [r for position, r in enumerate(analysis.get('analysis_results', []))
+                             if position not in cascade['analysis_results']]
+    }
+
+# Derived Analysis Results Functions
+def build_analysis_result(failure_mode):
+    """Build the analysis result row of a failure mode from its management task"""
+    task = failure_mode.get('management_task', {})
+    return {
+        'failure_mode_id': failure_mode.get('id'),
+        'component': failure_mode.get('component', ''),
+        'failure_mode': failure_mode.get('description', ''),
+        'consequence': failure_mode.get('consequence_category', 'N/A'),
+        'task_type': task.get('task_type', ''),
+        'task_description': task.get('description', ''),
+        'frequency': task.get('description', ''),
+        'cost': task.get('cost', 0)
+    }
+
+def derive_analysis_results(failure_modes, previous_modes=None, previous_results=None):
+    """Materialise analysis_results: one row per failure mode with a task, in failure mode order
+
+    When the failure modes are a new version of previous_modes, rows of the failure modes that
+    are the same objects as before are reused from previous_results, so only changed failure
+    modes are rebuilt. Without a previous version every row is built.
+    """
+    previous_rows = {}
+    if previous_modes is not None and previous_results is not None:
+        unchanged_modes = {id(mode) for mode in previous_modes}
+        previous_rows = {result.get('failure_mode_id'): result for result in previous_results}
+    else:
+        unchanged_modes = set()
+
+    results = []
+    for mode in failure_modes:
+        if not mode.get('management_task'):
+            continue
+        row = previous_rows.get(mode.get('id')) if id(mode) in unchanged_modes else None
+        results.append(row if row is not None else build_analysis_result(mode))
+
+    if previous_results is not None and len(results) == len(previous_results) and all(
+            new is old for new, old in zip(results, previous_results)):
+        return previous_results
+    return results
+
+# Integrity Check Functions
+def check_analysis_integrity(analysis):
+    """List the integrity issues of one asset's analysis
+
+    Each issue is a dict with 'type', 'id' and 'message'. Orphans are records whose parent does
+    not exist; stale results belong to a failure mode without a task; duplicates are repeated
+    result rows for the same failure mode or repeated ids.
+    """
+    issues = []
+    function_ids = set()
+    for function in analysis.get('functions', []):
+        if function.get('id') in function_ids:
+            issues.append({'type': 'duplicate_id', 'id': function.get('id'),
+                           'message': f"Function id {function.get('id')} is used more than once"})
+        function_ids.add(function.get('id'))
+
+    failure_ids = set()
+    for failure in analysis.get('functional_failures', []):
+        if failure.get('id') in failure_ids:
+            issues.append({'type': 'duplicate_id', 'id': failure.get('id'),
+                           'message': f"Functional failure id {failure.get('id')} is used more than once"})
+        failure_ids.add(failure.get('id'))
+        if failure.get('function_id') not in function_ids:
+            issues.append({'type': 'orphan_functional_failure', 'id': failure.get('id'),
+                           'message': f"Functional failure {failure.get('id')} refers to missing function {failure.get('function_id')}"})
+
+    mode_ids = set()
+    modes_with_tasks = set()
+    for mode in analysis.get('failure_modes', []):
+        if mode.get('id') in mode_ids:
+            issues.append({'type': 'duplicate_id', 'id': mode.get('id'),
+                           'message': f"Failure mode id {mode.get('id')} is used more than once"})
+        mode_ids.add(mode.get('id'))
+        if mode.get('management_task'):
+            modes_with_tasks.add(mode.get('id'))
+        if mode.get('functional_failure_id') not in failure_ids:
+            issues.append({'type': 'orphan_failure_mode', 'id': mode.get('id'),
+                           'message': f"Failure mode {mode.get('id')} refers to missing functional failure {mode.get('functional_failure_id')}"})
+
+    seen_results = set()
+    for result in analysis.get('analysis_results', []):
+        mode_id = result.get('failure_mode_id')
+        if mode_id not in mode_ids:
+            issues.append({'type': 'orphan_result', 'id': mode_id,
+                           'message': f"Analysis result refers to missing failure mode {mode_id}"})
+        elif mode_id not in modes_with_tasks:
+            issues.append({'type': 'stale_result', 'id': mode_id,
+                           'message': f"Analysis result for {mode_id}, which has no task"})
+        elif mode_id in seen_results:
+            issues.append({'type': 'duplicate_result', 'id': mode_id,
+                           'message': f"Duplicate analysis result for {mode_id}"})
+        seen_results.add(mode_id)
+    return issues
+
+def repair_analysis(analysis):
+    """Return a copy of one asset's analysis with orphans, stale and duplicate results removed
+
+    Orphans are removed with everything below them and the analysis results are rebuilt from the
+    remaining failure modes' tasks. Duplicate ids are reported, not repaired.
+    """
+    repaired = {key: list(analysis.get(key, [])) for key in ANALYSIS_KEYS}
+
+    function_ids = {f.get('id') for f in repaired['functions']}
+    repaired['functional_failures'] = [f for f in repaired['functional_failures'] if f.get('function_id') in function_ids]
+    failure_ids = {f.get('id') for f in repaired['functional_failures']}
+    repaired['failure_modes'] = [m for m in repaired['failure_modes'] if m.get('functional_failure_id') in failure_ids]
+    repaired['analysis_results'] = derive_analysis_results(repaired['failure_modes'])
+    return repaired
+
+def iter_project_analyses(project):
+    """Yield (label, analysis dict) for every asset of a project file, including legacy top-level data"""
+    for position, asset in enumerate(project.get('assets', [])):
+        yield f"Asset {position + 1}: {asset.get('asset_name', '')}", asset
+    if any(project.get(key) for key in ANALYSIS_KEYS):
+        yield "Legacy single-asset data", project
+
+def check_project_integrity(project):
+    """Check every asset of a project file; returns a list of (label, issues) for assets with issues"""
+    report = []
+    for label, analysis in iter_project_analyses(project):
+        issues = check_analysis_integrity(analysis)
+        if issues:
+            report.append((label, issues))
+    return report
+
+def repair_project(project):
+    """Return a copy of a project file with every asset's analysis repaired"""
+    repaired = dict(project)
+    if 'assets' in project:
+        repaired['assets'] = [dict(asset, **repair_analysis(asset)) for asset in project['assets']]
+    if any(project.get(key) for key in ANALYSIS_KEYS):
+        repaired.update(repair_analysis(project))
+    return repaired
+
+def main(argv=None):
+    """Check, and optionally repair, the referential integrity of a project file"""
+    parser = argparse.ArgumentParser(description="Check the referential integrity of an exported RCM project file")
+    parser.add_argument('project_file', help="Exported project JSON file")
+    parser.add_argument('--repair', action='store_true', help="Remove orphaned, stale and duplicate records")
+    parser.add_argument('-o', '--output', help="Where to write the repaired project (default: overwrite the input)")
+    args = parser.parse_args(argv)
+
+    with open(args.project_file, 'r') as f:
+        project = json.load(f)
+
+    report = check_project_integrity(project)
+    for label, issues in report:
+        print(f"{label}: {len(issues)} issue(s)")
+        for issue in issues:
+            print(f"  - {issue['message']}")
+    if not report:
+        print("No integrity issues found.")
+        return 0
+
+    if args.repair:
+        repaired = repair_project(project)
+        output_path = args.output or args.project_file
+        with open(output_path, 'w') as f:
+            json.dump(repaired, f, indent=2)
+        remaining = sum(len(issues) for _, issues in check_project_integrity(repaired))
+        print(f"Repaired project written to {output_path} ({remaining} issue(s) remaining)")
+        return 0
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
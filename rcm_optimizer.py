@@ -0,0 +1,174 @@
+"""Budget-constrained selection of maintenance tasks
+
+When the maintenance budget is smaller than the total cost of the tasks, choose which tasks to
+fund so that the most risk (or avoided failure cost) is addressed within the budget and an
+optional limit on annual crew hours. Two methods are provided: a greedy selection by value per
+unit of resource, and a 0/1 knapsack solved by dynamic programming over the budget. The knapsack
+also gives the efficient frontier: the best value reachable at every budget.
+"""
+import numpy as np
+
+# The knapsack is solved over at most this many budget steps. Task costs are rounded up to whole
+# steps, so a selection never exceeds the budget; with whole-dollar costs and a budget of at most
+# this many dollars the solution is exact.
+MAX_BUDGET_STEPS = 20000
+# Budget steps of the efficient frontier and of the crew-hour multiplier search
+FRONTIER_STEPS = 2000
+LAGRANGE_ITERATIONS = 12
+
+OBJECTIVES = {'risk': "Risk addressed (risk score)", 'failure_cost': "Avoided failure cost ($)"}
+
+# Candidate Functions
+def task_candidates(assets):
+    """Every failure mode with a task, as arrays for the optimiser
+
+    Returns a dict of arrays: 'cost' (annual task cost), 'hours' (annual crew hours), 'risk'
+    (risk addressed: the risk score minus the post-task score where one is assessed, otherwise
+    the whole risk score), 'failure_cost', 'asset_index' and 'mode_position'.
+    """
+    columns = {key: [] for key in ('cost', 'hours', 'risk', 'failure_cost', 'asset_index', 'mode_position')}
+    for asset_position, asset in enumerate(assets):
+        for mode_position, mode in enumerate(asset.get('failure_modes', [])):
+            task = mode.get('management_task')
+            if not task:
+                continue
+            score = (mode.get('risk_assessment') or {}).get('risk_score') or 0
+            post_score = (task.get('post_risk_assessment') or {}).get('risk_score')
+            columns['cost'].append(task.get('cost', 0) or 0)
+            columns['hours'].append(task.get('crew_hours', 0) or 0)
+            columns['risk'].append(max(score - post_score, 0) if post_score is not None else score)
+            columns['failure_cost'].append(task.get('failure_cost', 0) or 0)
+            columns['asset_index'].append(asset_position)
+            columns['mode_position'].append(mode_position)
+    return {key: np.array(values, dtype=np.int64 if key in ('asset_index', 'mode_position') else np.float64)
+            for key, values in columns.items()}
+
+def _selection_result(selected, values, costs, hours, method, exact):
+    """Totals of a selection"""
+    return {
+        'selected': selected,
+        'value': float(values[selected].sum()),
+        'cost': float(costs[selected].sum()),
+        'hours': float(hours[selected].sum()),
+        'method': method,
+        'exact': exact
+    }
+
+# Greedy Functions
+def _fill_greedy(selected, values, costs, hours, budget, hours_limit):
+    """Add unselected tasks by value per unit of resource while they fit; returns the new selection"""
+    selected = selected.copy()
+    weight = costs / budget if budget > 0 else np.where(costs > 0, np.inf, 0.0)
+    if hours_limit:
+        weight = weight + hours / hours_limit
+    with np.errstate(divide='ignore', invalid='ignore'):
+        density = np.where(weight > 0, values / np.where(weight > 0, weight, 1), np.inf)
+    spent = costs[selected].sum()
+    used = hours[selected].sum()
+    for position in np.lexsort((costs, -density)):
+        if selected[position] or values[position] <= 0:
+            continue
+        if spent + costs[position] <= budget and (not hours_limit or used + hours[position] <= hours_limit):
+            selected[position] = True
+            spent += costs[position]
+            used += hours[position]
+    return selected
+
+def greedy_selection(values, costs, hours, budget, hours_limit=None):
+    """Fund tasks in order of value per unit of budget (and crew hours), skipping tasks that do not fit"""
+    selected = _fill_greedy(np.zeros(len(values), dtype=bool), values, costs, hours, budget, hours_limit)
+    return _selection_result(selected, values, costs, hours, 'greedy', False)
+
+# Knapsack Functions
+def _knapsack(values, weights, capacity, keep=False):
+    """0/1 knapsack over integer weights: best value at every capacity, and the packed take-bits per task"""
+    best = np.zeros(capacity + 1)
+    take = np.zeros((len(values), (capacity + 8) // 8), dtype=np.uint8) if keep else None
+    for position in np.flatnonzero((values > 0) & (weights <= capacity)):
+        weight = weights[position]
+        if weight == 0:
+            best += values[position]
+            if keep:
+                take[position] = 0xFF
+            continue
+        candidate = best[:-weight] + values[position]
+        improved = candidate > best[weight:]
+        best[weight:] = np.where(improved, candidate, best[weight:])
+        if keep:
+            bits = np.zeros(capacity + 1, dtype=bool)
+            bits[weight:] = improved
+            take[position] = np.packbits(bits)
+    return best, take
+
+def _knapsack_selection(values, weights, capacity):
+    """Tasks of the best knapsack at a capacity"""
+    _, take = _knapsack(values, weights, capacity, keep=True)
+    selected = np.zeros(len(values), dtype=bool)
+    remaining = capacity
+    for position in range(len(values) - 1, -1, -1):
+        if take[position, remaining >> 3] >> (7 - (remaining & 7)) & 1:
+            selected[position] = True
+            remaining -= weights[position]
+    return selected
+
+def _budget_steps(costs, budget, max_steps):
+    """Step size, integer task weights (costs rounded up to steps) and the capacity of a budget"""
+    step = max(1.0, budget / max_steps)
+    weights = np.ceil(costs / step - 1e-9).astype(np.int64)
+    return step, np.maximum(weights, 0), int(budget // step)
+
+def knapsack_selection(values, costs, hours, budget, hours_limit=None):
+    """Fund the tasks that maximise the total value within the budget, by dynamic programming
+
+    The crew hours limit is handled with a Lagrange multiplier: task values are reduced by a
+    price per crew hour, found by bisection, until the best selection fits the hours. Any budget
+    left over by the rounding of costs to steps is filled greedily, and the greedy selection is
+    returned instead if it is better. The result is exact ('exact': True) when costs are whole
+    dollars, the budget is at most MAX_BUDGET_STEPS dollars and the hours limit does not bind.
+    """
+    selected = values > 0
+    if costs[selected].sum() <= budget and (not hours_limit or hours[selected].sum() <= hours_limit):
+        return _selection_result(selected, values, costs, hours, 'dynamic programming', True)
+
+    step, weights, capacity = _budget_steps(costs, budget, MAX_BUDGET_STEPS)
+    selected = _knapsack_selection(values, weights, capacity)
+    exact = step == 1.0 and bool(np.all(costs == np.round(costs)))
+
+    if hours_limit and hours[selected].sum() > hours_limit:
+        exact = False
+        with np.errstate(divide='ignore', invalid='ignore'):
+            price_high = float(np.max(np.where(hours > 0, values / np.where(hours > 0, hours, 1), 0), initial=0))
+        price_low = 0.0
+        _, coarse_weights, coarse_capacity = _budget_steps(costs, budget, FRONTIER_STEPS)
+        for _ in range(LAGRANGE_ITERATIONS):
+            price = (price_low + price_high) / 2
+            trial = _knapsack_selection(values - price * hours, coarse_weights, coarse_capacity)
+            if hours[trial].sum() <= hours_limit:
+                price_high = price
+            else:
+                price_low = price
+        selected = _knapsack_selection(values - price_high * hours, weights, capacity)
+        # Drop the tasks with the least value per crew hour until the selection fits
+        for position in sorted(np.flatnonzero(selected), key=lambda position: values[position] / max(hours[position], 1e-9)):
+            if hours[selected].sum() <= hours_limit:
+                break
+            if hours[position] > 0:
+                selected[position] = False
+
+    selected = _fill_greedy(selected, values, costs, hours, budget, hours_limit)
+    result = _selection_result(selected, values, costs, hours, 'dynamic programming', exact)
+    greedy = greedy_selection(values, costs, hours, budget, hours_limit)
+    return greedy if greedy['value'] > result['value'] else result
+
+def efficient_frontier(values, costs, points=FRONTIER_STEPS):
+    """Best value reachable at budgets from 0 to the total task cost (crew hours not limited)
+
+    Returns (budgets, values) arrays. Costs are rounded up to the frontier's budget steps, so the
+    values are a slightly conservative estimate of the exact frontier.
+    """
+    total_cost = float(costs[values > 0].sum())
+    if total_cost <= 0:
+        return np.zeros(1), np.array([values[values > 0].sum()])
+    step, weights, capacity = _budget_steps(costs, total_cost, points)
+    best, _ = _knapsack(values, weights, capacity)
+    return np.arange(capacity + 1) * step, best
@@ -0,0 +1,541 @@
+"""PDF reports for FMECA & RCM projects
+
+Project and asset reports (summary metrics, risk matrix, FMECA table and task schedule) are
+written as PDF files in pure Python, using the standard Helvetica fonts that every PDF viewer
+provides, so no font files or third-party libraries are needed. Each asset is a section of
+pages; the sections of a project report are laid out in parallel in a process pool and pages
+are written to the output as soon as their section is finished.
+
+    python rcm_pdf.py project.json -o report.pdf
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+
+from rcm_data import (DEFAULT_RISK_MODERATE_THRESHOLD, DEFAULT_RISK_HIGH_THRESHOLD, CONSEQUENCE_RATINGS, LIKELIHOOD_RATINGS,
+                      classify_risk, parse_project_data)
+
+# A4 landscape, in points
+PAGE_WIDTH = 842
+PAGE_HEIGHT = 595
+MARGIN = 36
+CONTENT_WIDTH = PAGE_WIDTH - 2 * MARGIN
+
+# Projects with fewer assets are laid out in this process; starting a pool costs more than it saves
+PARALLEL_MIN_ASSETS = 8
+
+# Risk matrix colours used in the app (see the risk matrix on the Risk Assessment step)
+RISK_LEVEL_COLOURS = {'High': (1.0, 0.42, 0.42), 'Moderate': (1.0, 0.647, 0.0), 'Low': (0.565, 0.933, 0.565)}
+HEADER_COLOUR = (0.122, 0.306, 0.471)
+GRID_COLOUR = (0.75, 0.75, 0.75)
+MUTED_COLOUR = (0.4, 0.4, 0.4)
+
+# Helvetica and Helvetica-Bold glyph widths (1/1000 em) for the characters ' ' to '~'
+HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584)
+HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584)
+DEFAULT_GLYPH_WIDTH = 556
+
+# Text Functions
+def clean_text(value):
+    """Text of a value as it can be drawn: one line, WinAnsi characters only (others become '?')"""
+    text = '' if value is None else str(value)
+    text = ' '.join(text.split())
+    return text.encode('cp1252', 'replace').decode('cp1252')
+
+def text_width(text, size, bold=False):
+    """Width of a line of text in points"""
+    widths = HELVETICA_BOLD_WIDTHS if bold else HELVETICA_WIDTHS
+    total = 0
+    for char in text:
+        code = ord(char) - 32
+        total += widths[code] if 0 <= code < len(widths) else DEFAULT_GLYPH_WIDTH
+    return total * size / 1000
+
+def truncate_text(text, width, size, bold=False):
+    """Shorten a line of text with '...' so that it fits a width"""
+    if text_width(text, size, bold) <= width:
+        return text
+    while text and text_width(text + '...', size, bold) > width:
+        text = text[:-1]
+    return text + '...'
+
+def wrap_text(value, width, size, bold=False, max_lines=None):
+    """Word-wrap text to a width; words longer than a line are split. Returns a list of lines"""
+    lines = []
+    line = ''
+    for word in clean_text(value).split(' '):
+        candidate = f"{line} {word}" if line else word
+        if text_width(candidate, size, bold) <= width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        while text_width(word, size, bold) > width and len(word) > 1:
+            cut = len(word) - 1
+            while cut > 1 and text_width(word[:cut], size, bold) > width:
+                cut -= 1
+            lines.append(word[:cut])
+            word = word[cut:]
+        line = word
+    if line or not lines:
+        lines.append(line)
+    if max_lines and len(lines) > max_lines:
+        lines = lines[:max_lines]
+        lines[-1] = truncate_text(lines[-1] + '...', width, size, bold)
+    return lines
+
+def _pdf_string(text):
+    """A PDF string literal of clean text"""
+    data = text.encode('cp1252', 'replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+def _number(value):
+    """A number as written in a content stream"""
+    return f"{value:.2f}".rstrip('0').rstrip('.')
+
+def _colour(colour):
+    """Operands of an RGB colour operator"""
+    return ' '.join(_number(component) for component in colour)
+
+# Page Layout Functions
+class PdfPage:
+    """Drawing operations of one page, in top-down coordinates (y is the distance from the top edge)"""
+
+    def __init__(self):
+        self.operations = []
+
+    def rect(self, x, y, width, height, fill=None, stroke=None):
+        """A rectangle whose top left corner is at (x, y)"""
+        bottom = PAGE_HEIGHT - y - height
+        box = f"{_number(x)} {_number(bottom)} {_number(width)} {_number(height)} re"
+        if fill and stroke:
+            self.operations.append(f"q {_colour(fill)} rg {_colour(stroke)} RG 0.5 w {box} B Q".encode())
+        elif fill:
+            self.operations.append(f"q {_colour(fill)} rg {box} f Q".encode())
+        else:
+            self.operations.append(f"q {_colour(stroke or GRID_COLOUR)} RG 0.5 w {box} S Q".encode())
+
+    def line(self, x1, y1, x2, y2, colour=GRID_COLOUR):
+        """A thin line"""
+        self.operations.append(f"q {_colour(colour)} RG 0.5 w {_number(x1)} {_number(PAGE_HEIGHT - y1)} m "
+                               f"{_number(x2)} {_number(PAGE_HEIGHT - y2)} l S Q".encode())
+
+    def text(self, x, y, text, size=8, bold=False, colour=(0, 0, 0)):
+        """A line of clean text whose baseline is at (x, y)"""
+        font = '/F2' if bold else '/F1'
+        self.operations.append(f"BT {font} {_number(size)} Tf {_colour(colour)} rg "
+                               f"{_number(x)} {_number(PAGE_HEIGHT - y)} Td ".encode()
+                               + _pdf_string(text) + b" Tj ET")
+
+    def to_stream(self):
+        """The compressed content stream of the page"""
+        return zlib.compress(b'\n'.join(self.operations))
+
+class ReportLayout:
+    """Flows headings, metrics, risk matrices and tables down pages, starting new pages as needed
+
+    Finished pages are kept as compressed content streams in self.pages.
+    """
+
+    def __init__(self, title):
+        self.title = clean_text(title)
+        self.pages = []
+        self.page = None
+        self.y = 0
+
+    def new_page(self):
+        """Finish the current page and start a new one with the running title"""
+        if self.page is not None:
+            self.pages.append(self.page.to_stream())
+        self.page = PdfPage()
+        self.page.text(MARGIN, MARGIN - 8, self.title, size=8, colour=MUTED_COLOUR)
+        self.page.line(MARGIN, MARGIN - 4, PAGE_WIDTH - MARGIN, MARGIN - 4)
+        self.y = MARGIN + 10
+
+    def ensure_space(self, height):
+        """Start a new page unless height points are left on the current one"""
+        if self.page is None or self.y + height > PAGE_HEIGHT - MARGIN:
+            self.new_page()
+
+    def finish(self):
+        """Finish the last page and return the content streams of all pages"""
+        if self.page is not None:
+            self.pages.append(self.page.to_stream())
+            self.page = None
+        return self.pages
+
+    def heading(self, text, size=12):
+        """A bold heading, kept on the same page as the first 60 points below it"""
+        self.ensure_space(size + 66)
+        self.y += size
+        self.page.text(MARGIN, self.y, truncate_text(clean_text(text), CONTENT_WIDTH, size, True), size=size, bold=True)
+        self.y += 8
+
+    def key_values(self, pairs):
+        """'Label: value' lines"""
+        for label, value in pairs:
+            self.ensure_space(12)
+            self.y += 10
+            label = clean_text(label) + ':'
+            self.page.text(MARGIN, self.y, label, size=9, bold=True)
+            offset = text_width(label, 9, True) + 4
+            self.page.text(MARGIN + offset, self.y, truncate_text(clean_text(value), CONTENT_WIDTH - offset, 9), size=9)
+        self.y += 8
+
+    def metrics(self, pairs):
+        """A row of boxes with a small label and a large value"""
+        self.ensure_space(48)
+        box_width = CONTENT_WIDTH / len(pairs)
+        for position, (label, value) in enumerate(pairs):
+            x = MARGIN + position * box_width
+            self.page.rect(x + 2, self.y, box_width - 4, 40, fill=(0.96, 0.96, 0.96), stroke=GRID_COLOUR)
+            self.page.text(x + 8, self.y + 13, truncate_text(clean_text(label), box_width - 16, 8), size=8,
+                           colour=MUTED_COLOUR)
+            self.page.text(x + 8, self.y + 32, truncate_text(clean_text(value), box_width - 16, 14, True), size=14,
+                           bold=True)
+        self.y += 52
+
+    def risk_matrix(self, counts, moderate_threshold, high_threshold):
+        """The 5x5 consequence/likelihood matrix with the number of failure modes in each cell"""
+        label_width, cell_width, cell_height = 90, 80, 20
+        self.ensure_space(cell_height * 6 + 12)
+        top = self.y
+        self.page.text(MARGIN, top + 13, "Likelihood / Consequence", size=7, bold=True)
+        for column, consequence in enumerate(CONSEQUENCE_RATINGS):
+            self.page.text(MARGIN + label_width + column * cell_width + 4, top + 13, consequence, size=7, bold=True)
+        for row, likelihood in enumerate(reversed(LIKELIHOOD_RATINGS)):
+            likelihood_value = len(LIKELIHOOD_RATINGS) - row
+            y = top + (row + 1) * cell_height
+            self.page.text(MARGIN, y + 13, likelihood, size=7, bold=True)
+            for column in range(len(CONSEQUENCE_RATINGS)):
+                score = column + 1 + likelihood_value
+                level, _ = classify_risk(score, moderate_threshold, high_threshold)
+                x = MARGIN + label_width + column * cell_width
+                self.page.rect(x, y, cell_width, cell_height, fill=RISK_LEVEL_COLOURS[level], stroke=(1, 1, 1))
+                count = counts.get((column + 1, likelihood_value), 0)
+                label = f"{score} {level}" + (f" - {count}" if count else '')
+                self.page.text(x + 4, y + 13, label, size=7, bold=bool(count))
+        self.y = top + cell_height * 6 + 12
+
+    def table(self, columns, rows, risk_columns=(), size=7, max_lines=8):
+        """A table with wrapped cells; the header is repeated on every page the table continues on
+
+        columns is a list of (header, width in points). Cells of risk_columns (positions) are filled
+        with the colour of their risk level.
+        """
+        padding = 3
+        leading = size + 2
+        header_lines = [wrap_text(header, width - 2 * padding, size, True, 2) for header, width in columns]
+        header_height = max(len(lines) for lines in header_lines) * leading + 2 * padding
+
+        def draw_header():
+            x = MARGIN
+            for (_, width), lines in zip(columns, header_lines):
+                self.page.rect(x, self.y, width, header_height, fill=HEADER_COLOUR)
+                for number, line in enumerate(lines):
+                    self.page.text(x + padding, self.y + padding + size + number * leading, line, size=size, bold=True,
+                                   colour=(1, 1, 1))
+                x += width
+            self.y += header_height
+
+        header_drawn = False
+        for row in rows:
+            cells = [wrap_text(value, width - 2 * padding, size, max_lines=max_lines)
+                     for value, (_, width) in zip(row, columns)]
+            row_height = max(len(lines) for lines in cells) * leading + 2 * padding
+            if not header_drawn:
+                # The header is kept on the same page as the first row
+                self.ensure_space(header_height + row_height)
+                draw_header()
+                header_drawn = True
+            elif self.y + row_height > PAGE_HEIGHT - MARGIN:
+                self.new_page()
+                draw_header()
+            x = MARGIN
+            for position, ((_, width), lines) in enumerate(zip(columns, cells)):
+                fill = RISK_LEVEL_COLOURS.get(row[position]) if position in risk_columns else None
+                self.page.rect(x, self.y, width, row_height, fill=fill, stroke=GRID_COLOUR)
+                for number, line in enumerate(lines):
+                    self.page.text(x + padding, self.y + padding + size + number * leading, line, size=size)
+                x += width
+            self.y += row_height
+        if not header_drawn:
+            self.ensure_space(header_height)
+            draw_header()
+        self.y += 10
+
+# PDF File Functions
+class PdfWriter:
+    """Writes a PDF file object by object: only object offsets and page ids are kept in memory
+
+    Object 1 is the catalog, 2 the page tree and 3/4 the Helvetica fonts; these are written by
+    close(), after the pages that refer to them.
+    """
+
+    def __init__(self, output, title='', footer=''):
+        self.output = output
+        self.title = clean_text(title)
+        self.footer = clean_text(footer)
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 5
+        self.position = 0
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _write(self, data):
+        self.output.write(data)
+        self.position += len(data)
+
+    def _add_object(self, body, object_id=None):
+        """Write an object and return its id"""
+        if object_id is None:
+            object_id = self.next_id
+            self.next_id += 1
+        self.offsets[object_id] = self.position
+        self._write(f"{object_id} 0 obj\n".encode() + body + b"\nendobj\n")
+        return object_id
+
+    def _add_stream(self, data, compressed=True):
+        """Write a content stream object and return its id"""
+        header = f"<< /Length {len(data)}{' /Filter /FlateDecode' if compressed else ''} >>\nstream\n".encode()
+        return self._add_object(header + data + b"\nendstream")
+
+    def add_page(self, content_stream):
+        """Write a page from a compressed content stream, with the footer and page number added"""
+        page_number = len(self.page_ids) + 1
+        footer = PdfPage()
+        footer.text(MARGIN, PAGE_HEIGHT - MARGIN + 20, self.footer, size=7, colour=MUTED_COLOUR)
+        label = f"Page {page_number}"
+        footer.text(PAGE_WIDTH - MARGIN - text_width(label, 7), PAGE_HEIGHT - MARGIN + 20, label, size=7,
+                    colour=MUTED_COLOUR)
+        content_id = self._add_stream(content_stream)
+        footer_id = self._add_stream(b'\n'.join(footer.operations), compressed=False)
+        page_id = self._add_object(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> "
+            f"/Contents [{content_id} 0 R {footer_id} 0 R] >>".encode())
+        self.page_ids.append(page_id)
+
+    def close(self):
+        """Write the fonts, page tree, catalog and cross-reference table"""
+        for object_id, font in ((3, 'Helvetica'), (4, 'Helvetica-Bold')):
+            self._add_object(f"<< /Type /Font /Subtype /Type1 /BaseFont /{font} /Encoding /WinAnsiEncoding >>".encode(),
+                             object_id)
+        kids = ' '.join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._add_object(f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode(), 2)
+        self._add_object(b"<< /Type /Catalog /Pages 2 0 R >>", 1)
+        info_id = self._add_object(b"<< /Title " + _pdf_string(self.title) + b" /Producer (FMECA & RCM Analysis Tool) "
+                                   b"/CreationDate (D:" + datetime.now().strftime('%Y%m%d%H%M%S').encode() + b") >>")
+
+        xref_position = self.position
+        entries = [b"0000000000 65535 f \n"]
+        for object_id in range(1, self.next_id):
+            entries.append(f"{self.offsets[object_id]:010d} 00000 n \n".encode())
+        self._write(f"xref\n0 {self.next_id}\n".encode() + b''.join(entries))
+        self._write(f"trailer\n<< /Size {self.next_id} /Root 1 0 R /Info {info_id} 0 R >>\n"
+                    f"startxref\n{xref_position}\n%%EOF\n".encode())
+
+# Report Content Functions
+def _rating(value):
+    """The number of a rating such as '3-Occasional', or None"""
+    text = str(value or '')
+    return int(text[0]) if text[:1].isdigit() else None
+
+def _money(value):
+    """A cost as shown in reports"""
+    return f"${value or 0:,.2f}"
+
+def count_risk_matrix(assets):
+    """Number of failure modes in each (consequence, likelihood) cell of the risk matrix"""
+    counts = {}
+    for asset in assets:
+        for mode in asset.get('failure_modes', []):
+            risk = mode.get('risk_assessment') or {}
+            cell = (_rating(risk.get('consequence')), _rating(risk.get('likelihood')))
+            if None not in cell:
+                counts[cell] = counts.get(cell, 0) + 1
+    return counts
+
+def summarize_asset(asset):
+    """Report counts of an asset: failure modes, tasks, risk levels and annual task cost"""
+    modes = asset.get('failure_modes', [])
+    tasks = [mode['management_task'] for mode in modes if mode.get('management_task')]
+    levels = [(mode.get('risk_assessment') or {}).get('risk_level', '') for mode in modes]
+    return {
+        'components': len(asset.get('components', [])),
+        'functions': len(asset.get('functions', [])),
+        'functional_failures': len(asset.get('functional_failures', [])),
+        'failure_modes': len(modes),
+        'tasks': len(tasks),
+        'high': levels.count('High'),
+        'moderate': levels.count('Moderate'),
+        'low': levels.count('Low'),
+        'cost': sum(task.get('cost', 0) or 0 for task in tasks)
+    }
+
+def render_project_summary(assets, project_data, title, moderate_threshold, high_threshold):
+    """Content streams of the project summary pages: project details, totals, risk matrix and assets"""
+    layout = ReportLayout(title)
+    layout.heading("FMECA & RCM Project Report", size=18)
+    details = [
+        ("Project No.", project_data.get('project_no', '')),
+        ("Description", project_data.get('project_description', '')),
+        ("Last Modified", str(project_data.get('last_modified') or '')[:19].replace('T', ' ')),
+        ("Generated", datetime.now().strftime('%Y-%m-%d %H:%M'))
+    ]
+    layout.key_values([(label, value) for label, value in details if value])
+
+    summaries = [summarize_asset(asset) for asset in assets]
+    total = {key: sum(summary[key] for summary in summaries)
+             for key in ('functions', 'failure_modes', 'tasks', 'high', 'cost')}
+    layout.metrics([("Assets", len(assets)), ("Functions", total['functions']),
+                    ("Failure Modes", total['failure_modes']), ("Tasks", total['tasks']),
+                    ("High Risks", total['high']), ("Annual Task Cost", _money(total['cost']))])
+
+    layout.heading("Risk Matrix")
+    layout.risk_matrix(count_risk_matrix(assets), moderate_threshold, high_threshold)
+
+    layout.heading("Assets Overview")
+    layout.table(
+        [("Asset", 150), ("Class", 90), ("Type", 90), ("Location", 110), ("Failure Modes", 60), ("Tasks", 50),
+         ("High", 45), ("Moderate", 55), ("Low", 45), ("Annual Task Cost", 75)],
+        ((asset.get('asset_name', ''), asset.get('asset_class', ''), asset.get('asset_type', ''),
+          asset.get('site_location', ''), summary['failure_modes'], summary['tasks'], summary['high'],
+          summary['moderate'], summary['low'], _money(summary['cost']))
+         for asset, summary in zip(assets, summaries)))
+    return layout.finish()
+
+def render_asset_section(asset, title, moderate_threshold=DEFAULT_RISK_MODERATE_THRESHOLD,
+                         high_threshold=DEFAULT_RISK_HIGH_THRESHOLD):
+    """Content streams of an asset's pages: metrics, risk matrix, FMECA table and task schedule
+
+    Runs in a worker process for project reports, so it only takes and returns plain data.
+    """
+    layout = ReportLayout(title)
+    layout.heading(f"Asset: {asset.get('asset_name', '')}", size=16)
+    layout.key_values([
+        ("Class / Type", f"{asset.get('asset_class', '')} / {asset.get('asset_type', '')}"),
+        ("Site Location", asset.get('site_location', ''))
+    ])
+
+    summary = summarize_asset(asset)
+    layout.metrics([("Components", summary['components']), ("Functions", summary['functions']),
+                    ("Functional Failures", summary['functional_failures']),
+                    ("Failure Modes", summary['failure_modes']), ("Tasks", summary['tasks']),
+                    ("Annual Task Cost", _money(summary['cost']))])
+
+    layout.heading("Risk Matrix")
+    layout.risk_matrix(count_risk_matrix([asset]), moderate_threshold, high_threshold)
+
+    modes = asset.get('failure_modes', [])
+    if modes:
+        layout.heading("FMECA")
+        layout.table(
+            [("ID", 50), ("Component", 80), ("Failure Mode", 130), ("Operational Impact", 130),
+             ("Consequence", 100), ("C", 25), ("L", 25), ("Score", 35), ("Risk Level", 55), ("Task Type", 140)],
+            ((mode.get('id', ''), mode.get('component', ''), mode.get('description', ''),
+              (mode.get('effects') or {}).get('operational_impact', ''), mode.get('consequence_category', ''),
+              _rating((mode.get('risk_assessment') or {}).get('consequence')) or '',
+              _rating((mode.get('risk_assessment') or {}).get('likelihood')) or '',
+              (mode.get('risk_assessment') or {}).get('risk_score', ''),
+              (mode.get('risk_assessment') or {}).get('risk_level', ''),
+              (mode.get('management_task') or {}).get('task_type', ''))
+             for mode in modes),
+            risk_columns=(8,))
+
+    tasks = sorted((mode for mode in modes if mode.get('management_task')),
+                   key=lambda mode: (mode['management_task'].get('task_type', ''), str(mode.get('id', ''))))
+    if tasks:
+        layout.heading("Task Schedule")
+        layout.table(
+            [("Task Type", 130), ("Task Description", 250), ("Failure Mode", 60), ("Component", 90),
+             ("Task Cost", 70), ("Failure Cost", 70), ("Post-Task Risk", 100)],
+            ((mode['management_task'].get('task_type', ''), mode['management_task'].get('description', ''),
+              mode.get('id', ''), mode.get('component', ''), _money(mode['management_task'].get('cost')),
+              _money(mode['management_task'].get('failure_cost')),
+              (mode['management_task'].get('post_risk_assessment') or {}).get('risk_level', ''))
+             for mode in tasks),
+            risk_columns=(6,))
+    return layout.finish()
+
+def _render_asset_sections(assets, title, moderate_threshold, high_threshold, workers):
+    """Yield the pages of each asset in order, laid out in a process pool for larger projects"""
+    if workers == 1 or len(assets) < PARALLEL_MIN_ASSETS:
+        for asset in assets:
+            yield render_asset_section(asset, title, moderate_threshold, high_threshold)
+        return
+    # Spawned rather than forked: forking the threaded Streamlit server process can deadlock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        chunksize = max(1, len(assets) // (4 * (workers or os.cpu_count() or 1)))
+        yield from executor.map(render_asset_section, assets, repeat(title), repeat(moderate_threshold),
+                                repeat(high_threshold), chunksize=chunksize)
+
+def write_pdf_report(output, assets, project_data=None, moderate_threshold=DEFAULT_RISK_MODERATE_THRESHOLD,
+                     high_threshold=DEFAULT_RISK_HIGH_THRESHOLD, include_summary=True, workers=None):
+    """Write a PDF report of a list of assets to a binary file object
+
+    A project report starts with the project summary pages; every asset then gets its own section.
+    Asset sections are laid out by a process pool of workers processes (default: one per CPU)
+    when there are enough of them, and written as soon as they arrive in asset order.
+    """
+    project_data = project_data or {}
+    project_no = project_data.get('project_no', '')
+    title = f"Project {project_no} - FMECA & RCM Report" if project_no else "FMECA & RCM Report"
+    writer = PdfWriter(output, title=title, footer=f"Generated {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+    if include_summary:
+        for page in render_project_summary(assets, project_data, title, moderate_threshold, high_threshold):
+            writer.add_page(page)
+    for pages in _render_asset_sections(assets, title, moderate_threshold, high_threshold, workers):
+        for page in pages:
+            writer.add_page(page)
+    writer.close()
+
+def build_pdf_report(assets, project_data=None, moderate_threshold=DEFAULT_RISK_MODERATE_THRESHOLD,
+                     high_threshold=DEFAULT_RISK_HIGH_THRESHOLD, include_summary=True, workers=None):
+    """Build a PDF report of a list of assets and return its bytes"""
+    output = io.BytesIO()
+    write_pdf_report(output, assets, project_data, moderate_threshold, high_threshold, include_summary, workers)
+    return output.getvalue()
+
+def main(argv=None):
+    """Write the PDF report of a project file"""
+    parser = argparse.ArgumentParser(description="Write a PDF report of an exported RCM project file")
+    parser.add_argument('project_file', help="Exported project JSON file")
+    parser.add_argument('-o', '--output', help="PDF file to write (default: the project file name with .pdf)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument('--moderate-threshold', type=int, default=DEFAULT_RISK_MODERATE_THRESHOLD,
+                        help=f"Lowest risk score rated Moderate (default: {DEFAULT_RISK_MODERATE_THRESHOLD})")
+    parser.add_argument('--high-threshold', type=int, default=DEFAULT_RISK_HIGH_THRESHOLD,
+                        help=f"Lowest risk score rated High (default: {DEFAULT_RISK_HIGH_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    with open(args.project_file, 'r') as f:
+        project = parse_project_data(json.load(f))
+    output_path = args.output or os.path.splitext(args.project_file)[0] + '.pdf'
+    with open(output_path, 'wb') as f:
+        write_pdf_report(f, project.get('assets', []), project.get('project_data', {}), args.moderate_threshold,
+                         args.high_threshold, workers=args.workers)
+    print(f"Report written to {output_path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
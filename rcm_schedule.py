@@ -0,0 +1,260 @@
+"""Maintenance schedule calendar with resource levelling
+
+The CBM, FTM and FF tasks of all assets are expanded into dated occurrences over a planning
+horizon and levelled against the crew hours available per site and week. Task intervals are taken
+from the structured interval recorded in Step 7 or, for older tasks, parsed from the task text
+("Every 500 operating hours (~2 months)", "quarterly", "every 6 months").
+
+Occurrences are generated and levelled with NumPy: the occurrences of all tasks are one repeat of
+the task index, the weekly demand of every site is one bincount, and the backlog carried from week
+to week follows the Lindley recursion, which is a cumulative sum and a running minimum. Work is
+done first-in-first-out by due week, higher risk first within a week, and never before it is due.
+Since work is levelled by the week, tasks repeated more often than weekly (daily inspections) have
+one occurrence per week that carries all of that week's repeats.
+"""
+import re
+from datetime import date
+
+import numpy as np
+
+SCHEDULED_TASK_TYPES = ('CBM', 'FTM', 'FF')
+UNIT_DAYS = {'hours': 1 / 24, 'days': 1.0, 'weeks': 7.0, 'months': 365.25 / 12, 'years': 365.25}
+HOURS_PER_WEEK = 168.0
+DEFAULT_HORIZON_YEARS = 10
+DEFAULT_TASK_HOURS = 2.0
+# Guard against expanding sub-daily intervals of thousands of tasks over many years
+MAX_OCCURRENCES = 5000000
+
+# Interval Parsing Functions
+_UNIT_PATTERN = (r"(operating\s+hours?|operating\s+hrs?|op\.?\s*hrs?|running\s+hours?|run\s+hours?|"
+                 r"hours?|hrs?|days?|weeks?|months?|years?|yrs?|cycles?)")
+_EVERY_NUMBER = re.compile(r"\b(?:every|each)\s+(\d+(?:\.\d+)?)\s*" + _UNIT_PATTERN + r"\b", re.IGNORECASE)
+_EVERY_UNIT = re.compile(r"\b(?:every|each)\s+(other\s+)?(hour|day|week|month|year)\b", re.IGNORECASE)
+_NUMBER_LY = re.compile(r"\b(\d+(?:\.\d+)?)[\s-]*(hour|day|week|month|year)ly\b", re.IGNORECASE)
+_WORDS = re.compile(r"\b(hourly|daily|weekly|fortnightly|monthly|quarterly|half[\s-]yearly|six[\s-]monthly|"
+                    r"biannually|semi[\s-]annually|annually|yearly|annual)\b", re.IGNORECASE)
+_WORD_INTERVALS = {
+    'hourly': (1.0, 'hours'), 'daily': (1.0, 'days'), 'weekly': (1.0, 'weeks'), 'fortnightly': (2.0, 'weeks'),
+    'monthly': (1.0, 'months'), 'quarterly': (3.0, 'months'), 'halfyearly': (6.0, 'months'),
+    'sixmonthly': (6.0, 'months'), 'biannually': (6.0, 'months'), 'semiannually': (6.0, 'months'),
+    'annually': (1.0, 'years'), 'yearly': (1.0, 'years'), 'annual': (1.0, 'years')
+}
+
+def normalise_unit(unit):
+    """Canonical interval unit ('hours', 'operating hours', 'days', 'weeks', 'months', 'years', 'cycles')"""
+    unit = re.sub(r"\s+", " ", unit.strip().lower())
+    if unit.startswith(('operating', 'op', 'running', 'run')):
+        return 'operating hours'
+    for canonical in ('hours', 'days', 'weeks', 'months', 'years', 'cycles'):
+        if unit.startswith(canonical[:-1]):
+            return canonical
+    if unit.startswith(('hr', 'yr')):
+        return 'hours' if unit.startswith('hr') else 'years'
+    return unit
+
+def parse_interval(text):
+    """The first interval mentioned in a task text, as (value, unit), or None
+
+    Understands "every 500 operating hours", "each 2 weeks", "every other month", "6-monthly" and
+    words such as daily, quarterly and annually.
+    """
+    if not text:
+        return None
+    found = []
+    for match in _EVERY_NUMBER.finditer(text):
+        found.append((match.start(), float(match.group(1)), normalise_unit(match.group(2))))
+    for match in _EVERY_UNIT.finditer(text):
+        found.append((match.start(), 2.0 if match.group(1) else 1.0, normalise_unit(match.group(2))))
+    for match in _NUMBER_LY.finditer(text):
+        found.append((match.start(), float(match.group(1)), normalise_unit(match.group(2))))
+    for match in _WORDS.finditer(text):
+        value, unit = _WORD_INTERVALS[re.sub(r"[\s-]", "", match.group(1).lower())]
+        found.append((match.start(), value, unit))
+    if not found:
+        return None
+    _, value, unit = min(found, key=lambda item: item[0])
+    return value, unit
+
+def task_interval(task):
+    """Interval of a task as (value, unit): the structured interval if recorded, else parsed from its description"""
+    interval = task.get('interval')
+    if interval and interval.get('value'):
+        return float(interval['value']), normalise_unit(interval.get('unit', 'days'))
+    return parse_interval(task.get('description', ''))
+
+def interval_days(value, unit, operating_hours_per_week=HOURS_PER_WEEK):
+    """Calendar days of an interval, or None when it cannot be converted (cycles, zero length)"""
+    if not value or value <= 0:
+        return None
+    if unit == 'operating hours':
+        return value * 7.0 / operating_hours_per_week if operating_hours_per_week > 0 else None
+    days_per_unit = UNIT_DAYS.get(unit)
+    return value * days_per_unit if days_per_unit else None
+
+# Task Collection Functions
+def collect_scheduled_tasks(assets, operating_hours_per_week=HOURS_PER_WEEK, default_task_hours=DEFAULT_TASK_HOURS):
+    """The recurring tasks of all assets as arrays, and the tasks that cannot be scheduled
+
+    Returns a dict with 'interval_days' (at least a week), 'repeats' (times the task is done per
+    occurrence: more than one for tasks repeated more often than weekly), 'hours' (crew hours per
+    occurrence: the task's annual crew hours spread over the year, else default_task_hours per
+    repeat), 'risk_score', 'site' (index into 'sites'), 'asset_index', 'mode_position' and
+    'unscheduled' (a list of (asset_index, mode_position, reason)).
+    """
+    columns = {key: [] for key in ('interval_days', 'repeats', 'hours', 'risk_score', 'site', 'asset_index',
+                                   'mode_position')}
+    sites = {}
+    unscheduled = []
+    for asset_position, asset in enumerate(assets):
+        site = asset.get('site_location', '') or 'Unassigned'
+        for mode_position, mode in enumerate(asset.get('failure_modes', [])):
+            task = mode.get('management_task')
+            if not task or not any(task_type in task.get('task_type', '') for task_type in SCHEDULED_TASK_TYPES):
+                continue
+            interval = task_interval(task)
+            if interval is None:
+                unscheduled.append((asset_position, mode_position, "No interval found in the task"))
+                continue
+            days = interval_days(*interval, operating_hours_per_week)
+            if days is None:
+                unscheduled.append((asset_position, mode_position,
+                                    f"Interval of {interval[0]:g} {interval[1]} cannot be converted to calendar time"))
+                continue
+            crew_hours = task.get('crew_hours', 0) or 0
+            repeats = max(UNIT_DAYS['weeks'] / days, 1.0)
+            days *= repeats
+            columns['interval_days'].append(days)
+            columns['repeats'].append(repeats)
+            columns['hours'].append(crew_hours * days / UNIT_DAYS['years'] if crew_hours else default_task_hours * repeats)
+            columns['risk_score'].append((mode.get('risk_assessment') or {}).get('risk_score') or 0)
+            columns['site'].append(sites.setdefault(site, len(sites)))
+            columns['asset_index'].append(asset_position)
+            columns['mode_position'].append(mode_position)
+    tasks = {key: np.array(values, dtype=np.float64 if key in ('interval_days', 'repeats', 'hours') else np.int64)
+             for key, values in columns.items()}
+    tasks['sites'] = list(sites)
+    tasks['unscheduled'] = unscheduled
+    return tasks
+
+# Occurrence Functions
+def expand_occurrences(interval_days_array, horizon_days):
+    """Every occurrence of every task within the horizon: (task index, due day) arrays
+
+    The first occurrence of a task is one interval after the start of the horizon.
+    """
+    counts = np.floor(horizon_days / interval_days_array + 1e-9).astype(np.int64)
+    total = int(counts.sum())
+    if total > MAX_OCCURRENCES:
+        raise ValueError(f"The schedule would have {total:,} occurrences (limit {MAX_OCCURRENCES:,}); "
+                         f"shorten the horizon or check the shortest task intervals")
+    task_index = np.repeat(np.arange(len(counts)), counts)
+    occurrence = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    return task_index, occurrence * interval_days_array[task_index]
+
+def level_occurrences(site, due_week, hours, priority, capacity, weeks):
+    """Level occurrences against the weekly crew hours of each site
+
+    Occurrences are worked first-in-first-out by due week, higher priority first within a week;
+    an occurrence is never worked before its due week. capacity holds the crew hours per week of
+    each site (np.inf for no limit). Returns (scheduled week per occurrence, weekly demand, weekly
+    scheduled hours, backlog at the end of each week), the weekly arrays shaped (sites, weeks). An
+    occurrence that is not done within the horizon has scheduled week == weeks.
+    """
+    site_count = len(capacity)
+    demand = np.bincount(site * weeks + due_week, weights=hours, minlength=site_count * weeks).reshape(site_count, weeks)
+    capacity = np.where(np.isfinite(capacity), capacity, demand.sum(axis=1) + 1.0)
+    # Lindley recursion: backlog[w] = max(0, backlog[w-1] + demand[w] - capacity)
+    excess = np.cumsum(demand - capacity[:, None], axis=1)
+    backlog = excess - np.minimum(np.minimum.accumulate(excess, axis=1), 0)
+    done = np.cumsum(demand, axis=1) - backlog
+    scheduled_hours = np.diff(done, axis=1, prepend=0)
+
+    order = np.lexsort((-priority, due_week, site))
+    cumulative = np.cumsum(hours[order])
+    site_sorted = site[order]
+    site_start = np.searchsorted(site_sorted, np.arange(site_count))
+    cumulative_before = np.concatenate([[0.0], cumulative])[site_start]
+    within_site = cumulative - cumulative_before[site_sorted]
+    # Offset each site's cumulative done hours so that one searchsorted covers all sites
+    offset = (demand.sum() + 1.0) * np.arange(site_count)
+    done_flat = (done + offset[:, None]).ravel()
+    tolerance = 1e-9 * max(float(demand.sum()), 1.0)
+    position = np.searchsorted(done_flat, within_site + offset[site_sorted] - tolerance)
+    scheduled_week = np.empty(len(order), dtype=np.int64)
+    scheduled_week[order] = np.minimum(position - site_sorted * weeks, weeks)
+    return scheduled_week, demand, scheduled_hours, backlog
+
+def build_schedule(assets, start_date, horizon_years=DEFAULT_HORIZON_YEARS, capacity_by_site=None,
+                   default_capacity=np.inf, operating_hours_per_week=HOURS_PER_WEEK,
+                   default_task_hours=DEFAULT_TASK_HOURS):
+    """Maintenance calendar of the recurring tasks of all assets, levelled per site and week
+
+    start_date is a date; capacity_by_site maps site names to crew hours per week,
+    other sites get default_capacity. Returns a dict with the task arrays (see
+    collect_scheduled_tasks), the occurrence arrays 'task_index', 'due_date', 'due_week',
+    'scheduled_week', 'occurrence_hours', the weekly arrays 'week_start', 'demand',
+    'scheduled_hours', 'backlog', 'capacity' and the 'weeks' of the horizon.
+    """
+    start = np.datetime64(start_date, 'D')
+    end_year = start_date.year + horizon_years
+    end_date = date(end_year, start_date.month, min(start_date.day, 28 if start_date.month == 2 else 31))
+    horizon_days = (end_date - start_date).days
+    weeks = (horizon_days + 6) // 7
+    tasks = collect_scheduled_tasks(assets, operating_hours_per_week, default_task_hours)
+    capacity_by_site = capacity_by_site or {}
+    capacity = np.array([capacity_by_site.get(site, default_capacity) for site in tasks['sites']], dtype=np.float64)
+
+    task_index, due_day = expand_occurrences(tasks['interval_days'], horizon_days)
+    due_day = np.floor(due_day).astype(np.int64)
+    due_week = due_day // 7
+    keep = due_week < weeks
+    task_index, due_day, due_week = task_index[keep], due_day[keep], due_week[keep]
+    occurrence_hours = tasks['hours'][task_index]
+    scheduled_week, demand, scheduled_hours, backlog = level_occurrences(
+        tasks['site'][task_index], due_week, occurrence_hours, tasks['risk_score'][task_index], capacity, weeks)
+
+    return dict(tasks, task_index=task_index, due_date=start + due_day, due_week=due_week,
+                scheduled_week=scheduled_week, occurrence_hours=occurrence_hours,
+                week_start=start + 7 * np.arange(weeks), demand=demand, scheduled_hours=scheduled_hours,
+                backlog=backlog, capacity=capacity, weeks=weeks)
+
+# Summary Functions
+def schedule_summary(schedule):
+    """Totals of a levelled schedule: occurrences, crew hours, deferred occurrences and backlog"""
+    deferred = schedule['scheduled_week'] - schedule['due_week']
+    beyond = schedule['scheduled_week'] >= schedule['weeks']
+    return {
+        'tasks': len(schedule['interval_days']),
+        'occurrences': len(schedule['task_index']),
+        'hours': float(schedule['occurrence_hours'].sum()),
+        'deferred': int(np.count_nonzero(deferred > 0)),
+        'max_deferral_weeks': int(deferred[~beyond].max(initial=0)),
+        'beyond_horizon': int(np.count_nonzero(beyond)),
+        'peak_backlog_hours': float(schedule['backlog'].max(initial=0))
+    }
+
+def calendar_rows(schedule, assets, occurrences):
+    """Calendar (Gantt) rows of the given occurrence indices, one per occurrence, in the given order"""
+    rows = []
+    week_start = schedule['week_start']
+    weeks = schedule['weeks']
+    for occurrence in occurrences:
+        task = schedule['task_index'][occurrence]
+        asset = assets[schedule['asset_index'][task]]
+        mode = asset['failure_modes'][schedule['mode_position'][task]]
+        scheduled_week = schedule['scheduled_week'][occurrence]
+        in_horizon = scheduled_week < weeks
+        rows.append({
+            'Site': schedule['sites'][schedule['site'][task]],
+            'Asset Name': asset.get('asset_name', ''),
+            'Failure Mode ID': mode.get('id', ''),
+            'Task Type': mode['management_task'].get('task_type', ''),
+            'Task': mode['management_task'].get('description', ''),
+            'Due Date': str(schedule['due_date'][occurrence]),
+            'Start': str(week_start[scheduled_week]) if in_horizon else '',
+            'Finish': str(week_start[scheduled_week] + 6) if in_horizon else '',
+            'Times': round(float(schedule['repeats'][task]), 1),
+            'Crew Hours': round(float(schedule['occurrence_hours'][occurrence]), 2),
+            'Deferred (weeks)': int(scheduled_week - schedule['due_week'][occurrence]) if in_horizon else None
+        })
+    return rows